@@ -5,41 +5,58 @@ functions.
 """
 from .code_edit import CodeEdit
 from .decoration import TextDecoration
-from .encodings import ENCODINGS_MAP, convert_to_codec_key
+from .encodings import ENCODINGS_MAP, convert_to_codec_key, decode_file
 from .manager import Manager
 from .mode import Mode
 from .panel import Panel
 from .syntax_highlighter import ColorScheme
+from .syntax_highlighter import FormatCache
 from .syntax_highlighter import PYGMENTS_STYLES
 from .syntax_highlighter import SyntaxHighlighter
 from .syntax_highlighter import TextBlockUserData
 from .utils import TextHelper, TextBlockHelper
 from .utils import get_block_symbol_data
+from .utils import get_block_bracket_depths
 from .utils import DelayJobRunner
 from .folding import FoldDetector
 from .folding import IndentFoldDetector
 from .folding import CharBasedFoldDetector
 from .folding import FoldScope
+from .folding import FoldIndex
+from .search import DocumentSearcher
+from .search import SearchResults
+from .search import WordIndex
+from .search import find_all
+from .workspace_checker import WorkspaceChecker
 
 
 __all__ = [
     'convert_to_codec_key',
+    'decode_file',
+    'find_all',
+    'get_block_bracket_depths',
     'get_block_symbol_data',
     'CharBasedFoldDetector',
     'CodeEdit',
     'ColorScheme',
     'DelayJobRunner',
+    'DocumentSearcher',
     'ENCODINGS_MAP',
     'FoldDetector',
+    'FoldIndex',
+    'FormatCache',
     'IndentFoldDetector',
     'FoldScope',
     'Manager',
     'Mode',
     'Panel',
     'PYGMENTS_STYLES',
+    'SearchResults',
     'SyntaxHighlighter',
     'TextBlockUserData',
     'TextDecoration',
     'TextHelper',
-    'TextBlockHelper'
+    'TextBlockHelper',
+    'WordIndex',
+    'WorkspaceChecker'
 ]
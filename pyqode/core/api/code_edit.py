@@ -171,6 +171,54 @@ class CodeEdit(QtWidgets.QPlainTextEdit):
                 c.show_whitespaces = value
             self.rehighlight()
 
+    @property
+    def long_line_threshold(self):
+        """
+        Number of characters above which a line is considered as a "long
+        line" (minified files, json dumps, logs,...).
+
+        Long lines only get a cheap plain highlighting and are skipped by
+        the symbol matcher, the occurrences highlighter and the fold
+        detector, which keeps the editor responsive without disabling those
+        features for the rest of the file. Set it to 0 to disable the guard.
+
+        Default is 10000.
+        """
+        return self._long_line_threshold
+
+    @long_line_threshold.setter
+    def long_line_threshold(self, value):
+        if value < 0:
+            value = 0
+        if self._long_line_threshold != value:
+            self._long_line_threshold = value
+            for c in self.clones:
+                c.long_line_threshold = value
+            self.rehighlight()
+
+    @property
+    def truncate_long_lines(self):
+        """
+        Only formats the first :attr:`long_line_threshold` characters of the
+        long lines, the rest of the line is left unformatted (with the default
+        document format).
+
+        The line is not elided: Qt still lays out and paints the whole line
+        and the text remains fully editable, selectable and copyable. This
+        only spares the format ranges of the tail.
+
+        Default is False.
+        """
+        return self._truncate_long_lines
+
+    @truncate_long_lines.setter
+    def truncate_long_lines(self, value):
+        if self._truncate_long_lines != value:
+            self._truncate_long_lines = value
+            for c in self.clones:
+                c.truncate_long_lines = value
+            self.rehighlight()
+
     @property
     def font_name(self):
         """
@@ -455,6 +503,8 @@ class CodeEdit(QtWidgets.QPlainTextEdit):
         self._whitespaces_foreground = None
         self._sel_background = None
         self._show_whitespaces = False
+        self._long_line_threshold = 10000
+        self._truncate_long_lines = False
         self._foreground = None
         self._sel_foreground = None
         self._tab_length = 4
@@ -560,6 +610,8 @@ class CodeEdit(QtWidgets.QPlainTextEdit):
         clone.tab_length = self.tab_length
         clone._save_on_focus_out = self._save_on_focus_out
         clone.show_whitespaces = self.show_whitespaces
+        clone.long_line_threshold = self.long_line_threshold
+        clone.truncate_long_lines = self.truncate_long_lines
         clone.font_name = self.font_name
         clone.font_size = self.font_size
         clone.zoom_level = self.zoom_level
@@ -605,13 +657,16 @@ class CodeEdit(QtWidgets.QPlainTextEdit):
         Show a tool tip at the specified position
 
         :param pos: Tooltip position
-        :param tooltip: Tooltip text
+        :param tooltip: Tooltip text or a callable that returns the tooltip
+            text (evaluated when the tooltip is about to be shown).
 
         :param _sender_deco: TextDecoration which is the sender of the show
             tooltip request. (for internal use only).
         """
         if _sender_deco is not None and _sender_deco not in self.decorations:
             return
+        if callable(tooltip):
+            tooltip = tooltip()
         QtWidgets.QToolTip.showText(pos, tooltip[0: 1024], self)
 
     def setPlainText(self, txt, mime_type, encoding):
@@ -632,7 +687,20 @@ class CodeEdit(QtWidgets.QPlainTextEdit):
         self._modified_lines.clear()
         import time
         t = time.time()
-        super(CodeEdit, self).setPlainText(txt)
+        sh = self.syntax_highlighter
+        bulk_folding = (sh is not None and sh.fold_detector is not None and
+                        sh.fold_detector.bulk_processing)
+        if bulk_folding:
+            # compute the fold levels of the whole document at once instead
+            # of block by block while highlighting
+            sh._bulk_folding = True
+        try:
+            super(CodeEdit, self).setPlainText(txt)
+        finally:
+            if bulk_folding:
+                sh._bulk_folding = False
+        if bulk_folding:
+            sh.fold_document()
         _logger().log(5, 'setPlainText duration: %fs' % (time.time() - t))
         self.new_text_set.emit()
         self.redoAvailable.emit(False)
@@ -1004,10 +1072,9 @@ class CodeEdit(QtWidgets.QPlainTextEdit):
         self.mouse_pressed.emit(event)
         if event.button() == QtCore.Qt.LeftButton:
             cursor = self.cursorForPosition(event.pos())
-            for sel in self.decorations:
+            for sel in self.decorations.decorations_at(cursor):
                 if sel.cursor.blockNumber() == cursor.blockNumber():
-                    if sel.contains_cursor(cursor):
-                        sel.signals.clicked.emit(sel)
+                    sel.signals.clicked.emit(sel)
         if not event.isAccepted():
             event.setAccepted(initial_state)
             super(CodeEdit, self).mousePressEvent(event)
@@ -1048,8 +1115,8 @@ class CodeEdit(QtWidgets.QPlainTextEdit):
         cursor = self.cursorForPosition(event.pos())
         self._last_mouse_pos = event.pos()
         block_found = False
-        for sel in self.decorations:
-            if sel.contains_cursor(cursor) and sel.tooltip:
+        for sel in self.decorations.decorations_at(cursor):
+            if sel.tooltip:
                 if (self._prev_tooltip_block_nbr != cursor.blockNumber() or
                         not QtWidgets.QToolTip.isVisible()):
                     pos = event.pos()
@@ -1059,7 +1126,7 @@ class CodeEdit(QtWidgets.QPlainTextEdit):
                     pos.setY(pos.y() + self.panels.margin_size(0))
                     self._tooltips_runner.request_job(
                         self.show_tooltip,
-                        self.mapToGlobal(pos), sel.tooltip[0: 1024], sel)
+                        self.mapToGlobal(pos), sel.tooltip, sel)
                     self._prev_tooltip_block_nbr = cursor.blockNumber()
                 block_found = True
                 break
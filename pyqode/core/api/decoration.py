@@ -52,7 +52,9 @@ class TextDecoration(QtWidgets.QTextEdit.ExtraSelection):
         :param draw_order: The draw order of the selection, highest values will
             appear on top of the lowest values.
         :param tooltip: An optional tooltips that will be automatically shown
-            when the mouse cursor hover the decoration.
+            when the mouse cursor hover the decoration. It can also be a
+            callable that returns the tooltip text, it will then be called
+            only when the tooltip is about to be shown.
         :param full_width: True to select the full line width.
 
         .. note:: Use the cursor selection if startPos and endPos are none.
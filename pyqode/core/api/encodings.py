@@ -3,7 +3,13 @@ This module contains the list of possible encodings, taken from
 the standard library documentation:
 https://docs.python.org/3.4/library/codecs.html#standard-encodings
 
+It also contains the functions used to detect the encoding of a file and
+decode it.
+
 """
+import codecs
+import mmap
+import os
 
 #: Encodings map, map a codec name to a an alias/language pair.#:
 ENCODINGS_MAP = {
@@ -90,10 +96,31 @@ ENCODINGS_MAP = {
     "utf_16": ("UTF-16", "Unicode"),
     "utf_16_be": ("UTF-16BE", "Unicode"),
     "utf_16_le": ("UTF-16LE", "Unicode"),
+    "utf_32": ("UTF-32", "Unicode"),
     "utf_7": ("UTF-7", "Unicode"),
-    "utf_8": ("UTF-8", "Unicode")
+    "utf_8": ("UTF-8", "Unicode"),
+    "utf_8_sig": ("UTF-8-SIG", "Unicode")
 }
 
+#: Byte order marks and the codec used to decode the text that follows them.
+#: UTF-32 marks must be tested before the UTF-16 marks (they share the same
+#: prefix).
+BOMS = [
+    (codecs.BOM_UTF32_LE, 'utf_32'),
+    (codecs.BOM_UTF32_BE, 'utf_32'),
+    (codecs.BOM_UTF8, 'utf_8_sig'),
+    (codecs.BOM_UTF16_LE, 'utf_16'),
+    (codecs.BOM_UTF16_BE, 'utf_16'),
+]
+
+#: Number of bytes decoded to test a candidate encoding before decoding the
+#: whole content.
+SAMPLE_SIZE = 64 * 1024
+
+#: Files bigger than this size (in bytes) are memory mapped instead of being
+#: read.
+MMAP_THRESHOLD = 1024 * 1024
+
 
 def convert_to_codec_key(value):
     """
@@ -146,3 +173,90 @@ def convert_to_codec_key(value):
         if converted in aliases:
             return key
     return converted
+
+
+def get_bom_encoding(data):
+    """
+    Detects the byte order mark at the start of some data.
+
+    :param data: bytes (or any object supporting slicing, e.g. a mmap)
+    :returns: the codec to use to decode the data, None if there is no
+        BOM.
+    """
+    head = data[:4]
+    for bom, encoding in BOMS:
+        if head.startswith(bom):
+            return encoding
+    return None
+
+
+def decode(data, encodings, detect_bom=True):
+    """
+    Decodes some data with the first encoding that works.
+
+    Each candidate encoding is first tested on a sample of the data
+    (:attr:`SAMPLE_SIZE`), so that a wrong encoding is usually rejected
+    without decoding the whole content.
+
+    :param data: bytes (or any object supporting the buffer protocol,
+        e.g. a mmap)
+    :param encodings: list of candidate encodings, in order of preference.
+    :param detect_bom: True to try the encoding given by a byte order mark
+        first.
+
+    :returns: (encoding, text)
+    :raises: UnicodeDecodeError if the data cannot be decoded with any of
+        the candidate encodings (the error of the first candidate is
+        raised).
+    """
+    candidates = []
+    if detect_bom:
+        encoding = get_bom_encoding(data)
+        if encoding:
+            candidates.append(encoding)
+    for encoding in encodings:
+        if encoding not in candidates:
+            candidates.append(encoding)
+    if not candidates:
+        raise ValueError('no candidate encoding')
+    sample = data[:SAMPLE_SIZE] if len(data) > SAMPLE_SIZE else None
+    error = None
+    for encoding in candidates:
+        try:
+            if sample is not None:
+                decoder = codecs.getincrementaldecoder(encoding)()
+                # final=False: the sample may end in the middle of a
+                # multibyte sequence
+                decoder.decode(sample, False)
+            return encoding, codecs.decode(data, encoding)
+        except UnicodeError as e:
+            if error is None:
+                error = e
+    raise error
+
+
+def decode_file(path, encodings, detect_bom=True):
+    """
+    Reads a file and decodes its content with the first encoding that
+    works (see :func:`decode`).
+
+    The file is read only once, big files (see :attr:`MMAP_THRESHOLD`) are
+    memory mapped.
+
+    :param path: path of the file to decode.
+    :param encodings: list of candidate encodings, in order of preference.
+    :param detect_bom: True to try the encoding given by a byte order mark
+        first.
+
+    :returns: (encoding, text)
+    :raises: UnicodeDecodeError if the content cannot be decoded with any of
+        the candidate encodings, IOError/OSError if the file cannot be read.
+    """
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size >= MMAP_THRESHOLD:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                return decode(data, encodings, detect_bom=detect_bom)
+            finally:
+                data.close()
+        return decode(f.read(), encodings, detect_bom=detect_bom)
@@ -3,9 +3,10 @@ This module contains the code folding API.
 
 """
 from __future__ import print_function
+import bisect
 import logging
 import sys
-from pyqode.core.api.utils import TextBlockHelper
+from pyqode.core.api.utils import TextBlockHelper, get_changed_blocks
 
 
 def print_tree(editor, file=sys.stdout, print_blocks=False):
@@ -79,11 +80,19 @@ class FoldDetector(object):
         if text.strip() == '':
             # blank line always have the same level as the previous line
             fold_level = prev_fold_level
+        elif (self.editor is not None and
+                0 < self.editor.long_line_threshold <
+                current_block.length() - 1):
+            # don't run the detector on huge lines (minified files,...),
+            # they are kept at the level of the previous line
+            fold_level = prev_fold_level
         else:
             fold_level = self.detect_fold_level(
                 previous_block, current_block)
             if fold_level > self.limit:
                 fold_level = self.limit
+            # same bounds as the block state (and process_document)
+            fold_level = max(0, min(fold_level, 0x3FF))
 
         prev_fold_level = TextBlockHelper.get_fold_lvl(previous_block)
 
@@ -117,6 +126,113 @@ class FoldDetector(object):
             TextBlockHelper.set_fold_trigger(prev, False)
             TextBlockHelper.set_collapsed(prev, False)
 
+    @property
+    def bulk_processing(self):
+        """
+        True if the detector can compute the fold levels of a whole document
+        from the line texts only (see :meth:`process_document`), i.e. if its
+        :meth:`detect_fold_level` is implemented on top of
+        :meth:`detect_fold_level_from_text`.
+        """
+        for klass in type(self).__mro__:
+            if klass is FoldDetector:
+                break
+            if 'detect_fold_level' in vars(klass):
+                return 'detect_fold_level_from_text' in vars(klass)
+        return False
+
+    def process_document(self, document):
+        """
+        Computes the fold levels and fold triggers of a whole document in a
+        single linear sweep over the line texts and writes the block states in
+        bulk. This is much faster than running :meth:`process_block` on each
+        block and does not require the syntax highlighter to be enabled.
+
+        The sweep follows the same rules as :meth:`process_block`.
+
+        .. note:: Only detectors that support :attr:`bulk_processing` can be
+            used.
+
+        :param document: QTextDocument to process.
+        """
+        texts = document.toPlainText().split('\n')
+        if len(texts) != document.blockCount():
+            # the plain text does not match the blocks (e.g. the text
+            # contains unicode line/paragraph separators)
+            texts = []
+            block = document.firstBlock()
+            while block.isValid():
+                texts.append(block.text())
+                block = block.next()
+        editor = self.editor
+        try:
+            threshold = editor.long_line_threshold
+        except AttributeError:
+            threshold = 0
+        nb_blocks = len(texts)
+        blank = [not t.strip() for t in texts]
+        levels = [0] * nb_blocks
+        triggers = [False] * nb_blocks
+        collapsed = [False] * nb_blocks
+        # previous non blank block (or first block), None for the first block
+        prev = None
+        for i, text in enumerate(texts):
+            prev_lvl = levels[prev] if prev is not None else 0
+            if blank[i] or 0 < threshold < len(text):
+                fold_level = prev_lvl
+            else:
+                fold_level = self.detect_fold_level_from_text(
+                    texts[prev] if prev is not None else '', prev_lvl, text)
+                if fold_level > self.limit:
+                    fold_level = self.limit
+                fold_level = max(0, min(fold_level, 0x3FF))
+            if fold_level > prev_lvl:
+                # apply on previous blank lines
+                j = i - 1
+                while j >= 0 and blank[j]:
+                    levels[j] = fold_level
+                    j -= 1
+                if j >= 0:
+                    triggers[j] = True
+            if not blank[i] and prev is not None:
+                triggers[prev] = fold_level > prev_lvl
+            levels[i] = fold_level
+            if i and blank[i - 1] and triggers[i - 1]:
+                collapsed[i] = collapsed[i - 1]
+                triggers[i - 1] = collapsed[i - 1] = False
+            if i == 0 or not blank[i]:
+                prev = i
+        # write block states
+        block = document.firstBlock()
+        i = 0
+        while block.isValid() and i < nb_blocks:
+            state = block.userState()
+            if state == -1:
+                state = 0
+            new_state = ((state & 0x7000FFFF) | levels[i] << 16 |
+                         triggers[i] << 26 | collapsed[i] << 27)
+            if new_state != state:
+                block.setUserState(new_state)
+            block = block.next()
+            i += 1
+        FoldIndex.get(document).invalidate()
+
+    def detect_fold_level_from_text(self, prev_text, prev_lvl, text):
+        """
+        Detects the fold level of a line from its text, used by
+        :meth:`process_document`.
+
+        Detectors that can work from the line texts only should implement
+        this method and implement :meth:`detect_fold_level` on top of it.
+
+        :param prev_text: text of the first previous **non-blank** line ('' if
+            this is the first line of the document)
+        :param prev_lvl: fold level of the previous non-blank line
+        :param text: text of the line to process
+        :return: Fold level
+        """
+        raise NotImplementedError
+
     def detect_fold_level(self, prev_block, block):
         """
         Detects the block fold level.
@@ -147,7 +263,9 @@ class IndentFoldDetector(FoldDetector):
         :param prev_block: previous text block
         :param block: current block to highlight
         """
-        text = block.text()
+        return self.detect_fold_level_from_text(None, None, block.text())
+
+    def detect_fold_level_from_text(self, prev_text, prev_lvl, text):
         # round down to previous indentation guide to ensure contiguous block
         # fold level evolution.
         return (len(text) - len(text.lstrip())) // self.editor.tab_length
@@ -165,18 +283,369 @@ class CharBasedFoldDetector(FoldDetector):
 
     def detect_fold_level(self, prev_block, block):
         if prev_block:
-            prev_text = prev_block.text().strip()
+            prev_text = prev_block.text()
         else:
             prev_text = ''
-        text = block.text().strip()
+        return self.detect_fold_level_from_text(
+            prev_text, TextBlockHelper.get_fold_lvl(prev_block), block.text())
+
+    def detect_fold_level_from_text(self, prev_text, prev_lvl, text):
+        prev_text = prev_text.strip()
+        text = text.strip()
         if text in self.open_chars:
-            return TextBlockHelper.get_fold_lvl(prev_block) + 1
+            return prev_lvl + 1
         if prev_text.endswith(self.open_chars) and prev_text not in \
                 self.open_chars:
-            return TextBlockHelper.get_fold_lvl(prev_block) + 1
+            return prev_lvl + 1
         if self.close_chars in prev_text:
-            return TextBlockHelper.get_fold_lvl(prev_block) - 1
-        return TextBlockHelper.get_fold_lvl(prev_block)
+            return prev_lvl - 1
+        return prev_lvl
+
+
+class FoldIndex(object):
+    """
+    Index of the fold regions of a document.
+
+    The index keeps a copy of the fold levels and fold trigger flags of every
+    block of the document along with the fold regions derived from them (for
+    each fold trigger, the line that closes its region and its parent
+    trigger). Scope queries (range, parent, children) are then answered with
+    a few list lookups and binary searches instead of walking the text
+    blocks.
+
+    The index is kept up to date incrementally: text changes are spliced in
+    from the document ``contentsChange`` signal and fold level/trigger
+    changes are reported by :class:`pyqode.core.api.TextBlockHelper`. On the
+    first query that follows a change, the regions are derived again from
+    the top level line that precedes the modified blocks, up to the first
+    trigger whose region was not affected by the change (usually the end of
+    the enclosing top level scope).
+
+    .. note:: Fold levels and fold triggers must be modified through
+        :class:`pyqode.core.api.TextBlockHelper` to keep the index in sync.
+
+    Use :meth:`FoldIndex.get` to retrieve the index of a document, there is
+    only one index per document (shared between the editor clones).
+    """
+    @classmethod
+    def get(cls, document):
+        """
+        Returns the fold index of a document, the index is created on first
+        access.
+
+        :param document: QTextDocument
+        :rtype: FoldIndex
+        """
+        try:
+            return document._fold_index
+        except AttributeError:
+            index = cls(document)
+            document._fold_index = index
+            return index
+
+    def __init__(self, document):
+        self._document = document
+        #: fold level of each block, None means the data must be read from
+        #: the document
+        self._levels = None
+        #: fold trigger flag of each block
+        self._triggers = None
+        #: blank flag of each block
+        self._blank = None
+        #: sorted line numbers of the fold triggers
+        self._trigger_lines = []
+        #: for each trigger, offset of the line that closes its region (0 if
+        #: the region is never closed). Offsets are relative to the trigger
+        #: so that they remain valid when lines are inserted before it.
+        self._closes = []
+        #: for each trigger, offset of its parent trigger (0 if none)
+        self._parents = []
+        #: range of lines whose regions must be derived again, None if the
+        #: regions are up to date
+        self._dirty = None
+        #: block changes reported while the index is out of sync with the
+        #: document, they are re-read once the text change has been spliced in
+        self._pending = set()
+        document.contentsChange.connect(self._on_contents_change)
+
+    @staticmethod
+    def _read(block):
+        state = block.userState()
+        if state == -1:
+            state = 0
+        return ((state & 0x03FF0000) >> 16, bool(state & 0x04000000),
+                block.text().strip() == '')
+
+    def _read_range(self, start, end):
+        levels, triggers, blank = [], [], []
+        block = self._document.findBlockByNumber(start)
+        while block.isValid() and block.blockNumber() <= end:
+            lvl, trigger, is_blank = self._read(block)
+            levels.append(lvl)
+            triggers.append(trigger)
+            blank.append(is_blank)
+            block = block.next()
+        return levels, triggers, blank
+
+    def invalidate(self):
+        """
+        Invalidates the whole index, the fold data will be read again from the
+        document on the next query.
+        """
+        self._levels = self._triggers = self._blank = None
+        self._pending.clear()
+        self._dirty = None
+
+    def _mark_dirty(self, start, end):
+        start = max(start, 0)
+        if self._dirty is not None:
+            start = min(start, self._dirty[0])
+            end = max(end, self._dirty[1])
+        self._dirty = (start, end)
+
+    def _set_trigger(self, nbr, trigger):
+        self._triggers[nbr] = trigger
+        lines = self._trigger_lines
+        i = bisect.bisect_left(lines, nbr)
+        found = i < len(lines) and lines[i] == nbr
+        if trigger and not found:
+            lines.insert(i, nbr)
+        elif not trigger and found:
+            del lines[i]
+
+    def _update_block(self, block):
+        nbr = block.blockNumber()
+        lvl, trigger, blank = self._read(block)
+        self._blank[nbr] = blank
+        if self._levels[nbr] != lvl or self._triggers[nbr] != trigger:
+            self._levels[nbr] = lvl
+            self._set_trigger(nbr, trigger)
+            # the scope level of the previous trigger may change too
+            self._mark_dirty(nbr - 1, nbr)
+
+    def block_changed(self, block):
+        """
+        Updates the index after the fold level or the fold trigger flag of a
+        block changed. This is called automatically by
+        :class:`pyqode.core.api.TextBlockHelper`.
+
+        :param block: the modified block
+        """
+        if self._levels is None:
+            return
+        if len(self._levels) != self._document.blockCount():
+            # the text change that created this block has not been spliced in
+            # yet (the highlighter processed the change before us).
+            self._pending.add(block.blockNumber())
+            return
+        self._update_block(block)
+
+    def _on_contents_change(self, position, removed, added):
+        if self._levels is None:
+            return
+        changed = get_changed_blocks(self._document, position, added,
+                                     len(self._levels))
+        if changed is None:
+            self.invalidate()
+            return
+        start, end, old_end = changed
+        delta = end - old_end
+        levels, triggers, blank = self._read_range(start, end)
+        span = slice(start, old_end + 1)
+        if (delta or self._levels[span] != levels or
+                self._triggers[span] != triggers or
+                self._blank[span] != blank):
+            self._levels[span] = levels
+            self._triggers[span] = triggers
+            self._blank[span] = blank
+            self._closes[span] = [0] * len(levels)
+            self._parents[span] = [0] * len(levels)
+            lines = self._trigger_lines
+            i = bisect.bisect_left(lines, start)
+            j = bisect.bisect_right(lines, old_end)
+            new_lines = [start + k for k, flag in enumerate(triggers) if flag]
+            if delta:
+                # shift the next triggers
+                lines[i:] = new_lines + [line + delta for line in lines[j:]]
+            else:
+                lines[i:j] = new_lines
+            if self._dirty is not None:
+                dirty_start, dirty_end = self._dirty
+                if dirty_start > old_end:
+                    dirty_start += delta
+                if dirty_end > old_end:
+                    dirty_end += delta
+                self._dirty = (dirty_start, min(dirty_end, len(self._levels)))
+            self._mark_dirty(start - 1, end)
+        doc = self._document
+        for nbr in self._pending:
+            block = doc.findBlockByNumber(nbr)
+            if block.isValid():
+                self._update_block(block)
+        self._pending.clear()
+
+    def _update(self):
+        nb_blocks = self._document.blockCount()
+        if self._levels is None or len(self._levels) != nb_blocks:
+            self._levels, self._triggers, self._blank = self._read_range(
+                0, nb_blocks)
+            self._trigger_lines = [
+                i for i, flag in enumerate(self._triggers) if flag]
+            self._closes = [0] * len(self._levels)
+            self._parents = [0] * len(self._levels)
+            self._pending.clear()
+            self._dirty = (0, len(self._levels))
+        if self._dirty is not None:
+            start, end = self._dirty
+            self._dirty = None
+            self._derive_regions(start, end)
+
+    def _derive_regions(self, start, end):
+        """
+        Derives the regions of the triggers that follow the last top level
+        line before ``start``, up to the first top level trigger after
+        ``end`` whose region is not affected by the changes.
+        """
+        levels, triggers = self._levels, self._triggers
+        closes, parents = self._closes, self._parents
+        nb_blocks = len(levels)
+        # the regions opened before a top level line are closed at the latest
+        # on that line (or never closed, if their ref level is -1)
+        first = min(start, nb_blocks) - 1
+        while first > 0 and levels[first]:
+            first -= 1
+        first = max(first, 0)
+        # candidate parents, as (lvl, trigger), sorted by increasing level:
+        # this is the parent chain of the last trigger before the first line
+        candidates = []
+        i = bisect.bisect_left(self._trigger_lines, first)
+        trigger = self._trigger_lines[i - 1] if i else None
+        while trigger is not None:
+            candidates.append((levels[trigger], trigger))
+            offset = parents[trigger]
+            trigger = trigger - offset if offset else None
+        candidates.reverse()
+        # open regions, as (ref_lvl, trigger) tuples. The ref levels are
+        # sorted in the stack: a nested region always has a greater (or
+        # equal) ref level than its enclosing regions.
+        opened = []
+        for i in range(first, nb_blocks):
+            lvl = levels[i]
+            while opened and opened[-1][0] >= lvl:
+                trigger = opened.pop()[1]
+                closes[trigger] = i - trigger
+            if not triggers[i]:
+                continue
+            while candidates and candidates[-1][0] >= lvl:
+                candidates.pop()
+            parent = candidates[-1][1] if candidates else None
+            if i > end and not opened and not candidates and not parents[i]:
+                # top level trigger that was already a top level trigger: the
+                # next regions are not affected by the changes
+                return
+            parents[i] = i - parent if parent is not None else 0
+            candidates.append((lvl, i))
+            # scope level == trigger level for zones set programmatically
+            # (e.g. the imports zone of pyqode.python)
+            scope_lvl = levels[i + 1] if i + 1 < nb_blocks else 0
+            ref_lvl = lvl - 1 if scope_lvl == lvl else lvl
+            closes[i] = 0
+            if ref_lvl >= 0:
+                # a region with a ref level of -1 is never closed
+                opened.append((ref_lvl, i))
+
+    def triggers(self):
+        """
+        Gets the line numbers of all the fold triggers of the document.
+
+        :returns: sorted list of line numbers
+        """
+        self._update()
+        return list(self._trigger_lines)
+
+    def scope_range(self, trigger, ignore_blank_lines=True):
+        """
+        Gets the range of the fold scope started by a fold trigger.
+
+        :param trigger: line number of the fold trigger
+        :param ignore_blank_lines: True to ignore blank lines at the end of the
+            scope.
+        :returns: tuple(int, int)
+        """
+        self._update()
+        nb_blocks = len(self._levels)
+        offset = self._closes[trigger]
+        if offset:
+            end = max(trigger + offset - 1, trigger + 1)
+        else:
+            end = nb_blocks - 1 if trigger + 1 < nb_blocks else -1
+        if ignore_blank_lines:
+            blank = self._blank
+            while end > 0 and blank[end]:
+                end -= 1
+        return trigger, end
+
+    def parent(self, trigger):
+        """
+        Gets the line number of the parent fold trigger of a fold trigger.
+
+        :param trigger: line number of the fold trigger
+        :returns: the line number of the parent trigger or None.
+        """
+        self._update()
+        if self._levels[trigger] > 0 and trigger:
+            offset = self._parents[trigger]
+            if offset:
+                return trigger - offset
+            if self._triggers[0]:
+                return 0
+        return None
+
+    def children(self, trigger):
+        """
+        Gets the line numbers of the direct child fold triggers of a fold
+        trigger.
+
+        :param trigger: line number of the fold trigger
+        :returns: list of line numbers
+        """
+        _, end = self.scope_range(trigger)
+        if trigger + 1 >= len(self._levels):
+            return []
+        levels = self._levels
+        lvl = levels[trigger + 1]
+        lines = self._trigger_lines
+        return [line for line in lines[bisect.bisect_right(lines, trigger):
+                                       bisect.bisect_right(lines, end)]
+                if levels[line] == lvl]
+
+    def parent_trigger(self, line):
+        """
+        Finds the fold trigger of the scope that contains a line.
+
+        :param line: line number
+        :returns: the line number of the fold trigger, or 0 if the line is
+            not part of any scope.
+        """
+        self._update()
+        if self._triggers[line]:
+            return line
+        levels, parents = self._levels, self._parents
+        nb_blocks = len(levels)
+        # use the level of the next non blank line
+        next_line = line
+        while next_line < nb_blocks and self._blank[next_line]:
+            next_line += 1
+        ref_lvl = levels[next_line] - 1 if next_line < nb_blocks else -1
+        # the closest trigger before the line whose level is lower than the
+        # ref level: walk up the parents of the previous trigger (a parent is
+        # the closest previous trigger with a lower level)
+        i = bisect.bisect_right(self._trigger_lines, line)
+        trigger = self._trigger_lines[i - 1] if i else None
+        while trigger is not None and levels[trigger] > ref_lvl:
+            offset = parents[trigger]
+            trigger = trigger - offset if offset else None
+        return trigger or 0
 
 
 class FoldScope(object):
@@ -237,25 +706,8 @@ class FoldScope(object):
             that is part of the fold scope).
         :returns: tuple(int, int)
         """
-        ref_lvl = self.trigger_level
-        first_line = self._trigger.blockNumber()
-        block = self._trigger.next()
-        last_line = block.blockNumber()
-        lvl = self.scope_level
-        if ref_lvl == lvl:  # for zone set programmatically such as imports
-                            # in pyqode.python
-            ref_lvl -= 1
-        while (block.isValid() and
-                TextBlockHelper.get_fold_lvl(block) > ref_lvl):
-            last_line = block.blockNumber()
-            block = block.next()
-
-        if ignore_blank_lines and last_line:
-            block = block.document().findBlockByNumber(last_line)
-            while block.blockNumber() and block.text().strip() == '':
-                block = block.previous()
-                last_line = block.blockNumber()
-        return first_line, last_line
+        return FoldIndex.get(self._trigger.document()).scope_range(
+            self._trigger.blockNumber(), ignore_blank_lines)
 
     def fold(self):
         """
@@ -297,15 +749,9 @@ class FoldScope(object):
         """
         This generator generates the list of direct child regions.
         """
-        start, end = self.get_range()
-        block = self._trigger.next()
-        ref_lvl = self.scope_level
-        while block.blockNumber() <= end and block.isValid():
-            lvl = TextBlockHelper.get_fold_lvl(block)
-            trigger = TextBlockHelper.is_fold_trigger(block)
-            if lvl == ref_lvl and trigger:
-                yield FoldScope(block)
-            block = block.next()
+        doc = self._trigger.document()
+        for line in FoldIndex.get(doc).children(self._trigger.blockNumber()):
+            yield FoldScope(doc.findBlockByNumber(line))
 
     def parent(self):
         """
@@ -313,19 +759,14 @@ class FoldScope(object):
 
         :return: FoldScope or None
         """
-        if TextBlockHelper.get_fold_lvl(self._trigger) > 0 and \
-                self._trigger.blockNumber():
-            block = self._trigger.previous()
-            ref_lvl = self.trigger_level - 1
-            while (block.blockNumber() and
-                    (not TextBlockHelper.is_fold_trigger(block) or
-                     TextBlockHelper.get_fold_lvl(block) > ref_lvl)):
-                block = block.previous()
-            try:
-                return FoldScope(block)
-            except ValueError:
-                return None
-        return None
+        doc = self._trigger.document()
+        line = FoldIndex.get(doc).parent(self._trigger.blockNumber())
+        if line is None:
+            return None
+        try:
+            return FoldScope(doc.findBlockByNumber(line))
+        except ValueError:
+            return None
 
     def text(self, max_lines=sys.maxsize):
         """
@@ -350,25 +791,11 @@ class FoldScope(object):
 
         :param block: block from which the research will start
         """
-        # if we moved up for more than n lines, just give up otherwise this
-        # would take too much time.
-        limit = 5000
-        counter = 0
-        original = block
-        if not TextBlockHelper.is_fold_trigger(block):
-            # search level of next non blank line
-            while block.text().strip() == '' and block.isValid():
-                block = block.next()
-            ref_lvl = TextBlockHelper.get_fold_lvl(block) - 1
-            block = original
-            while (block.blockNumber() and counter < limit and
-                   (not TextBlockHelper.is_fold_trigger(block) or
-                    TextBlockHelper.get_fold_lvl(block) > ref_lvl)):
-                counter += 1
-                block = block.previous()
-        if counter < limit:
+        if TextBlockHelper.is_fold_trigger(block):
             return block
-        return None
+        doc = block.document()
+        return doc.findBlockByNumber(
+            FoldIndex.get(doc).parent_trigger(block.blockNumber()))
 
     def __repr__(self):
         return 'FoldScope(start=%r, end=%d)' % self.get_range()
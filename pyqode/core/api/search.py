@@ -0,0 +1,630 @@
+# -*- coding: utf-8 -*-
+"""
+This module contains the local search engine used to find text occurrences
+in a document.
+"""
+from array import array
+import bisect
+import collections
+import re
+import sys
+import threading
+
+from pyqode.core.backend.workers import DocumentWordsProvider
+from pyqode.qt import QtGui
+
+
+if sys.maxunicode > 0xFFFF:
+    _ASTRAL_PTRN = re.compile(u'[\U00010000-\U0010FFFF]')
+else:
+    # narrow build, string indexes are already UTF-16 code units
+    _ASTRAL_PTRN = None
+
+
+class _OffsetMap(object):
+    """
+    Converts the string indexes (code points) of a text to the positions
+    used by Qt (UTF-16 code units) and back. The two only differ if the text
+    contains characters outside of the BMP (e.g. emojis), which are encoded
+    as surrogate pairs in UTF-16.
+    """
+    def __init__(self, text):
+        #: string indexes of the non BMP characters
+        self.indexes = array('i')
+        if _ASTRAL_PTRN is not None:
+            self.indexes.extend(
+                m.start() for m in _ASTRAL_PTRN.finditer(text))
+        #: UTF-16 positions of the non BMP characters
+        self.positions = array(
+            'i', [i + n for n, i in enumerate(self.indexes)])
+
+    def __bool__(self):
+        return bool(self.indexes)
+
+    __nonzero__ = __bool__
+
+    def to_position(self, index):
+        """
+        Converts a string index to a UTF-16 position.
+        """
+        return index + bisect.bisect_left(self.indexes, index)
+
+    def to_index(self, position):
+        """
+        Converts a UTF-16 position to a string index (a position in the
+        middle of a surrogate pair is mapped to the non BMP character).
+        """
+        return position - bisect.bisect_left(self.positions, position)
+
+    def to_positions(self, indexes):
+        """
+        Converts a sorted array of string indexes to UTF-16 positions.
+        """
+        ret_val = array('i')
+        n = 0
+        astrals = self.indexes
+        for index in indexes:
+            while n < len(astrals) and astrals[n] < index:
+                n += 1
+            ret_val.append(index + n)
+        return ret_val
+
+
+class SearchResults(object):
+    """
+    The occurrences found by :meth:`DocumentSearcher.search`.
+
+    Start and end positions are stored in two packed arrays of ints. The
+    number of stored occurrences may be capped (see ``max_hits``) while
+    :attr:`total` is always the total number of occurrences found in the
+    searched range.
+
+    Iterating over the results yields (start, end) tuples. Positions are
+    document positions (UTF-16 code units, like ``QTextCursor`` positions).
+    """
+    def __init__(self, starts=None, ends=None, total=None):
+        #: start positions of the occurrences (array of int)
+        self.starts = starts if starts is not None else array('i')
+        #: end positions of the occurrences (array of int)
+        self.ends = ends if ends is not None else array('i')
+        #: total number of occurrences (including the ones that were not
+        #: stored because of the hit cap)
+        self.total = total if total is not None else len(self.starts)
+
+    @property
+    def capped(self):
+        """
+        True if some occurrences were not stored because of the hit cap.
+        """
+        return self.total > len(self.starts)
+
+    def index(self, start, end):
+        """
+        Returns the index of the occurrence that contains the range
+        [start, end], -1 if there is no such occurrence.
+
+        :param start: range start position
+        :param end: range end position
+        """
+        i = bisect.bisect_right(self.starts, start) - 1
+        if i >= 0 and self.ends[i] >= end:
+            return i
+        return -1
+
+    def __len__(self):
+        return len(self.starts)
+
+    def __iter__(self):
+        return zip(self.starts, self.ends)
+
+    def __getitem__(self, i):
+        return self.starts[i], self.ends[i]
+
+
+class DocumentSearcher(object):
+    """
+    Searches text occurrences in a document, locally (without going through
+    the backend).
+
+    The searcher works on a plain text snapshot of the document which is
+    kept until the document content changes. Literal texts are searched
+    with ``str.find``, regular expressions and whole word searches use
+    compiled (and cached) :mod:`re` patterns. The occurrences are returned
+    as packed position arrays (:class:`SearchResults`) and only counted
+    above the hit cap, so that searching a multi megabytes document takes
+    a few milliseconds.
+
+    When a literal search extends the previous one (e.g. while the user is
+    typing the search text), only the previous occurrences are matched
+    again instead of the whole document.
+
+    Use :meth:`DocumentSearcher.get` to retrieve the searcher of a
+    document, there is only one searcher per document (shared between the
+    editor clones).
+    """
+    #: Characters considered as word separators for whole word searches
+    separators = DocumentWordsProvider.separators
+
+    # compiled patterns, least recently used first. Patterns are compiled
+    # from the background threads of the multi-document search too.
+    _patterns = collections.OrderedDict()
+    _patterns_lock = threading.Lock()
+    _max_patterns = 100
+
+    @classmethod
+    def get(cls, document):
+        """
+        Returns the searcher of a document, the searcher is created on first
+        access.
+
+        :param document: QTextDocument
+        :rtype: DocumentSearcher
+        """
+        try:
+            return document._searcher
+        except AttributeError:
+            searcher = cls(document)
+            document._searcher = searcher
+            return searcher
+
+    def __init__(self, document):
+        self._document = document
+        self._text = None
+        self._lower_text = None
+        self._offsets = None
+        # (needle, case_sensitive, start, end, starts) of the last literal
+        # search whose occurrences were all stored, used to speed up the
+        # next search if it extends the search text.
+        self._previous = None
+        document.contentsChange.connect(self._on_contents_change)
+
+    @property
+    def text(self):
+        """
+        Returns the plain text snapshot of the document.
+        """
+        if self._text is None:
+            self._text = self._document.toPlainText()
+        return self._text
+
+    def _get_offsets(self):
+        """
+        Returns the map between the snapshot string indexes and the document
+        positions.
+        """
+        if self._offsets is None:
+            self._offsets = _OffsetMap(self.text)
+        return self._offsets
+
+    def _get_lower_text(self):
+        """
+        Returns the lower case snapshot of the document, None if lowering the
+        text changes its length (positions would not match).
+        """
+        if self._lower_text is None:
+            lower = self.text.lower()
+            self._lower_text = lower if len(lower) == len(self.text) else False
+        return self._lower_text or None
+
+    def invalidate(self):
+        """
+        Drops the text snapshot, it will be read again from the document on
+        the next search.
+        """
+        self._text = None
+        self._lower_text = None
+        self._offsets = None
+        self._previous = None
+
+    def _on_contents_change(self, *args):
+        self.invalidate()
+
+    @classmethod
+    def compile(cls, sub, regex=False, case_sensitive=False,
+                whole_word=False):
+        """
+        Compiles a search pattern. Compiled patterns are cached. This method
+        is thread safe.
+
+        :param sub: search text or regular expression
+        :param regex: True if sub is a regular expression
+        :param case_sensitive: True to match case
+        :param whole_word: True to match whole words only
+        :raises: re.error if the regular expression is invalid
+        """
+        key = (sub, regex, case_sensitive, whole_word)
+        with cls._patterns_lock:
+            compiled = cls._patterns.pop(key, None)
+            if compiled is not None:
+                # move to the end (most recently used)
+                cls._patterns[key] = compiled
+                return compiled
+        pattern = sub if regex else re.escape(sub)
+        if whole_word:
+            seps = ''.join(re.escape(sep) for sep in cls.separators)
+            pattern = r'(?<![^%s])(?:%s)(?![^%s])' % (seps, pattern, seps)
+        flags = re.MULTILINE
+        if not case_sensitive:
+            flags |= re.IGNORECASE
+        compiled = re.compile(pattern, flags)
+        with cls._patterns_lock:
+            cls._patterns[key] = compiled
+            while len(cls._patterns) > cls._max_patterns:
+                cls._patterns.popitem(last=False)
+        return compiled
+
+    def search(self, sub, regex=False, case_sensitive=False,
+               whole_word=False, start=0, end=None, max_hits=None):
+        """
+        Searches all the occurrences of a text (or of a regular expression).
+
+        :param sub: search text or regular expression
+        :param regex: True if sub is a regular expression
+        :param case_sensitive: True to match case
+        :param whole_word: True to match whole words only
+        :param start: start position of the searched range
+        :param end: end position of the searched range (None means the end
+            of the document)
+        :param max_hits: maximum number of occurrences to store, None to
+            store all of them. Occurrences are still counted above the cap.
+        :rtype: SearchResults
+        :raises: re.error if the regular expression is invalid
+        """
+        self._previous, previous = None, self._previous
+        if not sub:
+            return SearchResults()
+        text = self.text
+        offsets = self._get_offsets()
+        if offsets:
+            start = offsets.to_index(start)
+            if end is not None:
+                end = offsets.to_index(end)
+        if end is None:
+            end = len(text)
+        results = None
+        if not regex and not whole_word:
+            haystack = text if case_sensitive else self._get_lower_text()
+            if haystack is not None:
+                needle = sub if case_sensitive else sub.lower()
+                candidates = None
+                if (previous is not None and
+                        needle.startswith(previous[0]) and
+                        previous[1:4] == (case_sensitive, start, end)):
+                    candidates = previous[4]
+                results = self._search_literal(
+                    haystack, needle, start, end, max_hits, candidates)
+                if not results.capped and not self._has_border(needle):
+                    self._previous = (needle, case_sensitive, start, end,
+                                      results.starts)
+        if results is None:
+            pattern = self.compile(sub, regex, case_sensitive, whole_word)
+            results = self._search_pattern(pattern, text, start, end,
+                                           max_hits)
+        return self._to_positions(results, offsets)
+
+    @staticmethod
+    def _to_positions(results, offsets):
+        """
+        Converts results found in a string (string indexes) to document
+        positions.
+        """
+        if not offsets:
+            return results
+        return SearchResults(offsets.to_positions(results.starts),
+                             offsets.to_positions(results.ends),
+                             results.total)
+
+    def replace_all(self, results, text, pattern=None, highlighter=None):
+        """
+        Replaces occurrences with a text. The occurrences are replaced one by
+        one, from the last to the first, in a single edit block (one undo
+        step). Only the replaced ranges are modified: the blocks between the
+        occurrences (and their user data: markers, checker messages, fold
+        states,...) are kept.
+
+        :param results: the occurrences to replace (:class:`SearchResults`
+            found in the current text snapshot).
+        :param text: replacement text
+        :param pattern: the compiled regular expression that found the
+            occurrences (see :meth:`compile`). If set, the group references
+            of the replacement text (``\\1``, ``\\g<name>``) are expanded
+            for each occurrence.
+        :param highlighter: the syntax highlighter of the document, its
+            highlighting is suspended during the replacement and only the
+            modified blocks are highlighted again.
+        :returns: a QTextCursor positioned after the last replacement, None if
+            there was nothing to replace.
+        :raises: re.error if the replacement text contains invalid group
+            references (the document is not modified).
+        """
+        if not results:
+            return None
+        starts, ends = results.starts, results.ends
+        if pattern is None:
+            replacements = [text] * len(starts)
+        else:
+            replacements = self._expand(results, text, pattern)
+        # replacements ranges once all the occurrences are replaced
+        ranges = []
+        delta = 0
+        for i, replacement in enumerate(replacements):
+            length = len(replacement.encode('utf-16-le')) // 2
+            start = starts[i] + delta
+            ranges.append((start, start + length))
+            delta += length - (ends[i] - starts[i])
+        if highlighter is not None:
+            highlighter.suspend()
+        cursor = QtGui.QTextCursor(self._document)
+        try:
+            cursor.beginEditBlock()
+            for i in range(len(starts) - 1, -1, -1):
+                cursor.setPosition(starts[i])
+                cursor.setPosition(ends[i], cursor.KeepAnchor)
+                cursor.insertText(replacements[i])
+            cursor.endEditBlock()
+        finally:
+            if highlighter is not None:
+                highlighter.resume(ranges)
+        cursor.setPosition(ranges[-1][1])
+        return cursor
+
+    def _expand(self, results, template, pattern):
+        """
+        Returns the replacement text of each occurrence, with the group
+        references of the template expanded (see ``match.expand``).
+        """
+        text = self.text
+        offsets = self._get_offsets()
+        ret_val = []
+        for start, end in results:
+            if offsets:
+                start, end = offsets.to_index(start), offsets.to_index(end)
+            match = pattern.match(text, start)
+            if match is None or match.end() != end:
+                # the occurrence was found in a search range that ends at the
+                # occurrence end (lookaheads)
+                match = pattern.match(text, start, end)
+            ret_val.append(match.expand(template) if match else template)
+        return ret_val
+
+    @staticmethod
+    def _search_literal(haystack, needle, start, end, max_hits, candidates):
+        """
+        Searches a literal text with str.find/str.count. If candidates is
+        not None, the text is only matched at those positions (the
+        occurrences of a prefix of the text).
+        """
+        starts = array('i')
+        total = 0
+        length = len(needle)
+        if candidates is not None:
+            last_end = -1
+            for pos in candidates:
+                # keep the occurrences non overlapping, like str.find does
+                if pos >= last_end and haystack.startswith(needle, pos, end):
+                    if max_hits is None or total < max_hits:
+                        starts.append(pos)
+                    total += 1
+                    last_end = pos + length
+        else:
+            find = haystack.find
+            pos = find(needle, start, end)
+            while pos != -1:
+                if max_hits is not None and total >= max_hits:
+                    total += haystack.count(needle, pos, end)
+                    break
+                starts.append(pos)
+                total += 1
+                pos = find(needle, pos + length, end)
+        ends = array('i', [pos + length for pos in starts])
+        return SearchResults(starts, ends, total)
+
+    @staticmethod
+    def _search_pattern(pattern, text, start, end, max_hits):
+        """
+        Searches a compiled pattern.
+        """
+        results = SearchResults()
+        starts, ends = results.starts, results.ends
+        total = 0
+        matches = pattern.finditer(text, start, end)
+        for match in matches:
+            if max_hits is not None and total >= max_hits:
+                if match.end() > match.start():
+                    # count the remaining occurrences without creating the
+                    # match objects
+                    total += 1 + len(pattern.findall(text, match.end(), end))
+                else:
+                    total += 1 + sum(1 for _ in matches)
+                break
+            starts.append(match.start())
+            ends.append(match.end())
+            total += 1
+        results.total = total
+        return results
+
+    @staticmethod
+    def _has_border(sub):
+        """
+        Checks if the occurrences of a text may overlap (i.e. if a proper
+        prefix of the text is also a suffix). In that case, the non
+        overlapping occurrences do not contain all the positions where the
+        text appears and cannot be used to speed up the next search.
+        """
+        return any(sub[:i] == sub[-i:] for i in range(1, len(sub)))
+
+
+class WordIndex(object):
+    """
+    Per-document index of the words of each text block, used to find the
+    occurrences of a whole word without searching the entire document.
+
+    Words are the runs of characters that are not
+    :attr:`DocumentSearcher.separators`. The index is built on the first
+    query (from the document text snapshot) and is then kept up to date
+    from the document ``contentsChange`` signal: only the modified blocks
+    are tokenized again.
+
+    Use :meth:`WordIndex.get` to retrieve the index of a document, there is
+    only one index per document (shared between the editor clones).
+    """
+    #: Changes that span more blocks than this threshold invalidate the whole
+    #: index instead of being spliced in (e.g. when a new text is set).
+    splice_threshold = 1000
+
+    @classmethod
+    def get(cls, document):
+        """
+        Returns the word index of a document, the index is created on first
+        access.
+
+        :param document: QTextDocument
+        :rtype: WordIndex
+        """
+        try:
+            return document._word_index
+        except AttributeError:
+            index = cls(document)
+            document._word_index = index
+            return index
+
+    def __init__(self, document):
+        self._document = document
+        #: words of each block: dict {lower case word: [columns]}, None means
+        #: the index must be built
+        self._blocks = None
+        self._word_ptrn = re.compile('[^%s]+' % ''.join(
+            re.escape(sep) for sep in DocumentSearcher.separators))
+        document.contentsChange.connect(self._on_contents_change)
+
+    def invalidate(self):
+        """
+        Invalidates the whole index, it will be built again on the next
+        query.
+        """
+        self._blocks = None
+
+    def _tokenize(self, text):
+        words = {}
+        for match in self._word_ptrn.finditer(text):
+            words.setdefault(match.group().lower(), []).append(match.start())
+        return words
+
+    def _read_range(self, start, end):
+        ret_val = []
+        block = self._document.findBlockByNumber(start)
+        while block.isValid() and block.blockNumber() <= end:
+            ret_val.append(self._tokenize(block.text()))
+            block = block.next()
+        return ret_val
+
+    def _update(self):
+        doc = self._document
+        if self._blocks is None or len(self._blocks) != doc.blockCount():
+            lines = DocumentSearcher.get(doc).text.split('\n')
+            if len(lines) == doc.blockCount():
+                self._blocks = [self._tokenize(line) for line in lines]
+            else:
+                self._blocks = self._read_range(0, doc.blockCount())
+
+    def _on_contents_change(self, position, removed, added):
+        if self._blocks is None:
+            return
+        # utils imports this module
+        from pyqode.core.api.utils import get_changed_blocks
+        changed = get_changed_blocks(self._document, position, added,
+                                     len(self._blocks))
+        if changed is None or changed[1] - changed[0] > self.splice_threshold:
+            self.invalidate()
+            return
+        start, end, old_end = changed
+        self._blocks[start:old_end + 1] = self._read_range(start, end)
+
+    def count(self, word, case_sensitive=False):
+        """
+        Returns the number of occurrences of a whole word in the document.
+
+        :param word: the word to count
+        :param case_sensitive: True to match case
+        """
+        if case_sensitive:
+            return len(self.occurrences(word, case_sensitive=True))
+        self._update()
+        key = word.lower()
+        return sum(len(words.get(key, ())) for words in self._blocks)
+
+    def occurrences(self, word, case_sensitive=False, first_line=0,
+                    last_line=None):
+        """
+        Returns the occurrences of a whole word, as a list of
+        (start, end) positions, in document order.
+
+        :param word: the word to find
+        :param case_sensitive: True to match case
+        :param first_line: first line (block number) to consider
+        :param last_line: last line (block number) to consider, None to go
+            to the end of the document.
+        """
+        self._update()
+        key = word.lower()
+        length = len(word)
+        blocks = self._blocks
+        if last_line is None or last_line >= len(blocks):
+            last_line = len(blocks) - 1
+        ret_val = []
+        for nbr in range(max(0, first_line), last_line + 1):
+            columns = blocks[nbr].get(key)
+            if not columns:
+                continue
+            block = self._document.findBlockByNumber(nbr)
+            pos = block.position()
+            text = block.text()
+            # columns are string indexes, positions are UTF-16 positions
+            offsets = _OffsetMap(text)
+            for col in columns:
+                if case_sensitive and text[col:col + length] != word:
+                    continue
+                if offsets:
+                    ret_val.append((pos + offsets.to_position(col),
+                                    pos + offsets.to_position(col + length)))
+                else:
+                    ret_val.append((pos + col, pos + col + length))
+        return ret_val
+
+
+def find_all(text, sub, regex=False, case_sensitive=False, whole_word=False,
+             start=0, end=None, max_hits=None):
+    """
+    Searches all the occurrences of a text (or of a regular expression) in a
+    string. This function does not use any Qt object, it can be used from a
+    background thread to search document snapshots.
+
+    Like with :meth:`DocumentSearcher.search`, positions are document
+    positions (UTF-16 code units), not string indexes. See
+    :meth:`DocumentSearcher.search` for a description of the parameters.
+
+    :rtype: SearchResults
+    """
+    if not sub:
+        return SearchResults()
+    offsets = _OffsetMap(text)
+    if offsets:
+        start = offsets.to_index(start)
+        if end is not None:
+            end = offsets.to_index(end)
+    if end is None:
+        end = len(text)
+    results = None
+    if not regex and not whole_word:
+        haystack, needle = text, sub
+        if not case_sensitive:
+            haystack, needle = text.lower(), sub.lower()
+        if len(haystack) == len(text):
+            results = DocumentSearcher._search_literal(
+                haystack, needle, start, end, max_hits, None)
+    if results is None:
+        pattern = DocumentSearcher.compile(sub, regex, case_sensitive,
+                                           whole_word)
+        results = DocumentSearcher._search_pattern(pattern, text, start, end,
+                                                   max_hits)
+    return DocumentSearcher._to_positions(results, offsets)
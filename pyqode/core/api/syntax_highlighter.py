@@ -1,7 +1,10 @@
 """
 This module contains the syntax highlighter API.
 """
+from array import array
+import bisect
 import logging
+import re
 import sys
 import time
 import weakref
@@ -10,6 +13,7 @@ from pygments.token import Token, Punctuation
 from pygments.util import ClassNotFound
 from pyqode.core.api.mode import Mode
 from pyqode.core.api.utils import drift_color
+from pyqode.core.api.utils import BRACKETS, compute_bracket_depths
 from pyqode.qt import QtGui, QtCore, QtWidgets
 
 
@@ -17,8 +21,54 @@ def _logger():
     return logging.getLogger(__name__)
 
 
-#: A sorted list of available pygments styles, for convenience
-PYGMENTS_STYLES = sorted(set(list(get_all_styles()) + ['darcula', 'qt']))
+class _StyleList(list):
+    """
+    Sorted list of the available pygments styles that fills itself the first
+    time it is accessed.
+
+    Enumerating the styles imports every style plugin, this is only done
+    the first time the list is used (instead of when the module is
+    imported).
+    """
+    def __init__(self, extra_styles):
+        super(_StyleList, self).__init__()
+        self._extra_styles = extra_styles
+        self._loaded = False
+
+    def _load(self):
+        if not self._loaded:
+            self._loaded = True
+            list.extend(self, sorted(set(
+                list(get_all_styles()) + self._extra_styles)))
+
+    def __radd__(self, other):
+        self._load()
+        return list(other) + list(self)
+
+
+def _lazy_method(name):
+    method = getattr(list, name)
+
+    def wrapper(self, *args, **kwargs):
+        self._load()
+        return method(self, *args, **kwargs)
+    wrapper.__name__ = name
+    return wrapper
+
+
+for _name in ('__getitem__', '__len__', '__iter__', '__reversed__',
+              '__contains__', '__add__', '__mul__', '__rmul__', '__eq__',
+              '__ne__', '__lt__', '__le__', '__gt__', '__ge__', '__repr__',
+              '__str__', 'index', 'count', 'append', 'extend', 'insert',
+              'remove', 'pop', 'sort', 'reverse', '__setitem__',
+              '__delitem__', '__iadd__', '__imul__'):
+    setattr(_StyleList, _name, _lazy_method(_name))
+del _name
+
+
+#: A sorted list of available pygments styles, for convenience. The list is
+#: lazy: styles are discovered the first time the list is used.
+PYGMENTS_STYLES = _StyleList(['darcula', 'qt'])
 
 
 #: The list of color schemes keys (and their associated pygments token)
@@ -72,6 +122,102 @@ COLOR_SCHEME_KEYS = {
 }
 
 
+class FormatCache(object):
+    """
+    Process-wide flyweight registry of the QTextCharFormat and QBrush
+    objects built from pygments styles.
+
+    Building a format table is done once per style and shared by all the
+    syntax highlighters (and their clones) of the application. Opening a new
+    editor with an already used style does not rebuild anything.
+
+    Formats are keyed by ``(style name, token type)``, color scheme formats
+    are keyed by the style name. Use
+    :meth:`pyqode.core.api.FormatCache.invalidate` if a style has been
+    modified at runtime.
+
+    .. note:: Cached formats are shared, never modify a cached format in
+        place, copy it first (``QtGui.QTextCharFormat(fmt)``).
+    """
+    _formats = {}
+    _schemes = {}
+    _brushes = {}
+
+    @classmethod
+    def get_format(cls, style_name, token, factory):
+        """
+        Gets the format for ``token`` in the style ``style_name``, the format
+        is created using ``factory`` if it is not in the cache.
+
+        :param style_name: name of the pygments style
+        :param token: pygments token type
+        :param factory: callable that takes the token type and returns a
+            QTextCharFormat.
+        :return: QtGui.QTextCharFormat
+        """
+        key = (style_name, token)
+        try:
+            return cls._formats[key]
+        except KeyError:
+            fmt = cls._formats[key] = factory(token)
+            return fmt
+
+    @classmethod
+    def get_scheme_formats(cls, style_name, factory):
+        """
+        Gets the color scheme formats dict of the style ``style_name``,
+        the dict is created using ``factory`` if it is not in the cache.
+
+        The cached dict is never handed out: callers get their own copy
+        (the formats it contains are shared).
+
+        :param style_name: name of the pygments style
+        :param factory: callable that returns the formats dict.
+        :return: dict
+        """
+        try:
+            formats = cls._schemes[style_name]
+        except KeyError:
+            formats = cls._schemes[style_name] = dict(factory())
+        return dict(formats)
+
+    @classmethod
+    def get_brush(cls, color):
+        """
+        Gets a brush for a pygments color string (e.g. '#FF0000').
+
+        :param color: pygments color string
+        :return: QtGui.QBrush
+        """
+        try:
+            return cls._brushes[color]
+        except KeyError:
+            color_str = str(color).replace("#", "")
+            qcolor = QtGui.QColor()
+            qcolor.setRgb(int(color_str[:2], base=16),
+                          int(color_str[2:4], base=16),
+                          int(color_str[4:6], base=16))
+            brush = cls._brushes[color] = QtGui.QBrush(qcolor)
+            return brush
+
+    @classmethod
+    def invalidate(cls, style_name=None):
+        """
+        Removes the cached formats of a style.
+
+        :param style_name: name of the style to invalidate. None to clear
+            the whole cache.
+        """
+        if style_name is None:
+            cls._formats.clear()
+            cls._schemes.clear()
+            cls._brushes.clear()
+            return
+        cls._schemes.pop(style_name, None)
+        for key in [k for k in cls._formats.keys() if k[0] == style_name]:
+            cls._formats.pop(key)
+
+
 class ColorScheme(object):
     """
     Translates a pygments style into a dictionary of colors associated with a
@@ -110,20 +256,26 @@ class ColorScheme(object):
         :param style: name of the pygments style to load
         """
         self._name = style
-        self._brushes = {}
         #: Dictionary of formats colors (keys are the same as for
         #: :attr:`pyqode.core.api.COLOR_SCHEME_KEYS`
-        self.formats = {}
+        #: The formats are shared by all color schemes that use the same
+        #: style, each color scheme has its own dict.
+        self.formats = FormatCache.get_scheme_formats(
+            style, self._build_formats)
+
+    def _build_formats(self):
         try:
-            style = get_style_by_name(style)
+            style = get_style_by_name(self._name)
         except ClassNotFound:
-            if style == 'darcula':
+            if self._name == 'darcula':
                 from pyqode.core.styles.darcula import DarculaStyle
                 style = DarculaStyle
             else:
                 from pyqode.core.styles.qt import QtStyle
                 style = QtStyle
+        self.formats = {}
         self._load_formats_from_style(style)
+        return self.formats
 
     def _load_formats_from_style(self, style):
         # background
@@ -175,25 +327,11 @@ class ColorScheme(object):
             result.setObjectType(result.UserObject)
         return result
 
-    def _get_brush(self, color):
+    @staticmethod
+    def _get_brush(color):
         """ Returns a brush for the color.
         """
-        result = self._brushes.get(color)
-        if result is None:
-            qcolor = self._get_color(color)
-            result = QtGui.QBrush(qcolor)
-            self._brushes[color] = result
-        return result
-
-    @staticmethod
-    def _get_color(color):
-        """ Returns a QColor built from a Pygments color string. """
-        color = str(color).replace("#", "")
-        qcolor = QtGui.QColor()
-        qcolor.setRgb(int(color[:2], base=16),
-                      int(color[2:4], base=16),
-                      int(color[4:6], base=16))
-        return qcolor
+        return FormatCache.get_brush(color)
 
 
 class SyntaxHighlighter(QtGui.QSyntaxHighlighter, Mode):
@@ -223,6 +361,10 @@ class SyntaxHighlighter(QtGui.QSyntaxHighlighter, Mode):
     #: highlighter instance and the current text block
     block_highlight_finished = QtCore.Signal(object, object)
 
+    #: Names of the color scheme formats of the string and comment spans
+    #: recorded in the blocks user data.
+    LITERAL_FORMATS = ('comment', 'string', 'docstring')
+
     @property
     def formats(self):
         """
@@ -244,6 +386,7 @@ class SyntaxHighlighter(QtGui.QSyntaxHighlighter, Mode):
             color_scheme = ColorScheme(color_scheme)
         if color_scheme.name != self._color_scheme.name:
             self._color_scheme = color_scheme
+            self._kinds_cache.clear()
             self.refresh_editor(color_scheme)
             self.rehighlight()
 
@@ -289,6 +432,17 @@ class SyntaxHighlighter(QtGui.QSyntaxHighlighter, Mode):
         #: to work. Default is None
         self.fold_detector = None
         self.WHITESPACES = QtCore.QRegExp(r'\s+')
+        self._brackets_ptrn = re.compile(
+            '[%s]' % re.escape(''.join(BRACKETS)))
+        # string/comment spans of the block being highlighted
+        self._literal_spans = None
+        # id(format) -> (format, names of the equal string/comment formats)
+        self._kinds_cache = {}
+        # True while the editor sets a new text, the fold levels are then
+        # computed for the whole document at once (see fold_document)
+        self._bulk_folding = False
+        # True while the highlighting is suspended (see suspend/resume)
+        self._suspended = False
 
     def on_state_changed(self, state):
         if self._on_close:
@@ -296,8 +450,24 @@ class SyntaxHighlighter(QtGui.QSyntaxHighlighter, Mode):
         if state:
             self.setDocument(self.editor.document())
         else:
+            self._clear_recorded_data()
             self.setDocument(None)
 
+    def _clear_recorded_data(self):
+        """
+        Clears the data recorded in the blocks user data (brackets and
+        literal spans), it won't be kept up to date once the highlighter is
+        removed from the document.
+        """
+        if self.document() is None:
+            return
+        block = self.document().begin()
+        while block.isValid():
+            user_data = block.userData()
+            if isinstance(user_data, TextBlockUserData):
+                user_data.clear_recorded_data()
+            block = block.next()
+
     def _highlight_whitespaces(self, text):
         index = self.WHITESPACES.indexIn(text, 0)
         while index >= 0:
@@ -325,18 +495,147 @@ class SyntaxHighlighter(QtGui.QSyntaxHighlighter, Mode):
         :param text: text to highlight.
         """
         if not self.enabled:
+            user_data = self.currentBlockUserData()
+            if isinstance(user_data, TextBlockUserData):
+                # the recorded data would be out of date
+                user_data.clear_recorded_data()
             return
         current_block = self.currentBlock()
+        if self._suspended:
+            # keep the previous formats, the modified blocks are highlighted
+            # again by resume
+            for fmt_range in current_block.layout().additionalFormats():
+                QtGui.QSyntaxHighlighter.setFormat(
+                    self, fmt_range.start, fmt_range.length, fmt_range.format)
+            return
         previous_block = self._find_prev_non_blank_block(current_block)
         if self.editor:
-            self.highlight_block(text, current_block)
-            if self.editor.show_whitespaces:
-                self._highlight_whitespaces(text)
-            if self.fold_detector is not None:
+            self._literal_spans = []
+            threshold = self.editor.long_line_threshold
+            try:
+                # block.length() includes the paragraph separator
+                if 0 < threshold < current_block.length() - 1:
+                    self.highlight_long_block(text, current_block)
+                    bracket_text = ''
+                else:
+                    self.highlight_block(text, current_block)
+                    if self.editor.show_whitespaces:
+                        self._highlight_whitespaces(text)
+                    bracket_text = text
+                self._record_data(bracket_text, current_block)
+            finally:
+                self._literal_spans = None
+            if self.fold_detector is not None and not self._bulk_folding:
                 self.fold_detector._editor = weakref.ref(self.editor)
                 self.fold_detector.process_block(
                     current_block, previous_block, text)
 
+    def setFormat(self, start, count, fmt):
+        """
+        Sets the format of a range of the current block, the ranges that use
+        a string or comment format are recorded (see
+        :meth:`pyqode.core.api.TextHelper.is_comment_or_string`).
+        """
+        super(SyntaxHighlighter, self).setFormat(start, count, fmt)
+        spans = self._literal_spans
+        if spans is None or count <= 0:
+            return
+        end = start + count
+        if spans and spans[-1][1] > start:
+            # remove the parts of the recorded spans that are overwritten
+            cut = []
+            for span in spans:
+                if span[1] <= start or span[0] >= end:
+                    cut.append(span)
+                    continue
+                if span[0] < start:
+                    cut.append((span[0], start, span[2]))
+                if span[1] > end:
+                    cut.append((end, span[1], span[2]))
+            spans[:] = cut
+        kinds = self._literal_kinds(fmt)
+        if kinds:
+            spans.append((start, end, kinds))
+            if len(spans) > 1 and spans[-2][0] > start:
+                spans.sort()
+
+    def _literal_kinds(self, fmt):
+        """
+        Returns the names of the string/comment formats that are equal to a
+        format. The result is cached per format object, formats that are not
+        user objects are never string or comment formats.
+        """
+        if (not isinstance(fmt, QtGui.QTextCharFormat) or
+                fmt.objectType() != fmt.UserObject):
+            return ()
+        try:
+            cached, kinds = self._kinds_cache[id(fmt)]
+        except KeyError:
+            cached = None
+        if cached is not fmt:
+            formats = self.formats
+            kinds = tuple(key for key in self.LITERAL_FORMATS
+                          if formats[key] is fmt or formats[key] == fmt)
+            if len(self._kinds_cache) > 256:
+                self._kinds_cache.clear()
+            # keep a reference to the format so that its id is not reused
+            self._kinds_cache[id(fmt)] = (fmt, kinds)
+        return kinds
+
+    def _record_data(self, text, block):
+        """
+        Records the string/comment spans, the positions of the brackets that
+        are not in a string or in a comment and the bracket depth summary of
+        the block in the block user data (see
+        :func:`pyqode.core.api.get_block_symbol_data` and
+        :func:`pyqode.core.api.get_block_bracket_depths`).
+        """
+        user_data = block.userData()
+        if not isinstance(user_data, TextBlockUserData):
+            user_data = TextBlockUserData()
+            block.setUserData(user_data)
+        starts, ends, kinds = array('i'), array('i'), []
+        for start, end, span_kinds in self._literal_spans:
+            if starts and ends[-1] == start and kinds[-1] == span_kinds:
+                # merge adjacent spans (e.g. string tokens)
+                ends[-1] = end
+            else:
+                starts.append(start)
+                ends.append(end)
+                kinds.append(span_kinds)
+        positions = array('i')
+        characters = []
+        for match in self._brackets_ptrn.finditer(text):
+            pos = match.start()
+            i = bisect.bisect_right(starts, pos) - 1
+            if i >= 0 and pos < ends[i]:
+                # skips symbols in string literal or comment
+                continue
+            positions.append(pos)
+            characters.append(match.group())
+        user_data.literal_starts = starts
+        user_data.literal_ends = ends
+        user_data.literal_kinds = kinds
+        user_data.bracket_chars = ''.join(characters)
+        user_data.bracket_depths = compute_bracket_depths(
+            user_data.bracket_chars)
+        user_data.brackets = positions
+
+    def fold_document(self):
+        """
+        Computes the fold levels of the whole document in a single pass. This
+        works even if the highlighter is disabled.
+
+        :returns: False if the fold detector does not support bulk
+            processing.
+        """
+        if (self.editor is None or self.fold_detector is None or
+                not self.fold_detector.bulk_processing):
+            return False
+        self.fold_detector._editor = weakref.ref(self.editor)
+        self.fold_detector.process_document(self.editor.document())
+        return True
+
     def highlight_block(self, text, block):
         """
         Abstract method. Override this to apply syntax highlighting.
@@ -346,6 +645,57 @@ class SyntaxHighlighter(QtGui.QSyntaxHighlighter, Mode):
         """
         raise NotImplementedError()
 
+    def highlight_long_block(self, text, block):
+        """
+        Cheap highlighting used for blocks longer than
+        :attr:`pyqode.core.api.CodeEdit.long_line_threshold`: the whole block
+        gets the normal format. If
+        :attr:`pyqode.core.api.CodeEdit.truncate_long_lines` is set, only the
+        characters up to the threshold are formatted, the rest of the block
+        keeps the default document format.
+
+        :param text: Line of text to highlight.
+        :param block: current block
+        """
+        length = len(text)
+        if self.editor.truncate_long_lines:
+            length = min(length, self.editor.long_line_threshold)
+        self.setFormat(0, length, self.formats['normal'])
+
+    def suspend(self):
+        """
+        Suspends the highlighting: the blocks modified until :meth:`resume`
+        is called keep their previous formats.
+
+        Use it for bulk edits that modify a few blocks spread over a large
+        part of the document (e.g. replacing all the occurrences of a text in
+        a single edit block), otherwise all the blocks between the first and
+        the last modification are highlighted again.
+        """
+        self._suspended = True
+
+    def resume(self, ranges=()):
+        """
+        Resumes the highlighting and highlights the modified blocks again.
+
+        :param ranges: list of (start, end) positions of the text modified
+            while the highlighting was suspended.
+        """
+        self._suspended = False
+        document = self.document()
+        if document is None:
+            return
+        last_position = document.characterCount() - 1
+        last = -1
+        for start, end in ranges:
+            end = document.findBlock(min(end, last_position)).blockNumber()
+            block = document.findBlock(min(start, last_position))
+            while block.isValid() and block.blockNumber() <= end:
+                if block.blockNumber() > last:
+                    self.rehighlightBlock(block)
+                    last = block.blockNumber()
+                block = block.next()
+
     def rehighlight(self):
         """
         Rehighlight the entire document, may be slow.
@@ -383,3 +733,28 @@ class TextBlockUserData(QtGui.QTextBlockUserData):
         self.messages = []
         #: List of markers draw by a marker panel.
         self.markers = []
+        #: Positions of the brackets that are not in a string or in a
+        #: comment (array of int), recorded by the syntax highlighter. None if
+        #: the brackets have not been recorded.
+        self.brackets = None
+        #: The characters of the recorded brackets (str)
+        self.bracket_chars = ''
+        #: Bracket depth summary of the block, see
+        #: :func:`pyqode.core.api.utils.compute_bracket_depths`
+        self.bracket_depths = None
+        #: Start positions of the string/comment spans of the block (sorted
+        #: array of int), recorded by the syntax highlighter. None if the
+        #: spans have not been recorded.
+        self.literal_starts = None
+        #: End positions of the string/comment spans (array of int)
+        self.literal_ends = None
+        #: List of tuples with the names of the formats of each span (e.g.
+        #: ('comment',))
+        self.literal_kinds = None
+
+    def clear_recorded_data(self):
+        """
+        Clears the data recorded by the syntax highlighter.
+        """
+        self.brackets = None
+        self.literal_starts = None
@@ -2,11 +2,13 @@
 """
 This module contains utility functions/classes.
 """
+import bisect
 import functools
 import logging
 import weakref
 
 from pyqode.qt import QtCore, QtGui, QtWidgets
+from pyqode.core.api.search import DocumentSearcher
 
 
 def _logger():
@@ -525,6 +527,25 @@ class TextHelper(object):
         self._editor.document().markContentsDirty(text_cursor.selectionStart(),
                                                   text_cursor.selectionEnd())
 
+    def mark_lines_dirty(self, start, end):
+        """
+        Marks a range of lines as dirty, only the layout of those lines is
+        refreshed (and the document size updated accordingly).
+
+        :param start: first line number
+        :param end: last line number (included)
+        """
+        doc = self._editor.document()
+        first = doc.findBlockByNumber(start)
+        last = doc.findBlockByNumber(end)
+        if not first.isValid():
+            first = doc.firstBlock()
+        if not last.isValid():
+            last = doc.lastBlock()
+        position = first.position()
+        doc.markContentsDirty(
+            position, last.position() + last.length() - position)
+
     def line_indent(self, line_nbr=None):
         """
         Returns the indent level of the specified line
@@ -630,6 +651,9 @@ class TextHelper(object):
         """
         Searches a text in a text document.
 
+        The search is performed by the document's
+        :class:`pyqode.core.api.DocumentSearcher`.
+
         :param text_cursor: Current text cursor
         :param search_txt: Text to search
         :param search_flags: QTextDocument.FindFlags
@@ -637,36 +661,42 @@ class TextHelper(object):
         :rtype: tuple([], int)
 
         """
-        def compare_cursors(cursor_a, cursor_b):
-            """
-            Compares two QTextCursor
+        flags = int(search_flags)
+        results = DocumentSearcher.get(self._editor.document()).search(
+            search_txt,
+            case_sensitive=bool(
+                flags & int(QtGui.QTextDocument.FindCaseSensitively)),
+            whole_word=bool(flags & int(QtGui.QTextDocument.FindWholeWords)))
+        index = results.index(text_cursor.selectionStart(),
+                              text_cursor.selectionEnd())
+        return list(results), index
 
-            :param cursor_a: cursor a
-            :param cursor_b: cursor b
+    def is_long_block(self, block):
+        """
+        Checks if a block is longer than the editor's
+        :attr:`pyqode.core.api.CodeEdit.long_line_threshold`.
 
-            :returns; True if both cursor are identical (same position, same
-                selection)
-            """
-            return (cursor_b.selectionStart() >= cursor_a.selectionStart() and
-                    cursor_b.selectionEnd() <= cursor_a.selectionEnd())
-
-        text_document = self._editor.document()
-        occurrences = []
-        index = -1
-        cursor = text_document.find(search_txt, 0, search_flags)
-        original_cursor = text_cursor
-        while not cursor.isNull():
-            if compare_cursors(cursor, original_cursor):
-                index = len(occurrences)
-            occurrences.append((cursor.selectionStart(),
-                                cursor.selectionEnd()))
-            cursor.setPosition(cursor.position() + 1)
-            cursor = text_document.find(search_txt, cursor, search_flags)
-        return occurrences, index
+        Long blocks (minified code, json dumps, logs,...) are skipped by the
+        expensive per-block features (syntax highlighting, symbol matching,
+        occurrences,...).
+
+        :param block: QTextBlock
+        """
+        try:
+            threshold = self._editor.long_line_threshold
+        except AttributeError:
+            return False
+        # block.length() includes the paragraph separator
+        return 0 < threshold < block.length() - 1
 
     def is_comment_or_string(self, cursor_or_block, formats=None):
         """
         Checks if a block/cursor is a string or a comment.
+
+        The string/comment spans recorded by the syntax highlighter are used
+        if available, otherwise the block additional formats are compared to
+        the color scheme formats.
+
         :param cursor_or_block: QTextCursor or QTextBlock
         :param formats: the list of color scheme formats to consider. By
             default, it will consider the following keys: 'comment', 'string',
@@ -674,18 +704,29 @@ class TextHelper(object):
         """
         if formats is None:
             formats = ["comment", "string", "docstring"]
-        layout = None
         pos = 0
+        block = None
         if isinstance(cursor_or_block, QtGui.QTextBlock):
-            pos = len(cursor_or_block.text()) - 1
-            layout = cursor_or_block.layout()
+            block = cursor_or_block
+            pos = len(block.text()) - 1
         elif isinstance(cursor_or_block, QtGui.QTextCursor):
-            b = cursor_or_block.block()
-            pos = cursor_or_block.position() - b.position()
-            layout = b.layout()
+            block = cursor_or_block.block()
+            pos = cursor_or_block.position() - block.position()
+        if block is None:
+            return False
+        sh = self._editor.syntax_highlighter
+        user_data = block.userData()
+        starts = getattr(user_data, 'literal_starts', None)
+        if (starts is not None and sh is not None and
+                all(kind in getattr(sh, 'LITERAL_FORMATS', ())
+                    for kind in formats)):
+            i = bisect.bisect_right(starts, pos) - 1
+            return (i >= 0 and pos < user_data.literal_ends[i] and
+                    any(kind in formats
+                        for kind in user_data.literal_kinds[i]))
+        layout = block.layout()
         if layout is not None:
             additional_formats = layout.additionalFormats()
-            sh = self._editor.syntax_highlighter
             if sh:
                 ref_formats = sh.color_scheme.formats
                 for r in additional_formats:
@@ -926,7 +967,7 @@ class TextBlockHelper(object):
         """
         if block is None:
             return
-        state = block.userState()
+        old_state = state = block.userState()
         if state == -1:
             state = 0
         if val >= 0x3FF:
@@ -934,6 +975,8 @@ class TextBlockHelper(object):
         state &= 0x7C00FFFF
         state |= val << 16
         block.setUserState(state)
+        if state != old_state:
+            TextBlockHelper._fold_data_changed(block)
 
     @staticmethod
     def is_fold_trigger(block):
@@ -962,12 +1005,22 @@ class TextBlockHelper(object):
         """
         if block is None:
             return
-        state = block.userState()
+        old_state = state = block.userState()
         if state == -1:
             state = 0
         state &= 0x7BFFFFFF
         state |= int(val) << 26
         block.setUserState(state)
+        if state != old_state:
+            TextBlockHelper._fold_data_changed(block)
+
+    @staticmethod
+    def _fold_data_changed(block):
+        # keep the fold index of the document up to date (see
+        # pyqode.core.api.folding.FoldIndex)
+        index = getattr(block.document(), '_fold_index', None)
+        if index is not None:
+            index.block_changed(block)
 
     @staticmethod
     def is_collapsed(block):
@@ -1013,10 +1066,18 @@ class ParenthesisInfo(object):
         self.character = char
 
 
+#: The bracket characters recorded by the syntax highlighter, grouped by
+#: symbol type (parentheses, square brackets and braces).
+BRACKETS = ('()', '[]', '{}')
+
+
 def get_block_symbol_data(editor, block):
     """
     Gets the list of ParenthesisInfo for specific text block.
 
+    The brackets recorded by the syntax highlighter in the block user data
+    are used if available, otherwise the block text is scanned.
+
     :param editor: Code edit instance
     :param block: block to parse
     """
@@ -1045,6 +1106,19 @@ def get_block_symbol_data(editor, block):
             cursor.movePosition(cursor.Right, cursor.MoveAnchor, pos)
         return symbols
 
+    user_data = block.userData()
+    brackets = getattr(user_data, 'brackets', None)
+    if brackets is not None:
+        ret_val = [], [], []
+        for pos, character in zip(brackets, user_data.bracket_chars):
+            for symbol, characters in enumerate(BRACKETS):
+                if character in characters:
+                    ret_val[symbol].append(ParenthesisInfo(pos, character))
+                    break
+        return ret_val
+    if TextHelper(editor).is_long_block(block):
+        # do not scan huge lines (minified files,...)
+        return [], [], []
     parentheses = sorted(
         list_symbols(editor, block, '(') + list_symbols(editor, block, ')'),
         key=lambda x: x.position)
@@ -1057,6 +1131,85 @@ def get_block_symbol_data(editor, block):
     return parentheses, square_brackets, braces
 
 
+def compute_bracket_depths(characters):
+    """
+    Computes the bracket depth summary of a block.
+
+    :param characters: the bracket characters of the block, in order.
+    :returns: a tuple (net, forward_min, backward_min) per symbol type
+        (parentheses, square brackets, braces). ``net`` is the number of
+        opening minus the number of closing brackets, ``forward_min`` is the
+        minimum depth reached when walking the block from its start (opening
+        brackets count +1) and ``backward_min`` is the minimum depth reached
+        when walking the block from its end (closing brackets count +1).
+    """
+    ret_val = []
+    for open_char, close_char in BRACKETS:
+        net = forward_min = 0
+        for character in characters:
+            if character == open_char:
+                net += 1
+            elif character == close_char:
+                net -= 1
+                forward_min = min(forward_min, net)
+        depth = backward_min = 0
+        for character in reversed(characters):
+            if character == close_char:
+                depth += 1
+            elif character == open_char:
+                depth -= 1
+                backward_min = min(backward_min, depth)
+        ret_val.append((net, forward_min, backward_min))
+    return tuple(ret_val)
+
+
+def get_block_bracket_depths(editor, block):
+    """
+    Gets the bracket depth summary of a text block (see
+    :func:`compute_bracket_depths`). The summary recorded by the syntax
+    highlighter is used if available.
+
+    :param editor: Code edit instance
+    :param block: block to parse
+    """
+    user_data = block.userData()
+    if getattr(user_data, 'brackets', None) is not None:
+        return user_data.bracket_depths
+    symbols = sorted((info for infos in get_block_symbol_data(editor, block)
+                      for info in infos), key=lambda x: x.position)
+    return compute_bracket_depths(
+        ''.join(info.character for info in symbols))
+
+
+def get_changed_blocks(document, position, added, nb_blocks):
+    """
+    Computes the blocks modified by a document ``contentsChange``. This is
+    used by the per-block indexes that are kept in sync with a document
+    (fold index, word index, checker messages,...).
+
+    :param document: QTextDocument, after the change
+    :param position: position of the change
+    :param added: number of added characters
+    :param nb_blocks: number of blocks of the document before the change
+        (the number of entries of the index)
+    :returns: a tuple (start, end, old_end): blocks ``start`` to ``end`` of
+        the document replace the blocks ``start`` to ``old_end`` of the
+        document before the change. None if the change does not match the
+        number of blocks (the index is out of sync and must be rebuilt).
+    """
+    first = document.findBlock(position)
+    last = document.findBlock(position + added)
+    if not first.isValid():
+        first = document.lastBlock()
+    if not last.isValid():
+        last = document.lastBlock()
+    start, end = first.blockNumber(), last.blockNumber()
+    old_end = end - (document.blockCount() - nb_blocks)
+    if old_end < start - 1 or old_end >= nb_blocks:
+        return None
+    return start, end, old_end
+
+
 def keep_tc_pos(func):
     """
     Cache text cursor position and restore it when the wrapped
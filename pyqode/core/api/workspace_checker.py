@@ -0,0 +1,455 @@
+# -*- coding: utf-8 -*-
+"""
+This module contains the WorkspaceChecker, a service that runs a checker
+worker on all the files of a project, in a pool of background processes.
+"""
+import collections
+import fnmatch
+import functools
+import hashlib
+import inspect
+import itertools
+import logging
+import multiprocessing
+import os
+import traceback
+
+from pyqode.core.backend.server import import_class
+from pyqode.qt import QtCore
+
+
+def _logger():
+    return logging.getLogger(__name__)
+
+
+def _pool_context():
+    """
+    Returns the multiprocessing context used to create the pool.
+
+    Pool processes are spawned: forking a Qt application (which runs
+    threads) may deadlock the child processes.
+    """
+    try:
+        return multiprocessing.get_context('spawn')
+    except AttributeError:
+        # python 2
+        return multiprocessing
+
+
+def _check_file(worker, path, encoding, digests, data):
+    """
+    Checks a file, this function is called in a pool process.
+
+    :param worker: qualified name of the checker worker
+    :param path: path of the file to check
+    :param encoding: encoding of the file
+    :param digests: digests of the file contents whose results are known
+        (the last checked content and the cached ones)
+    :param data: extra request data (ignore_rules, max_line_length,...)
+
+    :returns: (digest, results, error). results is None if the content
+        digest is one of the known digests or if the check failed,
+        error is the formatted exception if the check failed (None
+        otherwise).
+    """
+    try:
+        with open(path, 'rb') as f:
+            content = f.read()
+        digest = hashlib.sha1(content).hexdigest()
+        if digest in digests:
+            return digest, None, None
+        worker = import_class(worker)
+        if inspect.isclass(worker):
+            worker = worker()
+        data = dict(data)
+        data.update({
+            'code': content.decode(encoding, 'replace'),
+            'path': path,
+            'encoding': encoding
+        })
+        return digest, [tuple(r) for r in worker(data)], None
+    except Exception:
+        return None, None, traceback.format_exc()
+
+
+class WorkspaceChecker(QtCore.QObject):
+    """
+    Runs a checker worker (the same kind of worker you would use with a
+    :class:`pyqode.core.modes.CheckerMode`) on all the files of a project.
+
+    Files are checked in a pool of processes, the most recently modified
+    files are checked first (and after the files they depend on, see
+    :attr:`dependencies`). Messages are streamed file by file through
+    :attr:`file_checked` and into :attr:`errors_table` if set.
+
+    A file is only checked again if its modification time or size changed
+    and its content digest is different from the last check (or if one of
+    its dependencies has been checked again), so you can call :meth:`check`
+    each time a file is saved. The results of the last
+    :attr:`max_cached_results` checked contents are kept, a file that is
+    reverted to a previous content is not checked again::
+
+        checker = WorkspaceChecker(pyflakes_worker, errors_table=table)
+        checker.check_directory(project_path, patterns=['*.py'])
+        editor.text_saved.connect(lambda path: checker.check([path]))
+
+    """
+    #: Signal emitted when a file has been checked, with the file path and the
+    #: list of :class:`pyqode.core.modes.CheckerMessage`.
+    file_checked = QtCore.Signal(str, list)
+    #: Signal emitted when the check of a file failed (the worker raised an
+    #: exception or the file could not be read), with the file path and the
+    #: formatted exception. The previous messages of the file are kept.
+    file_check_failed = QtCore.Signal(str, str)
+    #: Signal emitted when all the scheduled files have been checked.
+    finished = QtCore.Signal()
+
+    #: Directories skipped by :meth:`check_directory`
+    IGNORED_DIRECTORIES = ['.git', '.hg', '.svn', '__pycache__']
+
+    def __init__(self, worker, parent=None, errors_table=None,
+                 max_processes=None):
+        """
+        :param worker: The checker function or class, or its fully qualified
+            name. The worker must be importable from the pool processes.
+        :param parent: parent QObject
+        :param errors_table: Optional
+            :class:`pyqode.core.widgets.ErrorsTable` that will show the
+            messages.
+        :param max_processes: Max number of processes, default is the number
+            of cores.
+        """
+        super(WorkspaceChecker, self).__init__(parent)
+        if not isinstance(worker, str):
+            worker = '%s.%s' % (worker.__module__, worker.__name__)
+        self._worker = worker
+        if max_processes is None:
+            try:
+                max_processes = multiprocessing.cpu_count()
+            except NotImplementedError:
+                max_processes = 1
+        self._max_processes = max_processes
+        #: Encoding used to read the files
+        self.encoding = 'utf-8'
+        #: Ignore rules, passed to the worker
+        self.ignore_rules = []
+        #: Max line length, passed to the worker
+        self.max_line_length = 79
+        #: Optional ErrorsTable where messages are displayed
+        self.errors_table = errors_table
+        #: Max number of checked contents whose results are kept
+        self.max_cached_results = 256
+        self._dependencies = None
+        # path -> absolute paths of the files it depends on, updated when
+        # the file is checked again
+        self._deps_cache = {}
+        # path -> set of the files that depend on it
+        self._dependents = {}
+        self._pool = None
+        # path -> (mtime, size) when the file was scheduled
+        self._stats = {}
+        # path -> content digest
+        self._digests = {}
+        # (path, digest) -> results, least recently used first
+        self._cached_results = collections.OrderedDict()
+        # path -> digests of the cached results of the file
+        self._cached_digests = {}
+        # path -> list of messages
+        self._messages = {}
+        # path -> id of the latest task scheduled for the path
+        self._tasks = {}
+        self._task_ids = itertools.count()
+        # results pushed by the pool result thread
+        self._results = collections.deque()
+        self._timer = QtCore.QTimer(self)
+        self._timer.setInterval(100)
+        self._timer.timeout.connect(self._process_results)
+
+    @property
+    def dependencies(self):
+        """
+        Optional callable that returns the paths of the files a file depends
+        on. Dependencies are checked first and the dependent files are
+        checked again when a dependency changed.
+
+        The dependencies of a file are cached, they are only asked again
+        when the file changed.
+        """
+        return self._dependencies
+
+    @dependencies.setter
+    def dependencies(self, value):
+        self._dependencies = value
+        self._deps_cache.clear()
+        self._dependents.clear()
+
+    @property
+    def running(self):
+        """
+        True if some files are being checked.
+        """
+        return bool(self._tasks)
+
+    def messages(self, path=None):
+        """
+        Returns the messages of a file or of all the checked files.
+
+        :param path: file path, None to get the messages of all files.
+        """
+        if path is not None:
+            return list(self._messages.get(os.path.abspath(path), []))
+        return [msg for messages in self._messages.values()
+                for msg in messages]
+
+    def check_directory(self, root, patterns=None):
+        """
+        Checks all the files of a directory (recursively).
+
+        Files that were previously checked and that do not exist anymore are
+        removed.
+
+        :param root: directory path
+        :param patterns: list of file name patterns (e.g. ['*.py']). All
+            files are checked if None.
+        """
+        root = os.path.abspath(root)
+        paths = []
+        for dirpath, dirnames, filenames in os.walk(root):
+            dirnames[:] = [d for d in dirnames
+                           if d not in self.IGNORED_DIRECTORIES]
+            for name in filenames:
+                if patterns is None or any(
+                        fnmatch.fnmatch(name, p) for p in patterns):
+                    paths.append(os.path.join(dirpath, name))
+        existing = set(paths)
+        for path in list(self._stats):
+            if path.startswith(root + os.sep) and path not in existing:
+                self._forget(path)
+        self.check(paths)
+
+    def check(self, paths, force=False):
+        """
+        Schedules the check of a list of files. Files that did not change
+        since they were last checked are skipped.
+
+        :param paths: list of file paths
+        :param force: True to check files even if they did not change.
+        """
+        changed = set()
+        for path in paths:
+            path = os.path.abspath(path)
+            try:
+                st = os.stat(path)
+            except OSError:
+                self._forget(path)
+                continue
+            stat = (st.st_mtime, st.st_size)
+            if force or self._stats.get(path) != stat:
+                if force:
+                    self._discard_results(path)
+                self._stats[path] = stat
+                self._invalidate_deps(path)
+                changed.add(path)
+        if changed and self.dependencies is not None:
+            for path in self._dependent_files(changed):
+                # check again even if the content did not change
+                self._discard_results(path)
+                changed.add(path)
+        if changed:
+            self._submit(self._sort(changed))
+
+    def cancel(self):
+        """
+        Cancels the pending checks, the cancelled files will be checked by
+        the next call to :meth:`check`.
+        """
+        for path in self._tasks:
+            self._stats.pop(path, None)
+        self._tasks.clear()
+        self._timer.stop()
+
+    def close(self):
+        """
+        Cancels the pending checks and terminates the pool processes.
+        """
+        self.cancel()
+        if self._pool is not None:
+            self._pool.terminate()
+            self._pool = None
+
+    def _deps(self, path):
+        try:
+            return self._deps_cache[path]
+        except KeyError:
+            deps = self._deps_cache[path] = [
+                os.path.abspath(p) for p in self.dependencies(path)]
+            for dep in deps:
+                self._dependents.setdefault(dep, set()).add(path)
+            return deps
+
+    def _invalidate_deps(self, path):
+        """
+        Forgets the cached dependencies of a file.
+        """
+        for dep in self._deps_cache.pop(path, ()):
+            dependents = self._dependents.get(dep)
+            if dependents is not None:
+                dependents.discard(path)
+                if not dependents:
+                    del self._dependents[dep]
+
+    def _dependent_files(self, paths):
+        """
+        Returns the files that depend (directly or not) on a set of files.
+        """
+        for path in self._stats:
+            if path not in self._deps_cache:
+                self._deps(path)
+        ret_val = set()
+        todo = list(paths)
+        while todo:
+            for path in self._dependents.get(todo.pop(), ()):
+                if path not in ret_val and path not in paths:
+                    ret_val.add(path)
+                    todo.append(path)
+        return ret_val
+
+    def _sort(self, paths):
+        """
+        Sorts files by modification time (most recent first), dependencies
+        are placed before the files that depend on them.
+        """
+        paths = sorted(paths, key=lambda p: self._stats.get(p, (0, 0))[0],
+                       reverse=True)
+        if self.dependencies is None:
+            return paths
+        scheduled = set(paths)
+        visited = set()
+        ret_val = []
+        for root in paths:
+            if root in visited:
+                continue
+            visited.add(root)
+            stack = [(root, iter(self._deps(root)))]
+            while stack:
+                path, deps = stack[-1]
+                for dep in deps:
+                    if dep in scheduled and dep not in visited:
+                        visited.add(dep)
+                        stack.append((dep, iter(self._deps(dep))))
+                        break
+                else:
+                    stack.pop()
+                    ret_val.append(path)
+        return ret_val
+
+    def _submit(self, paths):
+        if self._pool is None:
+            self._pool = _pool_context().Pool(self._max_processes)
+        data = {
+            'ignore_rules': self.ignore_rules,
+            'max_line_length': self.max_line_length
+        }
+        for path in paths:
+            task_id = next(self._task_ids)
+            self._tasks[path] = task_id
+            self._pool.apply_async(
+                _check_file, (self._worker, path, self.encoding,
+                              self._known_digests(path), data),
+                callback=functools.partial(self._on_result, path, task_id))
+        self._timer.start()
+
+    def _on_result(self, path, task_id, result):
+        # called from the pool result thread
+        self._results.append((path, task_id, result))
+
+    def _known_digests(self, path):
+        digests = set(self._cached_digests.get(path, ()))
+        if path in self._digests:
+            digests.add(self._digests[path])
+        return digests
+
+    def _cache_results(self, path, digest, results):
+        key = (path, digest)
+        if key in self._cached_results:
+            # move to the end (most recently used)
+            del self._cached_results[key]
+        else:
+            self._cached_digests.setdefault(path, set()).add(digest)
+        self._cached_results[key] = results
+        while len(self._cached_results) > self.max_cached_results:
+            (old_path, old_digest), _ = self._cached_results.popitem(
+                last=False)
+            digests = self._cached_digests[old_path]
+            digests.discard(old_digest)
+            if not digests:
+                del self._cached_digests[old_path]
+
+    def _discard_results(self, path):
+        """
+        Forgets the digests and the cached results of a file so that it is
+        checked again.
+        """
+        self._digests.pop(path, None)
+        for digest in self._cached_digests.pop(path, ()):
+            del self._cached_results[(path, digest)]
+
+    def _process_results(self):
+        # imported here, the modes package depends on the api package
+        from pyqode.core.modes import CheckerMessage
+        resubmit = []
+        while self._results:
+            path, task_id, (digest, results, error) = \
+                self._results.popleft()
+            if self._tasks.get(path) != task_id:
+                # file scheduled again or check cancelled
+                continue
+            del self._tasks[path]
+            if error is not None:
+                # keep the previous messages, the file will be checked again
+                # by the next call to check
+                _logger().error('failed to check %s:\n%s', path, error)
+                self._stats.pop(path, None)
+                self.file_check_failed.emit(path, error)
+                continue
+            if results is None:
+                if digest == self._digests.get(path):
+                    # content did not change
+                    continue
+                # content reverted to a previously checked content
+                results = self._cached_results.get((path, digest))
+                if results is None:
+                    # results dropped from the cache in the meantime
+                    resubmit.append(path)
+                    continue
+            self._cache_results(path, digest, results)
+            self._digests[path] = digest
+            messages = []
+            for result in results:
+                msg = CheckerMessage(*result)
+                if msg.path is None:
+                    msg.path = path
+                messages.append(msg)
+            self._messages[path] = messages
+            self._publish(path, messages)
+        if resubmit:
+            self._submit(resubmit)
+        if not self._tasks:
+            self._timer.stop()
+            self.finished.emit()
+
+    def _publish(self, path, messages):
+        self.file_checked.emit(path, messages)
+        if self.errors_table is not None:
+            self.errors_table.replace_file_messages(path, messages)
+
+    def _forget(self, path):
+        """
+        Forgets a file that has been removed.
+        """
+        self._stats.pop(path, None)
+        self._discard_results(path)
+        self._tasks.pop(path, None)
+        self._invalidate_deps(path)
+        if self._messages.pop(path, None):
+            self._publish(path, [])
@@ -13,13 +13,21 @@ open the same file.
 We also use this to cache some editor states (such as the last cursor position
 for a specific file path)
 
+The per file metadata (encoding, cursor position, fold state) are not stored
+in the QSettings but in a small sqlite database next to the QSettings file
+(see :class:`FileMetadataStore`), only the most recently used files are kept.
+
 We do not store editor styles and settings here. Those kind of settings are
 better handled at the application level.
 
 """
+import atexit
 import json
 import locale
 import logging
+import os
+import sqlite3
+import time
 from pyqode.qt import QtCore
 
 try:
@@ -29,23 +37,284 @@ except:
     pass  # python 3.2 not supported
 
 
+# settings file name -> path of the metadata database
+_STORE_PATHS = {}
+# settings files whose legacy maps have been migrated by this process
+_MIGRATED = set()
+
+
+class FileMetadataStore(object):
+    """
+    Stores the metadata of files (encoding, cursor position,...) in a sqlite
+    database, with one row per file.
+
+    Only the :attr:`max_files` most recently used files are kept. Writes
+    (and access time updates) are batched: they are kept in memory and
+    written in a single transaction after :attr:`flush_delay` ms, when
+    :attr:`batch_size` writes are pending or at exit.
+
+    Use :meth:`get` to get the store of a database (stores are shared by all
+    the :class:`Cache` instances that use the same database).
+    """
+    #: Max number of files kept in the store, the least recently used files
+    #: are removed first.
+    max_files = 5000
+    #: Delay (in ms) before pending writes are flushed to the database.
+    flush_delay = 2000
+    #: Max number of pending writes, more writes trigger a flush.
+    batch_size = 100
+
+    _stores = {}
+
+    @classmethod
+    def get(cls, path):
+        """
+        Gets the store of a database.
+
+        :param path: path of the sqlite database.
+        """
+        try:
+            return cls._stores[path]
+        except KeyError:
+            store = cls._stores[path] = cls(path)
+            return store
+
+    def __init__(self, path):
+        """
+        :param path: path of the sqlite database.
+        """
+        self.path = path
+        # file path -> (metadata, access time), metadata is None for files
+        # that must be removed from the database
+        self._pending = {}
+        self._flush_scheduled = False
+        self._db = None
+        # last access time, access times are strictly increasing to keep
+        # the LRU order with a low resolution clock
+        self._atime = 0
+        atexit.register(self.flush)
+
+    def _connect(self):
+        if self._db is None:
+            try:
+                dirname = os.path.dirname(self.path)
+                if dirname and not os.path.exists(dirname):
+                    os.makedirs(dirname)
+                self._db = sqlite3.connect(self.path)
+                self._create_tables()
+            except (sqlite3.Error, OSError):
+                _logger().exception(
+                    'failed to open %s, using an in-memory database',
+                    self.path)
+                self._db = sqlite3.connect(':memory:')
+                self._create_tables()
+        return self._db
+
+    def _create_tables(self):
+        with self._db:
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS files ('
+                'path TEXT PRIMARY KEY, metadata TEXT, atime REAL)')
+            self._db.execute(
+                'CREATE INDEX IF NOT EXISTS files_atime ON files (atime)')
+
+    def _load(self, file_path):
+        try:
+            return self._pending[file_path][0] or {}
+        except KeyError:
+            row = self._connect().execute(
+                'SELECT metadata FROM files WHERE path = ?',
+                (file_path, )).fetchone()
+            if row is None:
+                return None
+            return json.loads(row[0])
+
+    def value(self, file_path, key, default=None):
+        """
+        Gets a metadata of a file. The file is marked as recently used.
+
+        :param file_path: path of the file
+        :param key: metadata key
+        :param default: value returned if the metadata is not set
+        """
+        metadata = self._load(file_path)
+        if metadata is None:
+            return default
+        self._write(file_path, metadata)
+        return metadata.get(key, default)
+
+    def set_value(self, file_path, key, value):
+        """
+        Sets a metadata of a file. The file is marked as recently used.
+
+        :param file_path: path of the file
+        :param key: metadata key
+        :param value: metadata value (must be json serializable), None to
+            remove the metadata.
+        """
+        metadata = self._load(file_path) or {}
+        if value is None:
+            if key not in metadata:
+                return
+            del metadata[key]
+        else:
+            metadata[key] = value
+        self._write(file_path, metadata)
+
+    def import_values(self, key, values):
+        """
+        Imports the values of a metadata, used to migrate the maps that were
+        stored in the QSettings. Existing values are not overwritten and the
+        imported files are considered as the least recently used.
+
+        :param key: metadata key
+        :param values: map of file path -> value
+        """
+        self.flush()
+        db = self._connect()
+        try:
+            with db:
+                for file_path, value in values.items():
+                    row = db.execute(
+                        'SELECT metadata FROM files WHERE path = ?',
+                        (file_path, )).fetchone()
+                    if row is None:
+                        db.execute('INSERT INTO files VALUES (?, ?, 0)',
+                                   (file_path, json.dumps({key: value})))
+                        continue
+                    metadata = json.loads(row[0])
+                    if key not in metadata:
+                        metadata[key] = value
+                        db.execute(
+                            'UPDATE files SET metadata = ? WHERE path = ?',
+                            (json.dumps(metadata), file_path))
+                self._evict(db)
+        except sqlite3.Error:
+            _logger().exception('failed to import %s values', key)
+
+    def clear(self):
+        """
+        Removes all the files from the store.
+        """
+        self._pending.clear()
+        db = self._connect()
+        with db:
+            db.execute('DELETE FROM files')
+
+    def flush(self):
+        """
+        Writes the pending changes to the database.
+        """
+        self._flush_scheduled = False
+        if not self._pending:
+            return
+        pending = self._pending
+        self._pending = {}
+        db = self._connect()
+        try:
+            with db:
+                db.executemany(
+                    'INSERT OR REPLACE INTO files VALUES (?, ?, ?)',
+                    [(file_path, json.dumps(metadata), atime)
+                     for file_path, (metadata, atime) in pending.items()
+                     if metadata])
+                db.executemany(
+                    'DELETE FROM files WHERE path = ?',
+                    [(file_path, )
+                     for file_path, (metadata, atime) in pending.items()
+                     if not metadata])
+                self._evict(db)
+        except sqlite3.Error:
+            _logger().exception('failed to write %s', self.path)
+
+    def _evict(self, db):
+        count = db.execute('SELECT COUNT(*) FROM files').fetchone()[0]
+        if count > self.max_files:
+            db.execute(
+                'DELETE FROM files WHERE path IN (SELECT path FROM files '
+                'ORDER BY atime DESC LIMIT -1 OFFSET ?)', (self.max_files, ))
+
+    def _write(self, file_path, metadata):
+        self._atime = max(time.time(), self._atime + 1e-6)
+        self._pending[file_path] = (metadata, self._atime)
+        if len(self._pending) >= self.batch_size:
+            self.flush()
+        elif not self._flush_scheduled:
+            if QtCore.QCoreApplication.instance() is None:
+                # no event loop
+                self.flush()
+            else:
+                self._flush_scheduled = True
+                QtCore.QTimer.singleShot(self.flush_delay, self.flush)
+
+
 class Cache(object):
     """
     Provides an easy acces to the cache by exposing some wrapper properties
     over QSettings.
 
+    The per file metadata are stored in a :class:`FileMetadataStore`.
+
     """
+    #: QSettings keys of the per file maps used by previous versions, they
+    #: are migrated to the metadata store.
+    LEGACY_KEYS = [
+        ('cachedFileEncodings', 'encoding'),
+        ('cachedCursorPosition', 'cursor')
+    ]
+
     def __init__(self, suffix='', qsettings=None):
         if qsettings is None:
             self._settings = QtCore.QSettings('pyQode', 'pyqode.core%s' % suffix)
         else:
             self._settings = qsettings
+        self._store = FileMetadataStore.get(self._store_path())
+        self._migrate()
+
+    def _store_path(self):
+        """
+        Returns the path of the metadata database, next to the QSettings
+        file (the ini file path is used if the settings are stored in the
+        registry). The path is computed once per settings file.
+        """
+        settings = self._settings
+        try:
+            return _STORE_PATHS[settings.fileName()]
+        except KeyError:
+            ini_settings = settings
+            if settings.format() != QtCore.QSettings.IniFormat:
+                ini_settings = QtCore.QSettings(
+                    QtCore.QSettings.IniFormat, settings.scope(),
+                    settings.organizationName(), settings.applicationName())
+            path = _STORE_PATHS[settings.fileName()] = os.path.splitext(
+                ini_settings.fileName())[0] + '.sqlite'
+            return path
+
+    def _migrate(self):
+        """
+        Moves the per file maps of previous versions from the QSettings to
+        the metadata store. This is done once per process (and settings
+        file).
+        """
+        if self._settings.fileName() in _MIGRATED:
+            return
+        _MIGRATED.add(self._settings.fileName())
+        for settings_key, key in self.LEGACY_KEYS:
+            if not self._settings.contains(settings_key):
+                continue
+            try:
+                values = json.loads(self._settings.value(settings_key))
+            except (TypeError, ValueError):
+                values = {}
+            self._store.import_values(key, values)
+            self._settings.remove(settings_key)
 
     def clear(self):
         """
         Clears the cache.
         """
         self._settings.clear()
+        self._store.clear()
 
     @property
     def preferred_encodings(self):
@@ -69,37 +338,100 @@ class Cache(object):
         self._settings.setValue('userDefinedEncodings',
                                 json.dumps(list(set(lst))))
 
+    @property
+    def cached_lexers(self):
+        """
+        The map of pygments lexers resolved by
+        :class:`pyqode.core.modes.pygments_sh.LexerCache` (only used if the
+        lexer cache is persistent).
+
+        Keys are the cache keys (extension, file name or mime type) prefixed
+        by the pygments version, values are the lexer class paths
+        ("module:ClassName").
+        """
+        try:
+            return json.loads(self._settings.value('cachedLexers'))
+        except TypeError:
+            return {}
+
+    @cached_lexers.setter
+    def cached_lexers(self, value):
+        self._settings.setValue('cachedLexers', json.dumps(value))
+
+    @property
+    def cached_lexer_patterns(self):
+        """
+        The special file name patterns of the pygments lexers, computed by
+        :class:`pyqode.core.modes.pygments_sh.LexerCache` (only used if the
+        lexer cache is persistent).
+
+        The value is a dict with the pygments ``version`` and the file name
+        regular expression (``pattern``), an empty dict if nothing is cached.
+        """
+        try:
+            return json.loads(self._settings.value('cachedLexerPatterns'))
+        except TypeError:
+            return {}
+
+    @cached_lexer_patterns.setter
+    def cached_lexer_patterns(self, value):
+        self._settings.setValue('cachedLexerPatterns', json.dumps(value))
+
     def get_file_encoding(self, file_path, preferred_encoding=None):
         """
         Gets an eventual cached encoding for file_path.
 
+        If no encoding were cached, the encoding is detected: the file is
+        read once and decoded with the encoding given by its byte order mark
+        (if any) or with the first preferred encoding that works.
+
         Raises a KeyError if no encoding were cached for the specified file
-        path.
+        path and no encoding could be detected.
 
         :param file_path: path of the file to look up
+        :param preferred_encoding: encoding to try before the user preferred
+            encodings.
         :returns: The cached encoding.
         """
         _logger().debug('getting encoding for %s', file_path)
         try:
-            map = json.loads(self._settings.value('cachedFileEncodings'))
-        except TypeError:
-            map = {}
-        try:
-            return map[file_path]
+            return self.get_cached_file_encoding(file_path)
         except KeyError:
-            encodings = self.preferred_encodings
-            if preferred_encoding:
-                encodings.insert(0, preferred_encoding)
-            for encoding in encodings:
-                _logger().debug('trying encoding: %s', encoding)
-                try:
-                    with open(file_path, encoding=encoding) as f:
-                        f.read()
-                except (UnicodeDecodeError, IOError, OSError):
-                    pass
-                else:
-                    return encoding
+            from pyqode.core.api import encodings
+            try:
+                return encodings.decode_file(
+                    file_path, self.get_candidate_encodings(
+                        preferred_encoding))[0]
+            except (UnicodeError, IOError, OSError):
+                raise KeyError(file_path)
+
+    def get_cached_file_encoding(self, file_path):
+        """
+        Gets the cached encoding of file_path, without trying to detect it.
+
+        Raises a KeyError if no encoding were cached for the specified file
+        path.
+
+        :param file_path: path of the file to look up
+        :returns: The cached encoding.
+        """
+        encoding = self._store.value(file_path, 'encoding')
+        if encoding is None:
             raise KeyError(file_path)
+        return encoding
+
+    def get_candidate_encodings(self, preferred_encoding=None):
+        """
+        Gets the list of encodings to try to decode a file whose encoding
+        is not cached: preferred_encoding followed by the user preferred
+        encodings.
+
+        :param preferred_encoding: encoding to try first.
+        """
+        encodings = self.preferred_encodings
+        if preferred_encoding:
+            encodings.insert(0, preferred_encoding)
+        return encodings
 
     def set_file_encoding(self, path, encoding):
         """
@@ -108,12 +440,7 @@ class Cache(object):
         :param path: path of the file to cache
         :param encoding: encoding to cache
         """
-        try:
-            map = json.loads(self._settings.value('cachedFileEncodings'))
-        except TypeError:
-            map = {}
-        map[path] = encoding
-        self._settings.setValue('cachedFileEncodings', json.dumps(map))
+        self._store.set_value(path, 'encoding', encoding)
 
     def get_cursor_position(self, file_path):
         """
@@ -122,14 +449,7 @@ class Cache(object):
         :param file_path: path of the file in the cache
         :return: Cached cursor position or (0, 0)
         """
-        try:
-            map = json.loads(self._settings.value('cachedCursorPosition'))
-        except TypeError:
-            map = {}
-        try:
-            pos = map[file_path]
-        except KeyError:
-            pos = 0
+        pos = self._store.value(file_path, 'cursor', 0)
         if isinstance(pos, list):
             # changed in pyqode 2.6.3, now we store the cursor position
             # instead of the line and column  (faster)
@@ -143,12 +463,31 @@ class Cache(object):
         :param path: path of the file to cache
         :param position: cursor position to cache
         """
-        try:
-            map = json.loads(self._settings.value('cachedCursorPosition'))
-        except TypeError:
-            map = {}
-        map[path] = position
-        self._settings.setValue('cachedCursorPosition', json.dumps(map))
+        self._store.set_value(path, 'cursor', position)
+
+    def get_fold_state(self, file_path):
+        """
+        Gets the cached fold state of file_path, i.e. the list of collapsed
+        fold triggers.
+
+        :param file_path: path of the file in the cache
+        :return: list of (line number, fingerprint) tuples, the fingerprint
+            is a checksum of the trigger line text.
+        """
+        return [tuple(trigger)
+                for trigger in self._store.value(file_path, 'folds', [])]
+
+    def set_fold_state(self, path, triggers):
+        """
+        Cache the fold state of the specified file path.
+
+        :param path: path of the file to cache
+        :param triggers: list of collapsed fold triggers, as (line number,
+            fingerprint) tuples. An empty list clears the cached state.
+        """
+        self._store.set_value(
+            path, 'folds',
+            [list(trigger) for trigger in triggers] if triggers else None)
 
 
 def _logger():
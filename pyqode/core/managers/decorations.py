@@ -1,37 +1,197 @@
 """
 Contains the text decorations manager
 """
+import bisect
+import heapq
+import itertools
 import logging
 from pyqode.core.api.manager import Manager
+from pyqode.qt import QtCore
 
 
 def _logger():
     return logging.getLogger(__name__)
 
 
+class _PositionIndex(object):
+    """
+    Interval index over the decoration selections.
+
+    Decorations are sorted by selection start, ``_max_ends[i]`` is the
+    greatest selection end of the first ``i + 1`` decorations: a backward
+    scan from the last decoration that starts before a range can stop as
+    soon as no previous decoration reaches the range.
+
+    The index follows the text changes that do not touch any decoration
+    (see :meth:`apply_change`).
+    """
+    def __init__(self, decorations):
+        items = sorted(((d.cursor.selectionStart(), d.cursor.selectionEnd(), d)
+                        for d in decorations), key=lambda item: item[0])
+        self._starts = [item[0] for item in items]
+        self._ends = [item[1] for item in items]
+        self._decorations = [item[2] for item in items]
+        self._max_ends = []
+        max_end = -1
+        for end in self._ends:
+            max_end = max(max_end, end)
+            self._max_ends.append(max_end)
+
+    def overlapping(self, start, end):
+        """
+        Returns the decorations whose selection intersects [start, end].
+        """
+        ret_val = []
+        i = bisect.bisect_right(self._starts, end) - 1
+        while i >= 0 and self._max_ends[i] >= start:
+            if self._ends[i] >= start:
+                ret_val.append(self._decorations[i])
+            i -= 1
+        return ret_val
+
+    def apply_change(self, position, removed, added):
+        """
+        Shifts the decorations that follow a text change.
+
+        :returns: False if the change touches a decoration (the text cursors
+            of the decorations may have moved differently, the index must be
+            built again).
+        """
+        k = bisect.bisect_right(self._starts, position + removed)
+        if k and self._max_ends[k - 1] >= position:
+            return False
+        delta = added - removed
+        if delta and k < len(self._starts):
+            self._starts[k:] = [pos + delta for pos in self._starts[k:]]
+            self._ends[k:] = [pos + delta for pos in self._ends[k:]]
+            self._max_ends[k:] = [pos + delta for pos in self._max_ends[k:]]
+        return True
+
+
 class TextDecorationsManager(Manager):
     """
     Manages the collection of TextDecoration that have been set on the editor
     widget.
+
+    Decorations are kept sorted by draw order (decorations that have the same
+    draw order are kept in insertion order).
+
+    Pushing the decorations to the editor (``setExtraSelections``) is
+    expensive, the manager coalesces the modifications and pushes the
+    decorations once per event loop iteration. Use :meth:`begin_update` and
+    :meth:`end_update` to group a set of modifications and push them at once
+    as soon as the update is finished::
+
+        editor.decorations.begin_update()
+        try:
+            for deco in decorations:
+                editor.decorations.append(deco)
+        finally:
+            editor.decorations.end_update()
+
+    Decorations can be grouped in named layers (e.g. "occurrences",
+    "search",...). A layer can be replaced or restyled in one operation and
+    hidden without removing its decorations::
+
+        editor.decorations.replace_layer('search', decorations)
+        editor.decorations.restyle_layer(
+            'search', lambda deco: deco.set_background(brush))
+        editor.decorations.set_layer_visible('search', False)
+
+    When there are more than :attr:`clip_threshold` decorations, only the
+    decorations that intersect the visible blocks (plus :attr:`clip_margin`
+    blocks above and below) are given to the editor, the visible decorations
+    are updated when the editor is scrolled out of that range.
+
+    .. note:: The draw order of a decoration is read when the decoration is
+        appended, to change it, remove the decoration and append it again.
     """
     def __init__(self, editor):
         super(TextDecorationsManager, self).__init__(editor)
+        #: Number of decorations above which only the decorations close to
+        #: the viewport are given to the editor.
+        self.clip_threshold = 500
+        #: Number of blocks, above and below the visible blocks, whose
+        #: decorations are given to the editor when decorations are clipped.
+        self.clip_margin = 100
         self._decorations = []
+        # sort keys of the decorations: (draw_order, insertion number)
+        self._keys = []
+        # sort key of each decoration, by decoration id
+        self._deco_keys = {}
+        self._counter = itertools.count()
+        # (key, decoration) appended during a batch update, they are sorted
+        # and merged once at the end of the update
+        self._pending = []
+        # layer name -> {decoration id: decoration}
+        self._layers = {}
+        # layer name of each decoration, by decoration id
+        self._deco_layers = {}
+        self._hidden_layers = set()
+        self._update_depth = 0
+        self._dirty = False
+        self._flush_scheduled = False
+        # positional index, built lazily, dropped when the decorations change
+        # and shifted on text changes
+        self._index = None
+        self._document = None
+        # range of blocks whose decorations have been given to the editor
+        # (None if decorations are not clipped)
+        self._clip_range = None
+        self._first_visible = -1
+        self._block_count = -1
+        editor.updateRequest.connect(self._on_update_request)
+
+    def decorations_at(self, cursor):
+        """
+        Returns the decorations that contain a text cursor, sorted by draw
+        order.
 
-    def append(self, decoration):
+        :param cursor: The text cursor to test
+        :type cursor: QtGui.QTextCursor
+        :returns: list of pyqode.core.api.TextDecoration
+        """
+        position = cursor.position()
+        return sorted(
+            (d for d in self._get_index().overlapping(position, position)
+             if d.contains_cursor(cursor)), key=self._sort_key)
+
+    def decorations_in_range(self, start, end):
+        """
+        Returns the decorations whose selection intersects a range of
+        positions, sorted by draw order.
+
+        :param start: start position
+        :param end: end position
+        :returns: list of pyqode.core.api.TextDecoration
+        """
+        return sorted(self._get_index().overlapping(start, end),
+                      key=self._sort_key)
+
+    def append(self, decoration, layer=None):
         """
         Adds a text decoration on a CodeEdit instance
 
         :param decoration: Text decoration to add
         :type decoration: pyqode.core.api.TextDecoration
+        :param layer: Name of the layer of the decoration (optional)
         """
-        if decoration not in self._decorations:
-            self._decorations.append(decoration)
-            self._decorations = sorted(
-                self._decorations, key=lambda sel: sel.draw_order)
-            self.editor.setExtraSelections(self._decorations)
-            return True
-        return False
+        if id(decoration) in self._deco_keys:
+            return False
+        key = (decoration.draw_order, next(self._counter))
+        if self._update_depth:
+            self._pending.append((key, decoration))
+        else:
+            index = bisect.bisect_right(self._keys, key)
+            self._keys.insert(index, key)
+            self._decorations.insert(index, decoration)
+        self._deco_keys[id(decoration)] = key
+        if layer is not None:
+            self._layers.setdefault(layer, {})[id(decoration)] = decoration
+            self._deco_layers[id(decoration)] = layer
+        self._index = None
+        self._changed()
+        return True
 
     def remove(self, decoration):
         """
@@ -41,25 +201,293 @@ class TextDecorationsManager(Manager):
         :type decoration: pyqode.core.api.TextDecoration
         """
         try:
-            self._decorations.remove(decoration)
-            self.editor.setExtraSelections(self._decorations)
-            return True
-        except ValueError:
+            key = self._deco_keys.pop(id(decoration))
+        except KeyError:
             return False
+        self._merge_pending()
+        index = bisect.bisect_left(self._keys, key)
+        del self._keys[index]
+        del self._decorations[index]
+        layer = self._deco_layers.pop(id(decoration), None)
+        if layer is not None:
+            del self._layers[layer][id(decoration)]
+        self._index = None
+        self._changed()
+        return True
 
     def clear(self):
         """
         Removes all text decoration from the editor.
 
         """
-        self._decorations[:] = []
+        self._decorations = []
+        self._keys = []
+        self._pending = []
+        self._deco_keys.clear()
+        self._layers.clear()
+        self._deco_layers.clear()
+        self._index = None
+        self._dirty = True
+        if not self._update_depth:
+            self._flush()
+
+    def layer(self, name):
+        """
+        Returns the decorations of a layer, sorted by draw order.
+
+        :param name: Name of the layer
+        """
+        return sorted(self._layers.get(name, {}).values(), key=self._sort_key)
+
+    def replace_layer(self, name, decorations):
+        """
+        Replaces the decorations of a layer. The editor is updated once.
+
+        :param name: Name of the layer
+        :param decorations: The new decorations of the layer
+        """
+        self._remove_decorations(self._layers.pop(name, {}))
+        layer = {}
+        new = []
+        for decoration in decorations:
+            if id(decoration) in self._deco_keys:
+                continue
+            key = (decoration.draw_order, next(self._counter))
+            self._deco_keys[id(decoration)] = key
+            self._deco_layers[id(decoration)] = name
+            layer[id(decoration)] = decoration
+            new.append((key, decoration))
+        if layer:
+            self._layers[name] = layer
+            self._merge(new)
+        self._index = None
+        self._changed()
+
+    def clear_layer(self, name):
+        """
+        Removes all the decorations of a layer.
+
+        :param name: Name of the layer
+        """
+        decorations = self._layers.pop(name, None)
+        if decorations:
+            self._remove_decorations(decorations)
+            self._index = None
+            self._changed()
+
+    def restyle_layer(self, name, function):
+        """
+        Calls ``function`` on each decoration of a layer and updates the
+        editor once.
+
+        :param name: Name of the layer
+        :param function: callable that takes a decoration and changes its
+            format.
+        """
+        decorations = self._layers.get(name)
+        if decorations:
+            for decoration in decorations.values():
+                function(decoration)
+            self._changed()
+
+    def set_layer_visible(self, name, visible):
+        """
+        Shows or hides the decorations of a layer. Hidden decorations are
+        kept in the manager but are not given to the editor.
+
+        :param name: Name of the layer
+        :param visible: True to show the layer, False to hide it
+        """
+        if visible == self.is_layer_visible(name):
+            return
+        if visible:
+            self._hidden_layers.remove(name)
+        else:
+            self._hidden_layers.add(name)
+        self._index = None
+        self._changed()
+
+    def is_layer_visible(self, name):
+        """
+        Checks if a layer is visible.
+
+        :param name: Name of the layer
+        """
+        return name not in self._hidden_layers
+
+    def _remove_decorations(self, decorations):
+        """
+        Removes a {decoration id: decoration} dict of decorations in a single
+        pass.
+        """
+        if not decorations:
+            return
+        self._merge_pending()
+        keys = []
+        kept = []
+        for key, decoration in zip(self._keys, self._decorations):
+            if id(decoration) not in decorations:
+                keys.append(key)
+                kept.append(decoration)
+        self._keys = keys
+        self._decorations = kept
+        for deco_id in decorations:
+            del self._deco_keys[deco_id]
+            self._deco_layers.pop(deco_id, None)
+
+    def _shown_decorations(self):
+        """
+        Returns the decorations that are not in a hidden layer.
+        """
+        self._merge_pending()
+        if not self._hidden_layers:
+            return self._decorations
+        hidden = set()
+        for name in self._hidden_layers:
+            hidden.update(self._layers.get(name, {}))
+        return [d for d in self._decorations if id(d) not in hidden]
+
+    def begin_update(self):
+        """
+        Starts a batch update: the decorations won't be pushed to the editor
+        until :meth:`end_update` is called. Calls can be nested.
+
+        The decorations appended during the update are sorted once, at the
+        end of the update.
+        """
+        self._update_depth += 1
+
+    def end_update(self):
+        """
+        Ends a batch update, the decorations are pushed to the editor
+        immediately if they changed.
+        """
+        if self._update_depth:
+            self._update_depth -= 1
+        if not self._update_depth:
+            self._merge_pending()
+            if self._dirty:
+                self._flush()
+
+    def _merge(self, new):
+        """
+        Merges a list of (key, decoration) into the sorted decorations.
+        """
+        new.sort(key=lambda item: item[0])
+        # keys are unique, decorations are never compared
+        merged = list(heapq.merge(zip(self._keys, self._decorations), new))
+        self._keys = [item[0] for item in merged]
+        self._decorations = [item[1] for item in merged]
+
+    def _merge_pending(self):
+        """
+        Merges the decorations appended during a batch update.
+        """
+        if self._pending:
+            pending = self._pending
+            self._pending = []
+            self._merge(pending)
+
+    def _changed(self):
+        self._dirty = True
+        if not self._update_depth and not self._flush_scheduled:
+            self._flush_scheduled = True
+            QtCore.QTimer.singleShot(0, self._flush)
+
+    def _flush(self):
+        self._flush_scheduled = False
+        if not self._dirty or self._update_depth:
+            return
+        self._dirty = False
+        editor = self.editor
+        if editor is None:
+            return
         try:
-            self.editor.setExtraSelections(self._decorations)
+            selections = self._shown_decorations()
+            if len(selections) > self.clip_threshold:
+                selections = self._visible_decorations(editor)
+            else:
+                self._clip_range = None
+            editor.setExtraSelections(selections)
         except RuntimeError:
+            # editor already deleted
             pass
 
+    def _sort_key(self, decoration):
+        return self._deco_keys[id(decoration)]
+
+    def _get_index(self):
+        editor = self.editor
+        document = editor.document() if editor is not None else None
+        if document is not self._document:
+            # editor.setDocument has been called (e.g. by CodeEdit.link)
+            if self._document is not None:
+                try:
+                    self._document.contentsChange.disconnect(
+                        self._on_contents_change)
+                except (RuntimeError, TypeError):
+                    pass
+            self._document = document
+            if document is not None:
+                document.contentsChange.connect(self._on_contents_change)
+            self._index = None
+        if self._index is None:
+            self._index = _PositionIndex(self._shown_decorations())
+        return self._index
+
+    def _visible_block_range(self, editor):
+        first = editor.firstVisibleBlock().blockNumber()
+        last = editor.cursorForPosition(QtCore.QPoint(
+            0, editor.viewport().height())).blockNumber()
+        return first, last
+
+    def _visible_decorations(self, editor):
+        first, last = self._visible_block_range(editor)
+        doc = editor.document()
+        start = max(0, first - self.clip_margin)
+        end = min(doc.blockCount() - 1, last + self.clip_margin)
+        self._clip_range = start, end
+        self._first_visible = first
+        self._block_count = doc.blockCount()
+        end_block = doc.findBlockByNumber(end)
+        return self.decorations_in_range(
+            doc.findBlockByNumber(start).position(),
+            end_block.position() + end_block.length())
+
+    def _on_contents_change(self, position, removed, added):
+        # decorations positions are updated by their text cursors, the
+        # index is shifted unless the change touches a decoration
+        if (self._index is not None and
+                not self._index.apply_change(position, removed, added)):
+            self._index = None
+        if self._clip_range is not None and \
+                self._document.blockCount() != self._block_count:
+            # blocks removed/inserted, decorations might have moved into the
+            # visible range.
+            self._block_count = self._document.blockCount()
+            self._changed()
+
+    def _on_update_request(self, *args):
+        if self._clip_range is None or self._dirty:
+            return
+        editor = self.editor
+        if editor is None:
+            return
+        first_visible = editor.firstVisibleBlock().blockNumber()
+        if first_visible == self._first_visible:
+            return
+        self._first_visible = first_visible
+        first, last = self._visible_block_range(editor)
+        start, end = self._clip_range
+        if first < start or last > end:
+            self._changed()
+
+    def __contains__(self, decoration):
+        return id(decoration) in self._deco_keys
+
     def __iter__(self):
+        self._merge_pending()
         return iter(self._decorations)
 
     def __len__(self):
-        return len(self._decorations)
+        return len(self._deco_keys)
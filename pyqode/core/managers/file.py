@@ -7,12 +7,15 @@ try:
     from future.builtins import str
 except:
     pass  # python 3.2 not supported
+import io
 import locale
 import logging
 import mimetypes
 import os
+import zlib
+from pyqode.core.api.encodings import decode_file
 from pyqode.core.api.manager import Manager
-from pyqode.core.api.utils import TextHelper
+from pyqode.core.api.utils import TextHelper, TextBlockHelper
 from pyqode.qt import QtCore, QtWidgets
 from pyqode.core.cache import Cache
 
@@ -174,6 +177,13 @@ class FileManager(Manager):
         #: True to restore cursor position (if the document has already been
         # opened once).
         self.restore_cursor = True
+        #: True to restore the collapsed fold triggers (if the document has
+        #: already been opened once). The collapsed triggers are cached by
+        #: :meth:`close`.
+        self.restore_fold_state = True
+        #: Number of lines around its cached position where a collapsed fold
+        #: trigger is searched for if the file has been modified externally.
+        self.fold_state_search_range = 50
         #: Preferred EOL convention. This setting will be used for saving the
         #: document unles autodetect_eol is True.
         self._preferred_eol = self.EOL.System
@@ -209,7 +219,9 @@ class FileManager(Manager):
         class:`pyqode.core.panels.EncodingPanel` on the editor.
 
         pyqode automatically caches file encoding that you can later reuse it
-        automatically.
+        automatically. If there is no cached encoding, the file is decoded
+        with the encoding given by its byte order mark (if any) or with the
+        first of ``encoding`` and the user preferred encodings that works.
 
         :param path: Path of the file to open.
         :param encoding: Default file encoding. Default is to use the locale
@@ -227,15 +239,19 @@ class FileManager(Manager):
         self.opening = True
         settings = Cache()
         self._path = path
-        # get encoding from cache
+        # get encoding from cache, if there is no cached encoding, the
+        # encoding is detected while decoding the file (the file is read
+        # only once)
+        candidates = [encoding]
+        detect_bom = False
         if use_cached_encoding:
             try:
-                cached_encoding = settings.get_file_encoding(
-                    path, preferred_encoding=encoding)
+                encoding = settings.get_cached_file_encoding(path)
             except KeyError:
-                pass
+                candidates = settings.get_candidate_encodings(encoding)
+                detect_bom = True
             else:
-                encoding = cached_encoding
+                candidates = [encoding]
         enable_modes = os.path.getsize(path) < self._limit
         for m in self.editor.modes:
             if m.enabled:
@@ -244,17 +260,20 @@ class FileManager(Manager):
             self.editor.modes.clear()
         # open file and get its content
         try:
-            with open(path, 'Ur', encoding=encoding) as file:
-                content = file.read()
-                if self.autodetect_eol:
-                    self._eol = file.newlines
-                    if isinstance(self._eol, tuple):
-                        self._eol = self._eol[0]
-                    if self._eol is None:
-                        # empty file has no newlines
-                        self._eol = self.EOL.string(self.preferred_eol)
-                else:
+            encoding, content = decode_file(path, candidates,
+                                            detect_bom=detect_bom)
+            # universal newlines
+            decoder = io.IncrementalNewlineDecoder(None, True)
+            content = decoder.decode(content, True)
+            if self.autodetect_eol:
+                self._eol = decoder.newlines
+                if isinstance(self._eol, tuple):
+                    self._eol = self._eol[0]
+                if self._eol is None:
+                    # empty file has no newlines
                     self._eol = self.EOL.string(self.preferred_eol)
+            else:
+                self._eol = self.EOL.string(self.preferred_eol)
         except (UnicodeDecodeError, UnicodeError) as e:
             try:
                 from pyqode.core.panels import EncodingPanel
@@ -274,6 +293,8 @@ class FileManager(Manager):
             self.editor.setPlainText(
                 content, self.get_mimetype(path), self.encoding)
             self.editor.setDocumentTitle(self.editor.file.name)
+            if self.restore_fold_state:
+                self._restore_fold_state()
             ret_val = True
             _logger().debug('file open: %s', path)
         self.opening = False
@@ -296,6 +317,61 @@ class FileManager(Manager):
         self.editor.setTextCursor(tc)
         QtCore.QTimer.singleShot(1, self.editor.centerCursor)
 
+    @staticmethod
+    def _fold_fingerprint(text):
+        return zlib.crc32(text.strip().encode('utf-8')) & 0xFFFFFFFF
+
+    def _folding_panel(self):
+        try:
+            return self.editor.panels.get('FoldingPanel')
+        except KeyError:
+            return None
+
+    def _cache_fold_state(self):
+        """
+        Caches the collapsed fold triggers of the file.
+        """
+        if not self.path or self._folding_panel() is None:
+            return
+        from pyqode.core.api.folding import FoldIndex
+        doc = self.editor.document()
+        triggers = []
+        for line in FoldIndex.get(doc).triggers():
+            block = doc.findBlockByNumber(line)
+            if TextBlockHelper.is_collapsed(block):
+                triggers.append((line, self._fold_fingerprint(block.text())))
+        Cache().set_fold_state(self.path, triggers)
+
+    def _find_fold_trigger(self, line, fingerprint):
+        """
+        Finds a cached fold trigger: we first check the cached line number and
+        then look around it in case the file has been modified externally.
+        """
+        doc = self.editor.document()
+        for delta in range(self.fold_state_search_range + 1):
+            for nbr in ((line - delta, line + delta) if delta else (line, )):
+                block = doc.findBlockByNumber(nbr)
+                if (block.isValid() and
+                        TextBlockHelper.is_fold_trigger(block) and
+                        self._fold_fingerprint(block.text()) == fingerprint):
+                    return nbr
+        return None
+
+    def _restore_fold_state(self):
+        """
+        Restores the cached collapsed fold triggers, in a single batch.
+        """
+        panel = self._folding_panel()
+        if panel is None:
+            return
+        lines = []
+        for line, fingerprint in Cache().get_fold_state(self.path):
+            line = self._find_fold_trigger(line, fingerprint)
+            if line is not None:
+                lines.append(line)
+        if lines:
+            panel.collapse_triggers(lines)
+
     def reload(self, encoding):
         """
         Reload the file with another encoding.
@@ -436,6 +512,7 @@ class FileManager(Manager):
         """
         Cache().set_cursor_position(
             self.path, self.editor.textCursor().position())
+        self._cache_fold_state()
         self.editor._original_text = ''
         if clear:
             self.editor.clear()
@@ -448,3 +525,5 @@ class FileManager(Manager):
         self.safe_save = original.replace_tabs_by_spaces
         self.clean_trailing_whitespaces = original.clean_trailing_whitespaces
         self.restore_cursor = original.restore_cursor
+        self.restore_fold_state = original.restore_fold_state
+        self.fold_state_search_range = original.fold_state_search_range
@@ -2,12 +2,13 @@
 """
 This module contains the checker mode, a base class for code checker modes.
 """
+import bisect
 import logging
 from pyqode.core.api import TextBlockUserData
 from pyqode.core.api.decoration import TextDecoration
 from pyqode.core.api.mode import Mode
 from pyqode.core.backend import NotRunning
-from pyqode.core.api.utils import DelayJobRunner
+from pyqode.core.api.utils import DelayJobRunner, get_changed_blocks
 from pyqode.qt import QtCore, QtGui
 
 
@@ -91,6 +92,14 @@ class CheckerMessage(object):
         #: store a reference to the associated QTextBlock, for quick acces
         self.block = None
 
+    @property
+    def key(self):
+        """
+        Returns the key used to compare the messages of two analysis:
+        (line, col, status, description)
+        """
+        return self.line, self.col, self.status, self.description
+
     def __str__(self):
         return "{0} l{1}".format(self.description, self.line)
 
@@ -103,6 +112,17 @@ def _logger(klass):
     return logging.getLogger('%s [%s]' % (__name__, klass.__name__))
 
 
+def _remove_identical(messages, message):
+    """
+    Removes a message from a list. Messages are compared by identity
+    (:meth:`CheckerMessage.__eq__` does not compare the lines).
+    """
+    for i, msg in enumerate(messages):
+        if msg is message:
+            del messages[i]
+            return
+
+
 class CheckerMode(Mode, QtCore.QObject):
     """
     Performs a user defined code analysis job using the backend and
@@ -137,7 +157,16 @@ class CheckerMode(Mode, QtCore.QObject):
 
     Messages are displayed as text decorations on the editor. A checker panel
     will take care of display message icons next to each line.
+
+    Messages are stored per line, the text decorations and the block user
+    data messages are only created for the lines that are close to the
+    viewport (see :attr:`display_margin`), this keeps the editor responsive
+    with tens of thousands of messages. When lines are inserted or removed,
+    the line of the messages below the modification is updated.
     """
+    #: Signal emitted when messages have been added or removed.
+    messages_changed = QtCore.Signal()
+
     @property
     def messages(self):
         """
@@ -145,6 +174,14 @@ class CheckerMode(Mode, QtCore.QObject):
         """
         return self._messages
 
+    @property
+    def messages_per_line(self):
+        """
+        Returns the checker messages grouped by line number, as a dict
+        {line: [messages]}.
+        """
+        return self._lines
+
     def __init__(self, worker,
                  delay=500,
                  show_tooltip=True):
@@ -158,15 +195,31 @@ class CheckerMode(Mode, QtCore.QObject):
         """
         Mode.__init__(self)
         QtCore.QObject.__init__(self)
-        # max number of messages to keep good performances
-        self.limit = 200
+        #: Max number of messages, None means no limit.
+        self.limit = None
+        #: Number of lines, above and below the visible lines, for which
+        #: messages are displayed.
+        self.display_margin = 100
         self.ignore_rules = []
         self._job_runner = DelayJobRunner(delay=delay)
         self._messages = []
+        # message key -> messages (messages moved to the same line may share
+        # the same key)
+        self._keys = {}
+        # line -> messages, and the sorted list of lines that have messages
+        # (None if it needs to be recomputed)
+        self._lines = {}
+        self._sorted_lines = None
+        # range of lines whose messages are displayed, and the displayed
+        # lines.
+        self._display_range = None
+        self._displayed_lines = set()
+        self._first_visible = -1
+        # block count before the last document change
+        self._block_count = 0
         self._worker = worker
         self._mutex = QtCore.QMutex()
         self._show_tooltip = show_tooltip
-        self._pending_msg = []
         self._finished = True
 
     def set_ignore_rules(self, rules):
@@ -180,117 +233,257 @@ class CheckerMode(Mode, QtCore.QObject):
 
     def add_messages(self, messages):
         """
-        Adds a message or a list of message.
+        Adds a list of messages.
+
+        The new messages are compared with the current messages using
+        :attr:`CheckerMessage.key`: the current messages that are not in the
+        list are removed and only the messages that are not displayed yet
+        are added.
 
-        :param messages: A list of messages or a single message
+        :param messages: A list of messages
         """
-        # remove old messages
-        if len(messages) > self.limit:
+        if self.limit is not None and len(messages) > self.limit:
             messages = messages[:self.limit]
         _logger(self.__class__).log(5, 'adding %s messages' % len(messages))
-        self._finished = False
-        self._new_messages = messages
-        self._to_check = list(self._messages)
-        self._pending_msg = messages
-        # start removing messages, new message won't be added until we
-        # checked all message that need to be removed
-        QtCore.QTimer.singleShot(1, self._remove_batch)
-
-    def _remove_batch(self):
-        if self.editor is None:
-            return
-        for i in range(100):
-            if not len(self._to_check):
-                # all messages checker, start adding messages now
-                QtCore.QTimer.singleShot(1, self._add_batch)
-                self.editor.repaint()
-                return False
-            msg = self._to_check.pop(0)
-            if msg.block is None:
-                msg.block = self.editor.document().findBlockByNumber(msg.line)
-            if msg not in self._new_messages:
-                self.remove_message(msg)
+        new_keys = set(msg.key for msg in messages)
+        self.editor.decorations.begin_update()
+        try:
+            kept = []
+            for msg in self._messages:
+                if msg.key in new_keys:
+                    kept.append(msg)
+                else:
+                    self._remove_message(msg)
+            self._messages[:] = kept
+            for msg in messages:
+                if msg.line >= 0 and msg.key not in self._keys:
+                    self._add_message(msg)
+            self._update_display(force=True)
+        finally:
+            self.editor.decorations.end_update()
+        self._finished = True
         self.editor.repaint()
-        QtCore.QTimer.singleShot(1, self._remove_batch)
+        self.messages_changed.emit()
+
+    def _add_key(self, message):
+        self._keys.setdefault(message.key, []).append(message)
+
+    def _remove_key(self, message):
+        messages = self._keys.get(message.key)
+        if messages is not None:
+            _remove_identical(messages, message)
+            if not messages:
+                del self._keys[message.key]
+
+    def _get_sorted_lines(self):
+        if self._sorted_lines is None:
+            self._sorted_lines = sorted(self._lines)
+        return self._sorted_lines
+
+    def _add_message(self, message):
+        self._messages.append(message)
+        self._add_key(message)
+        try:
+            self._lines[message.line].append(message)
+        except KeyError:
+            self._lines[message.line] = [message]
+            self._sorted_lines = None
 
-    def _add_batch(self):
-        if self.editor is None:
+    def _remove_message(self, message):
+        """
+        Removes a message from the store (except from the list of messages,
+        it's up to the caller).
+        """
+        self._hide_message(message)
+        self._remove_key(message)
+        messages = self._lines.get(message.line)
+        if messages is not None:
+            _remove_identical(messages, message)
+            if not messages:
+                del self._lines[message.line]
+                self._sorted_lines = None
+
+    def _show_message(self, message):
+        """
+        Creates the message decoration and adds the message to its block
+        user data.
+        """
+        if message.decoration is not None:
             return
-        for i in range(10):
-            if not len(self._pending_msg):
-                # all pending message added
-                self._finished = True
-                _logger(self.__class__).log(5, 'finished')
-                self.editor.repaint()
-                return False
-            message = self._pending_msg.pop(0)
-            if message.line >= 0:
-                try:
-                    usd = message.block.userData()
-                except AttributeError:
-                    message.block = self.editor.document().findBlockByNumber(message.line)
-                    usd = message.block.userData()
-                if usd is None:
-                    usd = TextBlockUserData()
-                    message.block.setUserData(usd)
-                # check if the same message already exists
-                if message in usd.messages:
-                    continue
-                self._messages.append(message)
-                usd.messages.append(message)
-                tooltip = None
-                if self._show_tooltip:
-                    tooltip = message.description
-                message.decoration = TextDecoration(
-                    self.editor.textCursor(), start_line=message.line,
-                    tooltip=tooltip, draw_order=3)
-                message.decoration.set_full_width()
-                message.decoration.set_as_error(color=QtGui.QColor(
-                    message.color))
-                self.editor.decorations.append(message.decoration)
-        QtCore.QTimer.singleShot(1, self._add_batch)
-        self.editor.repaint()
-        return True
-
-    def remove_message(self, message):
+        if message.block is None or not message.block.isValid():
+            message.block = self.editor.document().findBlockByNumber(
+                message.line)
+            if not message.block.isValid():
+                message.block = self.editor.document().lastBlock()
+        usd = message.block.userData()
+        if usd is None:
+            usd = TextBlockUserData()
+            message.block.setUserData(usd)
+        usd.messages.append(message)
+        tooltip = None
+        if self._show_tooltip:
+            tooltip = message.description
+        message.decoration = TextDecoration(
+            message.block, tooltip=tooltip, draw_order=3)
+        message.decoration.set_full_width()
+        message.decoration.set_as_error(color=QtGui.QColor(message.color))
+        self.editor.decorations.append(message.decoration, layer='checker')
+
+    def _hide_message(self, message):
         """
-        Removes a message.
-
-        :param message: Message to remove
+        Removes the message decoration and removes the message from its
+        block user data.
         """
-        import time
-        _logger(self.__class__).log(5, 'removing message %s' % message)
-        t = time.time()
+        if message.decoration is None:
+            return
         usd = message.block.userData()
         if usd:
             try:
                 usd.messages.remove(message)
             except (AttributeError, ValueError):
                 pass
-        if message.decoration:
-            self.editor.decorations.remove(message.decoration)
+        self.editor.decorations.remove(message.decoration)
+        message.decoration = None
+
+    def _visible_lines(self):
+        first = self.editor.firstVisibleBlock().blockNumber()
+        last = self.editor.cursorForPosition(QtCore.QPoint(
+            0, self.editor.viewport().height())).blockNumber()
+        return first, last
+
+    def _update_display(self, force=False):
+        """
+        Shows the messages of the lines that are close to the viewport and
+        hides the others.
+
+        :param force: True to update the displayed messages even if the
+            viewport is still in the displayed range.
+        """
+        first, last = self._visible_lines()
+        self._first_visible = first
+        if not force and self._display_range is not None:
+            start, end = self._display_range
+            if start <= first and last <= end:
+                return
+        start = max(0, first - self.display_margin)
+        end = last + self.display_margin
+        self._display_range = start, end
+        sorted_lines = self._get_sorted_lines()
+        lines = set(sorted_lines[bisect.bisect_left(sorted_lines, start):
+                                 bisect.bisect_right(sorted_lines, end)])
+        self.editor.decorations.begin_update()
+        try:
+            for line in self._displayed_lines - lines:
+                for msg in self._lines.get(line, []):
+                    self._hide_message(msg)
+            for line in lines:
+                for msg in self._lines[line]:
+                    self._show_message(msg)
+        finally:
+            self.editor.decorations.end_update()
+        self._displayed_lines = lines
+
+    def _on_update_request(self, *args):
+        if self._messages and \
+                self.editor.firstVisibleBlock().blockNumber() != \
+                self._first_visible:
+            self._update_display()
+
+    def _on_contents_change(self, position, removed, added):
+        """
+        Updates the line of the messages when lines have been inserted or
+        removed. Only the lines that follow the modification are moved.
+        """
+        doc = self.editor.document()
+        changed = get_changed_blocks(doc, position, added, self._block_count)
+        self._block_count = doc.blockCount()
+        if changed is None or not self._lines:
+            return
+        start, end, old_end = changed
+        delta = end - old_end
+        if not delta:
+            return
+        sorted_lines = self._get_sorted_lines()
+        i = bisect.bisect_right(sorted_lines, start)
+        if i == len(sorted_lines):
+            return
+        moved = []
+        for line in sorted_lines[i:]:
+            moved.extend(self._lines.pop(line))
+        del sorted_lines[i:]
+        new_lines = {}
+        displayed = set(line for line in self._displayed_lines
+                        if line <= start)
+        for msg in moved:
+            if msg.decoration is not None and msg.block.isValid():
+                # displayed message, its block gives the new line
+                new_line = msg.block.blockNumber()
+            elif msg.line > old_end:
+                new_line = msg.line + delta
+            else:
+                # the line was in the modified range
+                new_line = min(msg.line, end)
+            if new_line != msg.line:
+                self._remove_key(msg)
+                msg.line = new_line
+                self._add_key(msg)
+            new_lines.setdefault(new_line, []).append(msg)
+            if msg.decoration is not None:
+                displayed.add(new_line)
+        for line in sorted(new_lines):
+            try:
+                self._lines[line].extend(new_lines[line])
+            except KeyError:
+                self._lines[line] = new_lines[line]
+                bisect.insort(sorted_lines, line)
+        self._displayed_lines = displayed
+        self.messages_changed.emit()
+
+    def remove_message(self, message):
+        """
+        Removes a message.
+
+        :param message: Message to remove
+        """
+        _logger(self.__class__).log(5, 'removing message %s' % message)
+        self._remove_message(message)
         self._messages.remove(message)
+        self.messages_changed.emit()
 
     def clear_messages(self):
         """
         Clears all messages.
         """
-        while len(self._messages):
-            msg = self._messages.pop(0)
-            usd = msg.block.userData()
-            if usd and hasattr(usd, 'messages'):
-                usd.messages[:] = []
-            if msg.decoration:
-                self.editor.decorations.remove(msg.decoration)
+        for msg in self._messages:
+            if msg.decoration is not None:
+                usd = msg.block.userData()
+                if usd and hasattr(usd, 'messages'):
+                    usd.messages[:] = []
+                msg.decoration = None
+        self._messages[:] = []
+        self._keys.clear()
+        self._lines.clear()
+        self._sorted_lines = None
+        self._displayed_lines = set()
+        self._display_range = None
+        self.editor.decorations.clear_layer('checker')
+        self.messages_changed.emit()
 
     def on_state_changed(self, state):
         if state:
             self.editor.textChanged.connect(self.request_analysis)
             self.editor.new_text_set.connect(self.clear_messages)
+            self.editor.updateRequest.connect(self._on_update_request)
+            self._block_count = self.editor.document().blockCount()
+            self.editor.document().contentsChange.connect(
+                self._on_contents_change)
             self.request_analysis()
         else:
             self.editor.textChanged.disconnect(self.request_analysis)
             self.editor.new_text_set.disconnect(self.clear_messages)
+            self.editor.updateRequest.disconnect(self._on_update_request)
+            self.editor.document().contentsChange.disconnect(
+                self._on_contents_change)
             self._job_runner.cancel_requests()
             self.clear_messages()
 
@@ -306,8 +499,6 @@ class CheckerMode(Mode, QtCore.QObject):
             msg = CheckerMessage(*msg)
             if msg.line >= self.editor.blockCount():
                 msg.line = self.editor.blockCount() - 1
-            block = self.editor.document().findBlockByNumber(msg.line)
-            msg.block = block
             messages.append(msg)
         self.add_messages(messages)
 
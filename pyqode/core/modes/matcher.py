@@ -2,7 +2,7 @@
 """
 This module contains the symbol matcher mode
 """
-from pyqode.core.api import get_block_symbol_data
+from pyqode.core.api import get_block_symbol_data, get_block_bracket_depths
 from pyqode.core.api.decoration import TextDecoration
 from pyqode.core.api.mode import Mode
 from pyqode.qt import QtGui
@@ -26,6 +26,10 @@ class SymbolMatcherMode(Mode):
         :class:`pyqode.core.api.SyntaxHighlighter` must be installed on
         the editor instance.
 
+    The brackets positions and the bracket depth summary of each block are
+    recorded by the syntax highlighter, the blocks that cannot contain the
+    matching symbol are skipped using their depth summary.
+
     """
     #: known symbols {SYMBOL: (OPEN, CLOSE)}, you can customise this map to
     #: add support for other symbols
@@ -113,16 +117,13 @@ class SymbolMatcherMode(Mode):
 
     def __init__(self):
         super(SymbolMatcherMode, self).__init__()
-        self._decorations = []
         self._match_background = QtGui.QBrush(QtGui.QColor('#B4EEB4'))
         self._match_foreground = QtGui.QColor('red')
         self._unmatch_background = QtGui.QBrush(QtGui.QColor('transparent'))
         self._unmatch_foreground = QtGui.QColor('red')
 
     def _clear_decorations(self):
-        for deco in self._decorations:
-            self.editor.decorations.remove(deco)
-        self._decorations[:] = []
+        self.editor.decorations.clear_layer('matcher')
 
     def symbol_pos(self, cursor, character_type=OPEN, symbol_type=PAREN):
         """
@@ -140,7 +141,7 @@ class SymbolMatcherMode(Mode):
         block = cursor.block()
         data = get_block_symbol_data(self.editor, block)
         self._match(symbol_type, data, block.position())
-        for deco in self._decorations:
+        for deco in self.editor.decorations.layer('matcher'):
             if deco.character == self.SYMBOLS[symbol_type][character_type]:
                 retval = deco.line, deco.column
                 break
@@ -149,15 +150,18 @@ class SymbolMatcherMode(Mode):
         return retval
 
     def _refresh_decorations(self):
-        for deco in self._decorations:
-            self.editor.decorations.remove(deco)
+        if self.editor is None:
+            return
+
+        def restyle(deco):
             if deco.match:
                 deco.set_foreground(self._match_foreground)
                 deco.set_background(self._match_background)
             else:
                 deco.set_foreground(self._unmatch_foreground)
                 deco.set_background(self._unmatch_background)
-            self.editor.decorations.append(deco)
+
+        self.editor.decorations.restyle_layer('matcher', restyle)
 
     def on_state_changed(self, state):
         if state:
@@ -201,6 +205,15 @@ class SymbolMatcherMode(Mode):
                     cpt -= 1
             current_block = current_block.next()
             i = 0
+            # skip the blocks where the depth never goes below the number
+            # of pending opening symbols
+            while current_block.isValid():
+                net, forward_min, _ = get_block_bracket_depths(
+                    self.editor, current_block)[symbol]
+                if forward_min <= -(cpt + 1):
+                    break
+                cpt += net
+                current_block = current_block.next()
         return False
 
     def _match_right(self, symbol, current_block, i, nb_right_paren):
@@ -221,6 +234,15 @@ class SymbolMatcherMode(Mode):
                     else:
                         nb_right_paren -= 1
             current_block = current_block.previous()
+            # skip the blocks where the depth never goes below the number
+            # of pending closing symbols
+            while current_block.isValid():
+                net, _, backward_min = get_block_bracket_depths(
+                    self.editor, current_block)[symbol]
+                if backward_min <= -(nb_right_paren + 1):
+                    break
+                nb_right_paren -= net
+                current_block = current_block.previous()
             data = get_block_symbol_data(self.editor, current_block)
             parentheses = data[symbol]
             i = len(parentheses) - 1
@@ -252,8 +274,7 @@ class SymbolMatcherMode(Mode):
         else:
             deco.set_foreground(self._unmatch_foreground)
             deco.set_background(self._unmatch_background)
-        self._decorations.append(deco)
-        self.editor.decorations.append(deco)
+        self.editor.decorations.append(deco, layer='matcher')
         return cursor
 
     def clone_settings(self, original):
@@ -1,16 +1,20 @@
 """
 This module contains the occurrences highlighter mode.
 """
-from pyqode.qt import QtGui
+from pyqode.qt import QtCore, QtGui
 from pyqode.core.api import Mode, DelayJobRunner, TextHelper, TextDecoration
-from pyqode.core.backend import NotRunning
-from pyqode.core.backend.workers import findall
+from pyqode.core.api.search import WordIndex
 
 
 class OccurrencesHighlighterMode(Mode):
     """ Highlights occurrences of the word under the text text cursor.
 
     The ``delay`` before searching for occurrences is configurable.
+
+    Occurrences are looked up in the document's
+    :class:`pyqode.core.api.WordIndex` and only the occurrences found near
+    the viewport are highlighted (see :attr:`display_margin`), they are
+    updated when the editor is scrolled.
     """
     @property
     def delay(self):
@@ -101,10 +105,15 @@ class OccurrencesHighlighterMode(Mode):
 
     def __init__(self):
         super(OccurrencesHighlighterMode, self).__init__()
-        self._decorations = []
         #: Timer used to run the search request with a specific delay
-        self.timer = DelayJobRunner(delay=1000)
+        self.timer = DelayJobRunner(delay=50)
+        #: Number of lines above and below the viewport where occurrences are
+        #: highlighted.
+        self.display_margin = 100
         self._sub = None
+        # range of lines where the occurrences are highlighted
+        self._display_range = None
+        self._first_visible = -1
         self._background = QtGui.QColor('#CCFFCC')
         self._foreground = None
         self._underlined = False
@@ -113,19 +122,26 @@ class OccurrencesHighlighterMode(Mode):
     def on_state_changed(self, state):
         if state:
             self.editor.cursorPositionChanged.connect(self._request_highlight)
+            self.editor.updateRequest.connect(self._on_update_request)
         else:
             self.editor.cursorPositionChanged.disconnect(
                 self._request_highlight)
+            self.editor.updateRequest.disconnect(self._on_update_request)
             self.timer.cancel_requests()
 
     def _clear_decos(self):
-        for d in self._decorations:
-            self.editor.decorations.remove(d)
-        self._decorations[:] = []
+        self._display_range = None
+        self.editor.decorations.clear_layer('occurrences')
 
     def _request_highlight(self):
         if self.editor is not None:
-            sub = TextHelper(self.editor).word_under_cursor(
+            helper = TextHelper(self.editor)
+            if helper.is_long_block(self.editor.textCursor().block()):
+                # don't search for words found on a huge line
+                self._clear_decos()
+                self._sub = None
+                return
+            sub = helper.word_under_cursor(
                 select_whole_word=True).selectedText()
             if sub != self._sub:
                 self._clear_decos()
@@ -139,42 +155,67 @@ class OccurrencesHighlighterMode(Mode):
         self._sub = TextHelper(self.editor).word_under_cursor(
             select_whole_word=True).selectedText()
         if not cursor.hasSelection() or cursor.selectedText() == self._sub:
-            request_data = {
-                'string': self.editor.toPlainText(),
-                'sub': self._sub,
-                'regex': False,
-                'whole_word': True,
-                'case_sensitive': self.case_sensitive
-            }
-            try:
-                self.editor.backend.send_request(findall, request_data,
-                                                 self._on_results_available)
-            except NotRunning:
-                self._request_highlight()
+            self._update_display(force=True)
+
+    def _visible_lines(self):
+        first = self.editor.firstVisibleBlock().blockNumber()
+        last = self.editor.cursorForPosition(QtCore.QPoint(
+            0, self.editor.viewport().height())).blockNumber()
+        return first, last
+
+    def _update_display(self, force=False):
+        """
+        Highlights the occurrences of the current word that are close to the
+        viewport.
+
+        :param force: True to update the occurrences even if the viewport is
+            still in the highlighted range.
+        """
+        first, last = self._visible_lines()
+        self._first_visible = first
+        if not force and self._display_range is not None:
+            start, end = self._display_range
+            if start <= first and last <= end:
+                return
+        index = WordIndex.get(self.editor.document())
+        if not self._sub or index.count(
+                self._sub, case_sensitive=self.case_sensitive) < 2:
+            self._clear_decos()
+            return
+        start = max(0, first - self.display_margin)
+        end = last + self.display_margin
+        self._display_range = start, end
+        self._on_results_available(index.occurrences(
+            self._sub, case_sensitive=self.case_sensitive,
+            first_line=start, last_line=end))
+
+    def _on_update_request(self, *args):
+        if self._display_range is not None and \
+                self.editor.firstVisibleBlock().blockNumber() != \
+                self._first_visible:
+            self._update_display()
 
     def _on_results_available(self, results):
-        if len(results) > 500:
-            # limit number of results (on very big file where a lots of
-            # occurrences can be found, this would totally freeze the editor
-            # during a few seconds, with a limit of 500 we can make sure
-            # the editor will always remain responsive).
-            results = results[:500]
         current = self.editor.textCursor().position()
-        if len(results) > 1:
-            for start, end in results:
-                if start <= current <= end:
-                    continue
-                deco = TextDecoration(self.editor.textCursor(),
-                                      start_pos=start, end_pos=end)
-                if self.underlined:
-                    deco.set_as_underlined(self._background)
-                else:
-                    deco.set_background(QtGui.QBrush(self._background))
-                    if self._foreground is not None:
-                        deco.set_foreground(self._foreground)
-                deco.draw_order = 3
-                self.editor.decorations.append(deco)
-                self._decorations.append(deco)
+        helper = TextHelper(self.editor)
+        doc = self.editor.document()
+        decorations = []
+        for start, end in results:
+            if start <= current <= end:
+                continue
+            if helper.is_long_block(doc.findBlock(start)):
+                continue
+            deco = TextDecoration(self.editor.textCursor(),
+                                  start_pos=start, end_pos=end)
+            if self.underlined:
+                deco.set_as_underlined(self._background)
+            else:
+                deco.set_background(QtGui.QBrush(self._background))
+                if self._foreground is not None:
+                    deco.set_foreground(self._foreground)
+            deco.draw_order = 3
+            decorations.append(deco)
+        self.editor.decorations.replace_layer('occurrences', decorations)
 
     def clone_settings(self, original):
         self.delay = original.delay
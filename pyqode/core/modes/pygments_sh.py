@@ -5,25 +5,32 @@ on pygments.
 
 .. note: This code is taken and adapted from the IPython project.
 """
+import fnmatch
+import importlib
 import logging
 import mimetypes
-import sys
+import os
+import re
 
+import pygments
 from pygments.formatters.html import HtmlFormatter
 from pygments.lexer import Error, RegexLexer, Text, _TokenType
 from pygments.lexers import get_lexer_for_filename, get_lexer_for_mimetype
+from pygments.lexers import get_all_lexers
 from pygments.lexers.agile import PythonLexer
 from pygments.lexers.compiled import CLexer, CppLexer
 from pygments.lexers.dotnet import CSharpLexer
 from pygments.lexers.special import TextLexer
-from pygments.styles import get_style_by_name, get_all_styles
+from pygments.styles import get_style_by_name
 from pygments.token import Whitespace, Comment, Token
 from pygments.util import ClassNotFound
 from pyqode.qt import QtGui
 from pyqode.qt.QtCore import QRegExp
 
 from pyqode.core.api.syntax_highlighter import (
-    SyntaxHighlighter, ColorScheme, TextBlockUserData)
+    SyntaxHighlighter, ColorScheme, TextBlockUserData, FormatCache)
+# for backward compatibility, the list is lazy and now lives in the api
+from pyqode.core.api.syntax_highlighter import PYGMENTS_STYLES
 
 
 def _logger():
@@ -31,11 +38,173 @@ def _logger():
     return logging.getLogger(__name__)
 
 
-#: A sorted list of available pygments styles, for convenience
-PYGMENTS_STYLES = sorted(list(get_all_styles()))
+class LexerCache(object):
+    """
+    Process-wide cache of the pygments lexer resolution.
+
+    The pygments lookup functions scan every registered lexer (and every
+    plugin entry point) each time they are called. This cache remembers the
+    lexer class resolved for a file extension, a file name or a mime type so
+    that opening a file with an already known extension does not pay the
+    discovery cost again.
+
+    File names that match one of the non trivial pygments file name
+    patterns (e.g. ``CMakeLists.txt`` or ``*.html.j2``) are cached by file
+    name instead of extension, the cache always resolves to the same lexer
+    as pygments.
+
+    Set :attr:`persistent` to True to persist the resolved lexers and the
+    special file name patterns between runs (they are stored in the pyqode
+    cache, see :attr:`pyqode.core.cache.Cache.cached_lexers`), so that the
+    registered lexers are only scanned on a cache miss.
+    """
+    #: True to persist the cache between runs. Default is False.
+    persistent = False
+
+    _classes = {}
+    _special_patterns = None
+    _loaded = False
+
+    @classmethod
+    def lexer_for_filename(cls, filename, **options):
+        """
+        Returns a lexer instance for the given file name. If pygments does
+        not know the file name, the lexer is guessed from the mime type of the
+        file (and falls back to a plain text lexer).
 
-if hasattr(sys, 'frozen'):
-    PYGMENTS_STYLES += ['darcula', 'qt']
+        :param filename: file name or path
+        :param options: lexer options
+        """
+        name = os.path.basename(filename)
+        # a file name key is only cached for special file names, look it up
+        # before computing the key (which requires the special patterns)
+        lexer_class = cls._get('name:%s' % name)
+        if lexer_class is not None:
+            return lexer_class(**options)
+        key = cls._filename_key(name)
+        lexer_class = cls._get(key)
+        if lexer_class is None:
+            try:
+                lexer_class = type(get_lexer_for_filename(filename))
+            except (ClassNotFound, ImportError):
+                _logger().debug('no lexer found for %s, guessing lexer '
+                                'from mimetype', filename)
+                try:
+                    mime = mimetypes.guess_type(filename)[0]
+                    lexer_class = type(get_lexer_for_mimetype(mime))
+                except (ClassNotFound, IndexError, ImportError):
+                    lexer_class = type(get_lexer_for_mimetype('text/plain'))
+            cls._set(key, lexer_class)
+        return lexer_class(**options)
+
+    @classmethod
+    def lexer_for_mimetype(cls, mime, **options):
+        """
+        Returns a lexer instance for the given mime type.
+
+        :param mime: mime type
+        :param options: lexer options
+        :raises: pygments.util.ClassNotFound if there is no lexer for the
+            mime type.
+        """
+        key = 'mime:%s' % mime
+        lexer_class = cls._get(key)
+        if lexer_class is None:
+            lexer_class = type(get_lexer_for_mimetype(mime))
+            cls._set(key, lexer_class)
+        return lexer_class(**options)
+
+    @classmethod
+    def clear(cls):
+        """
+        Clears the cache (in memory and persistent).
+        """
+        cls._classes.clear()
+        cls._special_patterns = None
+        if cls.persistent:
+            from pyqode.core.cache import Cache
+            cache = Cache()
+            cache.cached_lexers = {}
+            cache.cached_lexer_patterns = {}
+
+    @classmethod
+    def _get_special_patterns(cls):
+        """
+        Returns the compiled file name patterns of the lexers that are not a
+        simple extension pattern (``*.ext``). The registered lexers are only
+        scanned if the patterns are not in the (persistent) cache.
+        """
+        if cls._special_patterns is None:
+            pattern = None
+            if cls.persistent:
+                from pyqode.core.cache import Cache
+                cached = Cache().cached_lexer_patterns
+                if cached.get('version') == pygments.__version__:
+                    pattern = cached.get('pattern')
+            if pattern is None:
+                patterns = []
+                for _, _, filenames, _ in get_all_lexers():
+                    for ptrn in filenames:
+                        if not re.match(r'^\*\.[^*?\[\].]+$', ptrn):
+                            patterns.append('(?:%s)' % fnmatch.translate(ptrn))
+                # (?!) never matches
+                pattern = '|'.join(patterns) or '(?!)'
+                if cls.persistent:
+                    from pyqode.core.cache import Cache
+                    Cache().cached_lexer_patterns = {
+                        'version': pygments.__version__, 'pattern': pattern}
+            cls._special_patterns = re.compile(pattern)
+        return cls._special_patterns
+
+    @classmethod
+    def _filename_key(cls, name):
+        if cls._get_special_patterns().match(name):
+            return 'name:%s' % name
+        return 'ext:%s' % os.path.splitext(name)[1]
+
+    @classmethod
+    def _get(cls, key):
+        if cls.persistent and not cls._loaded:
+            cls._load()
+        return cls._classes.get(key)
+
+    @classmethod
+    def _set(cls, key, lexer_class):
+        cls._classes[key] = lexer_class
+        if cls.persistent:
+            from pyqode.core.cache import Cache
+            cache = Cache()
+            prefix = cls._version_prefix()
+            # drop the lexers resolved by another version of pygments
+            lexers = dict((k, v) for k, v in cache.cached_lexers.items()
+                          if k.startswith(prefix))
+            lexers[prefix + key] = '%s:%s' % (lexer_class.__module__,
+                                              lexer_class.__name__)
+            cache.cached_lexers = lexers
+
+    @staticmethod
+    def _version_prefix():
+        # persisted keys are prefixed by the pygments version, a pygments
+        # upgrade may change the resolved lexers.
+        return '%s|' % pygments.__version__
+
+    @classmethod
+    def _load(cls):
+        from pyqode.core.cache import Cache
+        cls._loaded = True
+        prefix = cls._version_prefix()
+        for key, path in Cache().cached_lexers.items():
+            if not key.startswith(prefix):
+                continue
+            key = key[len(prefix):]
+            module_name, class_name = path.split(':')
+            try:
+                lexer_class = getattr(
+                    importlib.import_module(module_name), class_name)
+            except (ImportError, AttributeError):
+                _logger().debug('failed to restore cached lexer %s', path)
+            else:
+                cls._classes.setdefault(key, lexer_class)
 
 
 def get_tokens_unprocessed(self, text, stack=('root',)):
@@ -164,9 +333,6 @@ class PygmentsSH(SyntaxHighlighter):
         self._style = None
         self._formatter = HtmlFormatter(nowrap=True)
         self._lexer = lexer if lexer else PythonLexer()
-
-        self._brushes = {}
-        self._formats = {}
         self._init_style()
         self._prev_block = None
 
@@ -178,7 +344,6 @@ class PygmentsSH(SyntaxHighlighter):
         """
         :type editor: pyqode.code.api.CodeEdit
         """
-        self._clear_caches()
         self._update_style()
         super(PygmentsSH, self).on_install(editor)
 
@@ -215,15 +380,9 @@ class PygmentsSH(SyntaxHighlighter):
         if filename.endswith("~"):
             filename = filename[0:len(filename) - 1]
         try:
-            self._lexer = get_lexer_for_filename(filename)
+            self._lexer = LexerCache.lexer_for_filename(filename)
         except (ClassNotFound, ImportError):
-            print('class not found for url', filename)
-            try:
-                m = mimetypes.guess_type(filename)
-                print(m)
-                self._lexer = get_lexer_for_mimetype(m[0])
-            except (ClassNotFound, IndexError, ImportError):
-                self._lexer = get_lexer_for_mimetype('text/plain')
+            self._lexer = None
         if self._lexer is None:
             _logger().warning('failed to get lexer from filename: %s, using '
                               'plain text instead...', filename)
@@ -236,7 +395,7 @@ class PygmentsSH(SyntaxHighlighter):
         :param mime: mime type
         :param options: optional addtional options.
         """
-        self._lexer = get_lexer_for_mimetype(mime, **options)
+        self._lexer = LexerCache.lexer_for_mimetype(mime, **options)
         _logger().debug('lexer for mimetype (%s): %r', mime, self._lexer)
 
     def highlight_block(self, text, block):
@@ -251,7 +410,7 @@ class PygmentsSH(SyntaxHighlighter):
             self._update_style()
         original_text = text
         if self.editor and self._lexer and self.enabled:
-            if block.blockNumber():
+            if block.blockNumber() and self._prev_block is not None:
                 prev_data = self._prev_block.userData()
                 if prev_data:
                     if hasattr(prev_data, "syntax_stack"):
@@ -269,9 +428,6 @@ class PygmentsSH(SyntaxHighlighter):
             for token, text in tokens:
                 length = len(text)
                 fmt = self._get_format(token)
-                if token in [Token.Literal.String, Token.Literal.String.Doc,
-                             Token.Comment]:
-                    fmt.setObjectType(fmt.UserObject)
                 self.setFormat(index, length, fmt)
                 index += length
 
@@ -292,6 +448,29 @@ class PygmentsSH(SyntaxHighlighter):
 
             self._prev_block = block
 
+    def highlight_long_block(self, text, block):
+        """
+        Highlights a long block without running the lexer. The lexer state
+        of the previous block is carried over, so the next block is lexed as
+        if the long block did not change the state.
+
+        :param text: text of the block to highlight
+        :param block: block to highlight
+        """
+        super(PygmentsSH, self).highlight_long_block(text, block)
+        usd = block.userData()
+        if usd is None:
+            usd = TextBlockUserData()
+            block.setUserData(usd)
+        prev_data = None
+        if block.blockNumber() and self._prev_block is not None:
+            prev_data = self._prev_block.userData()
+        if hasattr(prev_data, 'syntax_stack'):
+            usd.syntax_stack = prev_data.syntax_stack
+        elif hasattr(usd, 'syntax_stack'):
+            del usd.syntax_stack
+        self._prev_block = block
+
     def _update_style(self):
         """ Sets the style to the specified Pygments style.
         """
@@ -309,32 +488,29 @@ class PygmentsSH(SyntaxHighlighter):
             else:
                 self._style = get_style_by_name('default')
                 self._pygments_style = 'default'
-        self._clear_caches()
-
-    def _clear_caches(self):
-        """ Clear caches for brushes and formats.
-        """
-        self._brushes.clear()
-        self._formats.clear()
 
     def _get_format(self, token):
         """ Returns a QTextCharFormat for token or None.
+
+        Formats are shared by all the highlighters that use the same style
+        (see :class:`pyqode.core.api.FormatCache`).
         """
         if token == Whitespace:
             return self.editor.whitespaces_foreground
+        return FormatCache.get_format(
+            self._pygments_style, token, self._create_format)
 
-        if token in self._formats:
-            return self._formats[token]
-
-        result = self._get_format_from_style(token, self._style)
-
-        self._formats[token] = result
-        return result
+    def _create_format(self, token):
+        """ Creates the format of a token using the current style. """
+        return self._get_format_from_style(token, self._style)
 
     def _get_format_from_style(self, token, style):
         """ Returns a QTextCharFormat for token by reading a Pygments style.
         """
         result = QtGui.QTextCharFormat()
+        if token in [Token.Literal.String, Token.Literal.String.Doc,
+                     Token.Comment]:
+            result.setObjectType(result.UserObject)
         try:
             style = style.style_for_token(token)
         except KeyError:
@@ -361,23 +537,8 @@ class PygmentsSH(SyntaxHighlighter):
                     result.setFontStyleHint(QtGui.QFont.TypeWriter)
         return result
 
-    def _get_brush(self, color):
-        """ Returns a brush for the color.
-        """
-        result = self._brushes.get(color)
-        if result is None:
-            qcolor = self._get_color(color)
-            result = QtGui.QBrush(qcolor)
-            self._brushes[color] = result
-        return result
-
     @staticmethod
-    def _get_color(color):
-        """ Returns a QColor built from a Pygments color string.
+    def _get_brush(color):
+        """ Returns a brush for the color.
         """
-        color = str(color).replace("#", "")
-        qcolor = QtGui.QColor()
-        qcolor.setRgb(int(color[:2], base=16),
-                      int(color[2:4], base=16),
-                      int(color[4:6], base=16))
-        return qcolor
+        return FormatCache.get_brush(color)
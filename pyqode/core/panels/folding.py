@@ -2,6 +2,7 @@
 """
 This module contains the marker panel
 """
+import functools
 import logging
 import os
 import sys
@@ -163,7 +164,9 @@ class FoldingPanel(Panel):
         #: surrounding regions are darker)
         self._scope_decos = []
         #: the list of folded blocs decorations
-        self._block_decos = []
+        #: fold decorations of the collapsed blocks, by block number
+        self._block_decos = {}
+        self._block_decos_dirty = False
         self.setMouseTracking(True)
         self.scrollable = True
         self._mouse_over_line = None
@@ -230,33 +233,24 @@ class FoldingPanel(Panel):
             except ValueError:
                 pass
         # Draw fold triggers
+        if self._block_decos_dirty:
+            self._reindex_block_decos()
         for top_position, line_number, block in self.editor.visible_blocks:
             if TextBlockHelper.is_fold_trigger(block):
                 collapsed = TextBlockHelper.is_collapsed(block)
                 mouse_over = self._mouse_over_line == line_number
                 self._draw_fold_indicator(
                     top_position, mouse_over, collapsed, painter)
+                # check if the block decoration must be added/removed, it
+                # might have been (un)folded by the parent editor/document in
+                # the case of cloned editor
+                deco = self._block_decos.get(line_number)
                 if collapsed:
-                    # check if the block already has a decoration, it might
-                    # have been folded by the parent editor/document in the
-                    # case of cloned editor
-                    for deco in self._block_decos:
-                        if deco.block == block:
-                            # no need to add a deco, just go to the next block
-                            break
-                    else:
+                    if deco is None:
                         self._add_fold_decoration(block, FoldScope(block))
-                else:
-                    for deco in self._block_decos:
-                        # check if the block decoration has been removed, it
-                        # might have been unfolded by the parent
-                        # editor/document in the case of cloned editor
-                        if deco.block == block:
-                            # remove it and
-                            self._block_decos.remove(deco)
-                            self.editor.decorations.remove(deco)
-                            del deco
-                            break
+                elif deco is not None:
+                    del self._block_decos[line_number]
+                    self.editor.decorations.remove(deco)
 
     def _draw_fold_region_background(self, block, painter):
         """
@@ -390,18 +384,7 @@ class FoldingPanel(Panel):
         Find parent scope, if the block is not a fold trigger.
 
         """
-        original = block
-        if not TextBlockHelper.is_fold_trigger(block):
-            # search level of next non blank line
-            while block.text().strip() == '' and block.isValid():
-                block = block.next()
-            ref_lvl = TextBlockHelper.get_fold_lvl(block) - 1
-            block = original
-            while (block.blockNumber() and
-                   (not TextBlockHelper.is_fold_trigger(block) or
-                    TextBlockHelper.get_fold_lvl(block) > ref_lvl)):
-                block = block.previous()
-        return block
+        return FoldScope.find_parent_scope(block)
 
     def _clear_scope_decos(self):
         """
@@ -576,7 +559,8 @@ class FoldingPanel(Panel):
         """
         deco = TextDecoration(block)
         deco.signals.clicked.connect(self._on_fold_deco_clicked)
-        deco.tooltip = region.text(max_lines=25)
+        # the tooltip is computed when the user hovers the decoration
+        deco.tooltip = functools.partial(region.text, max_lines=25)
         deco.draw_order = 1
         deco.block = block
         deco.select_line()
@@ -584,9 +568,29 @@ class FoldingPanel(Panel):
             self._get_scope_highlight_color(), 110))
         deco.set_background(self._get_scope_highlight_color())
         deco.set_foreground(QtGui.QColor('#808080'))
-        self._block_decos.append(deco)
+        self._block_decos[block.blockNumber()] = deco
         self.editor.decorations.append(deco)
 
+    def _on_block_count_changed(self):
+        # block numbers of the fold decorations have to be updated
+        self._block_decos_dirty = True
+
+    def _reindex_block_decos(self):
+        """
+        Updates the block numbers of the fold decorations after some lines
+        have been added or removed.
+        """
+        decos = {}
+        for deco in self._block_decos.values():
+            nbr = deco.block.blockNumber()
+            if deco.block.isValid() and nbr not in decos:
+                decos[nbr] = deco
+            else:
+                # block removed or merged with another folded block
+                self.editor.decorations.remove(deco)
+        self._block_decos = decos
+        self._block_decos_dirty = False
+
     def toggle_fold_trigger(self, block):
         """
         Toggle a fold trigger block (expand or collapse it).
@@ -596,6 +600,7 @@ class FoldingPanel(Panel):
         if not TextBlockHelper.is_fold_trigger(block):
             return
         region = FoldScope(block)
+        start, end = region.get_range(ignore_blank_lines=False)
         if region.collapsed:
             region.unfold()
             if self._mouse_over_line is not None:
@@ -604,7 +609,7 @@ class FoldingPanel(Panel):
         else:
             region.fold()
             self._clear_scope_decos()
-        self._refresh_editor_and_scrollbars()
+        self._refresh_editor_and_scrollbars(start, end)
         self.trigger_state_changed.emit(region._trigger, region.collapsed)
 
     def mousePressEvent(self, event):
@@ -631,6 +636,8 @@ class FoldingPanel(Panel):
                     self._highlight_caret_scope)
                 self._block_nbr = -1
             self.editor.new_text_set.connect(self._clear_block_deco)
+            self.editor.blockCountChanged.connect(
+                self._on_block_count_changed)
         else:
             self.editor.key_pressed.disconnect(self._on_key_pressed)
             if self._highlight_caret:
@@ -638,6 +645,8 @@ class FoldingPanel(Panel):
                     self._highlight_caret_scope)
                 self._block_nbr = -1
             self.editor.new_text_set.disconnect(self._clear_block_deco)
+            self.editor.blockCountChanged.disconnect(
+                self._on_block_count_changed)
 
     def _on_key_pressed(self, event):
         """
@@ -673,18 +682,6 @@ class FoldingPanel(Panel):
                         tc.setPosition(end, tc.KeepAnchor)
                         self.editor.setTextCursor(tc)
 
-    @staticmethod
-    def _show_previous_blank_lines(block):
-        """
-        Show the block previous blank lines
-        """
-        # set previous blank lines visibles
-        pblock = block.previous()
-        while (pblock.text().strip() == '' and
-               pblock.blockNumber() >= 0):
-            pblock.setVisible(True)
-            pblock = pblock.previous()
-
     def refresh_decorations(self, force=False):
         """
         Refresh decorations colors. This function is called by the syntax
@@ -695,31 +692,45 @@ class FoldingPanel(Panel):
         cursor = self.editor.textCursor()
         if (self._prev_cursor is None or force or
                 self._prev_cursor.blockNumber() != cursor.blockNumber()):
-            for deco in self._block_decos:
+            for deco in self._block_decos.values():
                 self.editor.decorations.remove(deco)
-            for deco in self._block_decos:
+            for deco in self._block_decos.values():
                 deco.set_outline(drift_color(
                     self._get_scope_highlight_color(), 110))
                 deco.set_background(self._get_scope_highlight_color())
                 self.editor.decorations.append(deco)
         self._prev_cursor = cursor
 
-    def _refresh_editor_and_scrollbars(self):
+    def _refresh_editor_and_scrollbars(self, start=None, end=None):
         """
-        Refrehes editor content and scollbars.
+        Refreshes the editor content and scrollbars after the visibility of
+        some blocks changed.
 
-        We generate a fake resize event to refresh scroll bar.
+        Only the layout of the lines in the range [start, end] is invalidated.
+        The scrollbars and the panels are then refreshed once for the whole
+        range.
 
-        We have the same problem as described here:
+        We generate a fake resize event to refresh the scroll bar range. We
+        have the same problem as described here:
         http://www.qtcentre.org/threads/44803 and we apply the same solution
         (don't worry, there is no visual effect, the editor does not grow up
-        at all, even with a value = 500)
-        """
-        TextHelper(self.editor).mark_whole_doc_dirty()
-        self.editor.repaint()
+        at all).
+
+        :param start: first modified line, None to start at the beginning of
+            the document.
+        :param end: last modified line, None to go up to the end of the
+            document.
+        """
+        if start is None:
+            start = 0
+        if end is None or end < 0:
+            end = self.editor.document().blockCount() - 1
+        TextHelper(self.editor).mark_lines_dirty(start, end)
         s = self.editor.size()
         s.setWidth(s.width() + 1)
         self.editor.resizeEvent(QtGui.QResizeEvent(self.editor.size(), s))
+        self.editor.panels.refresh()
+        self.editor.viewport().update()
 
     def collapse_all(self):
         """
@@ -727,33 +738,86 @@ class FoldingPanel(Panel):
         invisible.
         """
         self._clear_block_deco()
+        visible = []
+        blank = []
+
+        def show_previous_blank_lines():
+            i = len(visible) - 1
+            while i >= 0 and blank[i]:
+                visible[i] = True
+                i -= 1
+
         block = self.editor.document().firstBlock()
-        last = self.editor.document().lastBlock()
         while block.isValid():
             lvl = TextBlockHelper.get_fold_lvl(block)
-            trigger = TextBlockHelper.is_fold_trigger(block)
-            if trigger:
+            if TextBlockHelper.is_fold_trigger(block):
                 if lvl == 0:
-                    self._show_previous_blank_lines(block)
+                    show_previous_blank_lines()
                 TextBlockHelper.set_collapsed(block, True)
-            block.setVisible(lvl == 0)
-            if block == last and block.text().strip() == '':
-                block.setVisible(True)
-                self._show_previous_blank_lines(block)
+            visible.append(lvl == 0)
+            blank.append(block.text().strip() == '')
             block = block.next()
-        self._refresh_editor_and_scrollbars()
+        if blank and blank[-1]:
+            # trailing blank lines are always visible
+            show_previous_blank_lines()
+        self._set_blocks_visible(visible)
         tc = self.editor.textCursor()
         tc.movePosition(tc.Start)
         self.editor.setTextCursor(tc)
         self.collapse_all_triggered.emit()
 
+    def _set_blocks_visible(self, visibilities):
+        """
+        Applies the visibility of every block of the document at once: only
+        the blocks whose visibility changed are modified and the editor
+        layout is refreshed once, for the range of modified blocks.
+
+        :param visibilities: list of booleans, one per block
+        """
+        first = last = None
+        block = self.editor.document().firstBlock()
+        for i, visible in enumerate(visibilities):
+            if not block.isValid():
+                break
+            if block.isVisible() != visible:
+                block.setVisible(visible)
+                if first is None:
+                    first = i
+                last = i
+            block = block.next()
+        if first is not None:
+            self._refresh_editor_and_scrollbars(first, last)
+
+    def collapse_triggers(self, lines):
+        """
+        Collapses a list of fold triggers at once, the editor layout is
+        refreshed only once for the whole range of folded blocks.
+
+        :param lines: line numbers of the fold triggers to collapse.
+        """
+        doc = self.editor.document()
+        first = last = None
+        for line in sorted(lines):
+            block = doc.findBlockByNumber(line)
+            if not TextBlockHelper.is_fold_trigger(block):
+                continue
+            scope = FoldScope(block)
+            scope.fold()
+            start, end = scope.get_range()
+            if first is None:
+                first, last = start, end
+            last = max(end, last)
+        if first is not None:
+            self._refresh_editor_and_scrollbars(first, last)
+
     def _clear_block_deco(self):
         """
         Clear the folded block decorations.
         """
-        for deco in self._block_decos:
+        for deco in self._block_decos.values():
             self.editor.decorations.remove(deco)
-        self._block_decos[:] = []
+        self._block_decos.clear()
+        self._block_decos_dirty = False
 
     def expand_all(self):
         """
@@ -761,11 +825,12 @@ class FoldingPanel(Panel):
         """
         block = self.editor.document().firstBlock()
         while block.isValid():
-            TextBlockHelper.set_collapsed(block, False)
-            block.setVisible(True)
+            if TextBlockHelper.is_collapsed(block):
+                TextBlockHelper.set_collapsed(block, False)
             block = block.next()
         self._clear_block_deco()
-        self._refresh_editor_and_scrollbars()
+        self._set_blocks_visible(
+            [True] * self.editor.document().blockCount())
         self.expand_all_triggered.emit()
 
     def _on_action_toggle(self):
@@ -12,33 +12,101 @@ class GlobalCheckerPanel(Panel):
 
     The user can click on a marker to quickly go the the error line.
 
+    The messages markers are rendered to a pixmap which is only updated when
+    the messages change, when the document is edited or when the panel size
+    changes.
+
     """
 
     def __init__(self):
         super(GlobalCheckerPanel, self).__init__()
         self.scrollable = True
+        self._pixmap = None
+        self._pixmap_key = None
+        self._checker_modes = []
+
+    def on_state_changed(self, state):
+        """
+        On state changed we (dis)connect to the textChanged signal, the
+        markers are rendered again after each edit.
+        """
+        if state:
+            self.editor.textChanged.connect(self._invalidate)
+        else:
+            self.editor.textChanged.disconnect(self._invalidate)
+            self._pixmap = None
+
+    def _get_checker_modes(self):
+        """
+        Returns the list of checker modes installed on the editor and
+        (re)connects to their messages_changed signal.
+        """
+        checker_modes = [m for m in self.editor.modes
+                         if isinstance(m, modes.CheckerMode)]
+        if checker_modes != self._checker_modes:
+            for m in self._checker_modes:
+                try:
+                    m.messages_changed.disconnect(self._invalidate)
+                except (RuntimeError, TypeError):
+                    pass
+            for m in checker_modes:
+                m.messages_changed.connect(self._invalidate)
+            self._checker_modes = checker_modes
+            self._pixmap = None
+        return checker_modes
+
+    def _invalidate(self):
+        self._pixmap = None
+        self.update()
 
     def _draw_messages(self, painter):
         """
         Draw messages from all subclass of CheckerMode currently
         installed on the editor.
 
+        Messages are bucketed by pixel row, only the most severe message of a
+        row is drawn.
+
         :type painter: QtGui.QPainter
         """
-        checker_modes = []
-        for m in self.editor.modes:
-            if isinstance(m, modes.CheckerMode):
-                checker_modes.append(m)
-        for checker_mode in checker_modes:
-            for msg in checker_mode.messages:
-                block = msg.block
-                color = QtGui.QColor(msg.color)
-                brush = QtGui.QBrush(color)
-                rect = QtCore.QRect()
-                rect.setX(self.sizeHint().width() / 4)
-                rect.setY(block.blockNumber() * self.get_marker_height())
-                rect.setSize(self.get_marker_size())
-                painter.fillRect(rect, brush)
+        marker_height = self.get_marker_height()
+        # pixel row -> most severe message
+        rows = {}
+        for checker_mode in self._get_checker_modes():
+            for line, messages in checker_mode.messages_per_line.items():
+                msg = max(messages, key=lambda m: m.status)
+                if msg.block is not None and msg.block.isValid():
+                    # live line number of the displayed messages
+                    line = msg.block.blockNumber()
+                y = int(line * marker_height)
+                prev = rows.get(y)
+                if prev is None or prev.status < msg.status:
+                    rows[y] = msg
+        size = self.get_marker_size()
+        x = self.sizeHint().width() // 4
+        colors = {}
+        for y, msg in rows.items():
+            try:
+                color = colors[msg.color]
+            except KeyError:
+                color = colors[msg.color] = QtGui.QColor(msg.color)
+            painter.fillRect(x, y, size.width(), size.height(), color)
+
+    def _get_pixmap(self):
+        """
+        Returns the pixmap of the messages markers, the pixmap is rendered
+        again if the messages, the document or the panel size changed.
+        """
+        self._get_checker_modes()
+        key = (self.width(), self.height(), self.editor.viewport().height())
+        if self._pixmap is None or key != self._pixmap_key:
+            self._pixmap = QtGui.QPixmap(self.size())
+            self._pixmap.fill(QtCore.Qt.transparent)
+            painter = QtGui.QPainter(self._pixmap)
+            self._draw_messages(painter)
+            painter.end()
+            self._pixmap_key = key
+        return self._pixmap
 
     def _draw_visible_area(self, painter):
         """
@@ -73,7 +141,7 @@ class GlobalCheckerPanel(Panel):
             self._background_brush = QtGui.QBrush(self.editor.background)
             painter = QtGui.QPainter(self)
             painter.fillRect(event.rect(), self._background_brush)
-            self._draw_messages(painter)
+            painter.drawPixmap(0, 0, self._get_pixmap())
             self._draw_visible_area(painter)
 
     def sizeHint(self):
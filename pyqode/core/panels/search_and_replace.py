@@ -2,6 +2,7 @@
 """
 This module contains the search and replace panel
 """
+import bisect
 import re
 import sre_constants
 
@@ -11,16 +12,16 @@ from pyqode.core import icons
 from pyqode.core._forms.search_panel_ui import Ui_SearchPanel
 from pyqode.core.api.decoration import TextDecoration
 from pyqode.core.api.panel import Panel
+from pyqode.core.api.search import DocumentSearcher, SearchResults
 from pyqode.core.api.utils import DelayJobRunner, TextHelper
-from pyqode.core.backend import NotRunning
-from pyqode.core.backend.workers import findall
 
 
 class SearchAndReplacePanel(Panel, Ui_SearchPanel):
     """ Lets the user search and replace text in the current document.
 
-    It uses the backend API to search for some text. Search operation is
-    performed in a background process (the backend process)..
+    The search is performed locally by the document's
+    :class:`pyqode.core.api.DocumentSearcher`, on a cached snapshot of the
+    document text, which is fast enough to search as you type.
 
     The search panel can also be used programatically. To do that, the client
     code must first requests a search using :meth:`requestSearch` and connects
@@ -90,6 +91,10 @@ class SearchAndReplacePanel(Panel, Ui_SearchPanel):
     #:    the extra selection used to highlight search result can be slow.
     MAX_HIGHLIGHTED_OCCURENCES = 500
 
+    #: Define the maximum number of occurrences that are kept for navigation,
+    #: the occurrences above this limit are only counted.
+    MAX_OCCURRENCES = 100000
+
     @property
     def background(self):
         """ Text decoration background """
@@ -128,7 +133,7 @@ class SearchAndReplacePanel(Panel, Ui_SearchPanel):
 
     def __init__(self):
         Panel.__init__(self, dynamic=True)
-        self.job_runner = DelayJobRunner(delay=500)
+        self.job_runner = DelayJobRunner(delay=100)
         Ui_SearchPanel.__init__(self)
         self.setupUi(self)
         self.toolButtonClose.clicked.connect(self.on_close)
@@ -139,8 +144,9 @@ class SearchAndReplacePanel(Panel, Ui_SearchPanel):
         self.cpt_occurences = 0
         self._previous_stylesheet = ""
         self._separator = None
-        self._decorations = []
-        self._occurrences = []
+        self._occurrences = SearchResults()
+        # (text, flags, start, end, document revision) of the last search
+        self._last_search = None
         self._current_occurrence_index = 0
         self._bg = None
         self._fg = None
@@ -213,11 +219,14 @@ class SearchAndReplacePanel(Panel, Ui_SearchPanel):
         self.text_helper = TextHelper(editor)
 
     def _refresh_decorations(self):
-        for deco in self._decorations:
-            self.editor.decorations.remove(deco)
+        if self.editor is None:
+            return
+
+        def restyle(deco):
             deco.set_background(QtGui.QBrush(self.background))
             deco.set_outline(self._outline)
-            self.editor.decorations.append(deco)
+
+        self.editor.decorations.restyle_layer('search', restyle)
 
     def on_state_changed(self, state):
         super(SearchAndReplacePanel, self).on_state_changed(state)
@@ -329,6 +338,7 @@ class SearchAndReplacePanel(Panel, Ui_SearchPanel):
                 self._exec_search, txt, self._search_flags())
         else:
             self.job_runner.cancel_requests()
+            self._last_search = None
             self._clear_occurrences()
             self._on_search_finished()
 
@@ -356,11 +366,11 @@ class SearchAndReplacePanel(Panel, Ui_SearchPanel):
 
     def get_occurences(self):
         """
-        Returns the list of text occurrences.
+        Returns the text occurrences.
 
         An occurrence is a tuple that contains start and end positions.
 
-        :return: List of tuple(int, int)
+        :rtype: pyqode.core.api.SearchResults
         """
         return self._occurrences
 
@@ -380,11 +390,10 @@ class SearchAndReplacePanel(Panel, Ui_SearchPanel):
         if cursor_pos not in range(current[0], current[1] + 1) or \
                 current_occurence == -1:
             # search first occurrence that occurs after the cursor position
-            current_occurence = 0
-            for i, (start, end) in enumerate(self._occurrences):
-                if end > cursor_pos:
-                    current_occurence = i
-                    break
+            current_occurence = bisect.bisect_right(occurrences.ends,
+                                                    cursor_pos)
+            if current_occurence == len(occurrences):
+                current_occurence = 0
         else:
             if (current_occurence == -1 or
                     current_occurence >= len(occurrences) - 1):
@@ -418,11 +427,8 @@ class SearchAndReplacePanel(Panel, Ui_SearchPanel):
         if cursor_pos not in range(current[0], current[1] + 1) or \
                 current_occurence == -1:
             # search first occurrence that occurs before the cursor position
-            current_occurence = len(self._occurrences) - 1
-            for i, (start, end) in enumerate(self._occurrences):
-                if end >= cursor_pos:
-                    current_occurence = i - 1
-                    break
+            current_occurence = bisect.bisect_left(
+                occurrences.ends, cursor_pos) - 1
         else:
             if (current_occurence == -1 or
                     current_occurence == 0):
@@ -477,7 +483,7 @@ class SearchAndReplacePanel(Panel, Ui_SearchPanel):
             current_occurences -= 1
             self._set_current_occurrence(current_occurences)
             self.select_next()
-            self.cpt_occurences = len(self.get_occurences())
+            self.cpt_occurences = self.get_occurences().total
             self._update_label_matches()
             self._update_buttons()
             return True
@@ -490,15 +496,65 @@ class SearchAndReplacePanel(Panel, Ui_SearchPanel):
         """
         Replaces all occurrences in the editor's document.
 
+        The occurrences are replaced in a single edit block (one undo step),
+        see :meth:`pyqode.core.api.DocumentSearcher.replace_all`. Decorations
+        updates and syntax highlighting are suspended during the operation.
+        If the regex option is checked, the group references of the
+        replacement text (e.g. ``\\1``) are expanded.
+
         :param text: The replacement text. If None, the content of the lineEdit
                      replace will be used instead
+
+        :return: The number of replaced occurrences.
         """
-        cursor = self.editor.textCursor()
-        cursor.beginEditBlock()
-        remains = self.replace(text=text)
-        while remains:
-            remains = self.replace(text=text)
-        cursor.endEditBlock()
+        if text is None or isinstance(text, bool):
+            text = self.lineEditReplace.text()
+        if self._last_search is None:
+            return 0
+        document = self.editor.document()
+        if self._last_search[4] != document.revision():
+            # the document changed since the last search, the searched range
+            # is out of date: search again (instead of waiting for the search
+            # requested by textChanged)
+            self.job_runner.cancel_requests()
+            self._exec_search(*self._last_search[:2])
+            if self._last_search is None:
+                return 0
+        sub, flags, start, end, revision = self._last_search
+        regex, case_sensitive, whole_word, in_selection = flags
+        searcher = DocumentSearcher.get(document)
+        try:
+            results = searcher.search(
+                sub, regex=regex, case_sensitive=case_sensitive,
+                whole_word=whole_word, start=start, end=end)
+            pattern = None
+            if regex:
+                pattern = searcher.compile(sub, regex, case_sensitive,
+                                           whole_word)
+                # check the group references before modifying the document
+                pattern.sub(text, '')
+        except sre_constants.error:
+            return 0
+        if not results:
+            return 0
+        # prevent search request due to editor textChanged
+        try:
+            self.editor.textChanged.disconnect(self.request_search)
+        except (RuntimeError, TypeError):
+            # already disconnected
+            pass
+        self.editor.decorations.begin_update()
+        try:
+            self._clear_occurrences()
+            self._clear_decorations()
+            self.editor.setTextCursor(searcher.replace_all(
+                results, text, pattern=pattern,
+                highlighter=self.editor.syntax_highlighter))
+            self._on_search_finished()
+        finally:
+            self.editor.decorations.end_update()
+            self.editor.textChanged.connect(self.request_search)
+        return len(results)
 
     def eventFilter(self, obj, event):
         if event.type() == QtCore.QEvent.KeyPress:
@@ -537,30 +593,23 @@ class SearchAndReplacePanel(Panel, Ui_SearchPanel):
         regex, case_sensitive, whole_word, in_selection = flags
         tc = self.editor.textCursor()
         assert isinstance(tc, QtGui.QTextCursor)
+        start, end = 0, None
         if in_selection and tc.hasSelection():
-            text = tc.selectedText()
-            self._offset = tc.selectionStart()
-        else:
-            text = self.editor.toPlainText()
-            self._offset = 0
-        request_data = {
-            'string': text,
-            'sub': sub,
-            'regex': regex,
-            'whole_word': whole_word,
-            'case_sensitive': case_sensitive
-        }
+            start, end = tc.selectionStart(), tc.selectionEnd()
+        self._last_search = (sub, flags, start, end,
+                             self.editor.document().revision())
         try:
-            self.editor.backend.send_request(findall, request_data,
-                                             self._on_results_available)
-        except AttributeError:
-            self._on_results_available(findall(request_data))
-        except NotRunning:
-            QtCore.QTimer.singleShot(100, self.request_search)
+            results = DocumentSearcher.get(self.editor.document()).search(
+                sub, regex=regex, case_sensitive=case_sensitive,
+                whole_word=whole_word, start=start, end=end,
+                max_hits=self.MAX_OCCURRENCES)
+        except sre_constants.error as e:
+            self._show_error(e)
+            return
+        self._on_results_available(results)
 
     def _on_results_available(self, results):
-        self._occurrences = [(start + self._offset, end + self._offset)
-                             for start, end in results]
+        self._occurrences = results
         self._on_search_finished()
 
     def _update_label_matches(self):
@@ -573,15 +622,11 @@ class SearchAndReplacePanel(Panel, Ui_SearchPanel):
             self.labelMatches.clear()
 
     def _on_search_finished(self):
-        self._clear_decorations()
-        all_occurences = self.get_occurences()
-        occurrences = all_occurences[:self.MAX_HIGHLIGHTED_OCCURENCES]
-        for i, occurrence in enumerate(occurrences):
-            deco = self._create_decoration(occurrence[0],
-                                           occurrence[1])
-            self._decorations.append(deco)
-            self.editor.decorations.append(deco)
-        self.cpt_occurences = len(all_occurences)
+        occurrences = self.get_occurences()
+        n = min(len(occurrences), self.MAX_HIGHLIGHTED_OCCURENCES)
+        self.editor.decorations.replace_layer('search', [
+            self._create_decoration(*occurrences[i]) for i in range(n)])
+        self.cpt_occurences = occurrences.total
         if not self.cpt_occurences:
             self._current_occurrence_index = -1
         else:
@@ -594,7 +639,7 @@ class SearchAndReplacePanel(Panel, Ui_SearchPanel):
         return ret_val
 
     def _clear_occurrences(self):
-        self._occurrences[:] = []
+        self._occurrences = SearchResults()
 
     def _create_decoration(self, selection_start, selection_end):
         """ Creates the text occurences decoration """
@@ -608,24 +653,20 @@ class SearchAndReplacePanel(Panel, Ui_SearchPanel):
 
     def _clear_decorations(self):
         """ Remove all decorations """
-        for deco in self._decorations:
-            self.editor.decorations.remove(deco)
-        self._decorations[:] = []
+        self.editor.decorations.clear_layer('search')
 
     def _set_current_occurrence(self, current_occurence_index):
         self._current_occurrence_index = current_occurence_index
 
     def _remove_occurrence(self, i, offset=0):
-        self._occurrences.pop(i)
+        starts, ends = self._occurrences.starts, self._occurrences.ends
+        del starts[i]
+        del ends[i]
+        self._occurrences.total -= 1
         if offset:
-            updated_occurences = []
-            for j, occ in enumerate(self._occurrences):
-                if j >= i:
-                    updated_occurences.append(
-                        (occ[0] + offset, occ[1] + offset))
-                else:
-                    updated_occurences.append((occ[0], occ[1]))
-            self._occurrences = updated_occurences
+            for j in range(i, len(starts)):
+                starts[j] += offset
+                ends[j] += offset
 
     def _update_buttons(self, txt=""):
         enable = self.cpt_occurences > 1
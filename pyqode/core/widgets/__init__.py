@@ -11,7 +11,9 @@ pyqode applications:
       the compiler output,...
     - CodeEditTabWidget: tab widget made to handle CodeEdit instances (or
       any other object that have the same interface).
-    - ErrorsTable: a QTableWidget specialised to show CheckerMessage.
+    - ErrorsTable: a QTableView specialised to show CheckerMessage.
+    - MultiDocumentSearchWidget: searches and replaces text in all the
+      documents opened in a SplittableTabWidget.
     - OutlineTreeWidget: a widget that show the outline of an editor.
 
 
@@ -36,6 +38,8 @@ from pyqode.core.widgets.filesystem_treeview import FileSystemContextMenu
 from pyqode.core.widgets.filesystem_treeview import FileSystemHelper
 from pyqode.core.widgets.output_window import OutputWindow
 from pyqode.core.widgets.terminal import Terminal
+from pyqode.core.widgets.multi_search import MultiDocumentSearch
+from pyqode.core.widgets.multi_search import MultiDocumentSearchWidget
 
 
 __all__ = [
@@ -59,6 +63,8 @@ __all__ = [
     'SplittableCodeEditTabWidget',
     'TabBar',
     'HtmlPreviewWidget',
+    'MultiDocumentSearch',
+    'MultiDocumentSearchWidget',
     'OutputWindow',
     'Terminal'
 ]
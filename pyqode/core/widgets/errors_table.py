@@ -1,7 +1,8 @@
 # -*- coding: utf-8 -*-
 """
-Contains a custom QTableWidget for easier displaying of CheckerMessages
+Contains a custom QTableView for easier displaying of CheckerMessages
 """
+from array import array
 from pyqode.core.api.utils import memoized
 from pyqode.core.modes import CheckerMessage, CheckerMessages
 from pyqode.qt import QtCore, QtWidgets, QtGui
@@ -13,15 +14,247 @@ COL_LINE_NBR = 2
 COL_MSG = 3
 
 
-class ErrorsTable(QtWidgets.QTableWidget):
+class ErrorsModel(QtCore.QAbstractTableModel):
     """
-    Extends a QtWidgets.QTableWidget to easily show
+    Table model that stores checker messages column by column (the columns
+    are used for display, filtering and sorting). The original
+    :class:`pyqode.core.modes.CheckerMessage` instances are kept and
+    returned by :meth:`message`.
+
+    The model can be filtered by message status and by file path and sorted
+    by any column.
+    """
+    HEADERS = ["Type", "File name", "Line", "Description"]
+
+    def __init__(self, parent=None, icon_function=None):
+        """
+        :param parent: parent object
+        :param icon_function: function that returns the icon of a message
+            status.
+        """
+        super(ErrorsModel, self).__init__(parent)
+        self._icon_function = icon_function
+        self._init_store()
+        # filters, None means no filter
+        self._statuses = None
+        self._path = None
+        # sort column/order, None means insertion order
+        self._sort_column = None
+        self._sort_order = QtCore.Qt.AscendingOrder
+
+    def _init_store(self):
+        self._status = array('b')
+        self._lines = array('i')
+        # -1 means no column
+        self._cols = array('i')
+        # index of the message path in self._paths
+        self._path_ids = array('i')
+        self._descriptions = []
+        # the original message objects
+        self._messages = []
+        # paths and file names, indexed by path id
+        self._paths = []
+        self._file_names = []
+        self._path_index = {}
+        # indexes of the messages shown by the model (filtered and sorted)
+        self._rows = []
+
+    def rowCount(self, parent=QtCore.QModelIndex()):
+        if parent.isValid():
+            return 0
+        return len(self._rows)
+
+    def columnCount(self, parent=QtCore.QModelIndex()):
+        if parent.isValid():
+            return 0
+        return len(self.HEADERS)
+
+    def headerData(self, section, orientation, role=QtCore.Qt.DisplayRole):
+        if orientation == QtCore.Qt.Horizontal and \
+                role == QtCore.Qt.DisplayRole:
+            return self.HEADERS[section]
+        return None
+
+    def flags(self, index):
+        return QtCore.Qt.ItemIsEnabled | QtCore.Qt.ItemIsSelectable
+
+    def data(self, index, role=QtCore.Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        i = self._rows[index.row()]
+        column = index.column()
+        if role == QtCore.Qt.DisplayRole:
+            if column == COL_TYPE:
+                return CheckerMessage.status_to_string(self._status[i])
+            elif column == COL_FILE_NAME:
+                return self._file_names[self._path_ids[i]]
+            elif column == COL_LINE_NBR:
+                line = self._lines[i]
+                return '-' if line < 0 else str(line + 1)
+            elif column == COL_MSG:
+                return self._descriptions[i]
+        elif role == QtCore.Qt.DecorationRole and column == COL_TYPE:
+            if self._icon_function is not None:
+                return self._icon_function(self._status[i])
+        elif role == QtCore.Qt.ToolTipRole and column == COL_FILE_NAME:
+            return self._paths[self._path_ids[i]]
+        elif role == QtCore.Qt.UserRole:
+            return self._message(i)
+        return None
+
+    def message(self, row):
+        """
+        Returns the message displayed at a row.
+
+        :param row: row number
+        :rtype: pyqode.core.modes.CheckerMessage
+        """
+        return self._message(self._rows[row])
+
+    def _message(self, i):
+        return self._messages[i]
+
+    def _path_id(self, path):
+        try:
+            return self._path_index[path]
+        except KeyError:
+            path_id = self._path_index[path] = len(self._paths)
+            self._paths.append(path)
+            self._file_names.append(
+                QtCore.QFileInfo(path).fileName() if path else '')
+            return path_id
+
+    def append_messages(self, messages):
+        """
+        Appends a list of messages.
+
+        :param messages: list of pyqode.core.modes.CheckerMessage
+        """
+        if not messages:
+            return
+        start = len(self._descriptions)
+        for msg in messages:
+            self._status.append(msg.status)
+            self._lines.append(msg.line)
+            self._cols.append(-1 if msg.col is None else msg.col)
+            self._path_ids.append(self._path_id(msg.path))
+            self._descriptions.append(msg.description)
+            self._messages.append(msg)
+        new_rows = [i for i in range(start, len(self._descriptions))
+                    if self._accept(i)]
+        if not new_rows:
+            return
+        if self._sort_column is None:
+            first = len(self._rows)
+            self.beginInsertRows(QtCore.QModelIndex(), first,
+                                 first + len(new_rows) - 1)
+            self._rows.extend(new_rows)
+            self.endInsertRows()
+        else:
+            self.beginResetModel()
+            self._rows.extend(new_rows)
+            self._sort_rows()
+            self.endResetModel()
+
+    def remove_file_messages(self, path):
+        """
+        Removes the messages of a file.
+
+        :param path: file path
+        """
+        path_id = self._path_index.get(path)
+        if path_id is None:
+            return
+        keep = [i for i, pid in enumerate(self._path_ids) if pid != path_id]
+        if len(keep) == len(self._path_ids):
+            return
+        self.beginResetModel()
+        self._status = array('b', (self._status[i] for i in keep))
+        self._lines = array('i', (self._lines[i] for i in keep))
+        self._cols = array('i', (self._cols[i] for i in keep))
+        self._path_ids = array('i', (self._path_ids[i] for i in keep))
+        self._descriptions = [self._descriptions[i] for i in keep]
+        self._messages = [self._messages[i] for i in keep]
+        self._update_rows()
+        self.endResetModel()
+
+    def clear(self):
+        """
+        Removes all messages.
+        """
+        self.beginResetModel()
+        self._init_store()
+        self.endResetModel()
+
+    def set_filter(self, statuses=None, path=None):
+        """
+        Filters the messages shown by the model.
+
+        :param statuses: list of message statuses to show, None to show
+            all statuses.
+        :param path: path of the file whose messages are shown, None to show
+            the messages of all files.
+        """
+        self.beginResetModel()
+        self._statuses = None if statuses is None else set(statuses)
+        self._path = path
+        self._update_rows()
+        self.endResetModel()
+
+    def sort(self, column, order=QtCore.Qt.AscendingOrder):
+        self.beginResetModel()
+        # a negative column restores the insertion order
+        self._sort_column = column if column >= 0 else None
+        self._sort_order = order
+        self._sort_rows()
+        self.endResetModel()
+
+    def _accept(self, i):
+        if self._statuses is not None and \
+                self._status[i] not in self._statuses:
+            return False
+        if self._path is not None and \
+                self._paths[self._path_ids[i]] != self._path:
+            return False
+        return True
+
+    def _update_rows(self):
+        self._rows = [i for i in range(len(self._descriptions))
+                      if self._accept(i)]
+        self._sort_rows()
+
+    def _sort_rows(self):
+        column = self._sort_column
+        if column is None:
+            self._rows.sort()
+            return
+        if column == COL_TYPE:
+            keys = self._status
+        elif column == COL_FILE_NAME:
+            names = self._file_names
+            keys = [names[pid] for pid in self._path_ids]
+        elif column == COL_LINE_NBR:
+            keys = self._lines
+        else:
+            keys = self._descriptions
+        self._rows.sort(key=keys.__getitem__,
+                        reverse=self._sort_order == QtCore.Qt.DescendingOrder)
+
+
+class ErrorsTable(QtWidgets.QTableView):
+    """
+    Extends a QtWidgets.QTableView to easily show
     :class:`pyqode.core.modes.CheckerMessage`.
 
     You add messages to the table using
-    :meth:`pyqode.core.widgets.ErrorsTable.add_message`.
+    :meth:`pyqode.core.widgets.ErrorsTable.add_message` or
+    :meth:`pyqode.core.widgets.ErrorsTable.add_messages`.
 
     You clear the table using :meth:`pyqode.core.widgets.ErrorsTable`.
+
+    Messages are stored in a :class:`ErrorsModel`, the table can be sorted by
+    clicking on the headers and filtered by status or by file with
+    :meth:`set_filter`.
     """
     #: Signal emitted when a message is activated, the clicked signal is passed
     #: as a parameter
@@ -34,10 +267,9 @@ class ErrorsTable(QtWidgets.QTableWidget):
     }
 
     def __init__(self, parent=None):
-        QtWidgets.QTableWidget.__init__(self, parent)
-        self.setColumnCount(6)
-        self.setHorizontalHeaderLabels(
-            ["Type", "File name", "Line", "Description", 'Details'])
+        QtWidgets.QTableView.__init__(self, parent)
+        self._model = ErrorsModel(self, icon_function=self._make_icon)
+        self.setModel(self._model)
         try:
             # pyqt4
             self.horizontalHeader().setResizeMode(
@@ -50,8 +282,13 @@ class ErrorsTable(QtWidgets.QTableWidget):
                 QtWidgets.QHeaderView.ResizeToContents)
             self.horizontalHeader().setSectionResizeMode(
                 COL_MSG, QtWidgets.QHeaderView.Stretch)
+        self.verticalHeader().setDefaultSectionSize(
+            self.fontMetrics().height() + 4)
         self.setMinimumSize(900, 200)
-        self.itemActivated.connect(self._on_item_activated)
+        # keep insertion order until the user clicks on a header
+        self.horizontalHeader().setSortIndicator(-1, QtCore.Qt.AscendingOrder)
+        self.setSortingEnabled(True)
+        self.activated.connect(self._on_item_activated)
         self.setSelectionMode(self.SingleSelection)
         self.setSelectionBehavior(self.SelectRows)
         self.setContextMenuPolicy(QtCore.Qt.CustomContextMenu)
@@ -63,13 +300,12 @@ class ErrorsTable(QtWidgets.QTableWidget):
         self.action_copy.triggered.connect(self._copy_cell_text)
         self.context_mnu.addAction(self.action_details)
         self.context_mnu.addAction(self.action_copy)
-        self.clear()
 
     def _copy_cell_text(self):
         """
         Copies the description of the selected message to the clipboard
         """
-        txt = self.currentItem().text()
+        txt = self.currentIndex().data()
         QtWidgets.QApplication.clipboard().setText(txt)
 
     def _show_context_menu(self, pos):
@@ -80,11 +316,13 @@ class ErrorsTable(QtWidgets.QTableWidget):
         """
         Clears the tables and the message list
         """
-        QtWidgets.QTableWidget.clear(self)
-        self.setRowCount(0)
-        self.setColumnCount(4)
-        self.setHorizontalHeaderLabels(
-            ["Type", "File name", "Line", "Description"])
+        self._model.clear()
+
+    def rowCount(self):
+        """
+        Returns the number of messages displayed in the table.
+        """
+        return self._model.rowCount()
 
     @classmethod
     @memoized
@@ -110,50 +348,49 @@ class ErrorsTable(QtWidgets.QTableWidget):
         :param msg: The message to append
         :type msg: pyqode.core.modes.CheckerMessage
         """
-        row = self.rowCount()
-        self.insertRow(row)
-
-        # type
-        item = QtWidgets.QTableWidgetItem(
-            self._make_icon(msg.status), msg.status_string)
-        item.setFlags(QtCore.Qt.ItemIsEnabled | QtCore.Qt.ItemIsSelectable)
-        item.setData(QtCore.Qt.UserRole, msg)
-        self.setItem(row, COL_TYPE, item)
-
-        # filename
-        item = QtWidgets.QTableWidgetItem(
-            QtCore.QFileInfo(msg.path).fileName())
-        item.setFlags(QtCore.Qt.ItemIsEnabled | QtCore.Qt.ItemIsSelectable)
-        item.setData(QtCore.Qt.UserRole, msg)
-        self.setItem(row, COL_FILE_NAME, item)
-
-        # line
-        if msg.line < 0:
-            item = QtWidgets.QTableWidgetItem("-")
-        else:
-            item = QtWidgets.QTableWidgetItem(str(msg.line + 1))
-        item.setFlags(QtCore.Qt.ItemIsEnabled | QtCore.Qt.ItemIsSelectable)
-        item.setData(QtCore.Qt.UserRole, msg)
-        self.setItem(row, COL_LINE_NBR, item)
+        self._model.append_messages([msg])
+
+    def add_messages(self, messages):
+        """
+        Adds a list of checker messages to the table.
+
+        :param messages: The messages to append
+        :type messages: list of pyqode.core.modes.CheckerMessage
+        """
+        self._model.append_messages(messages)
 
-        # desc
-        item = QtWidgets.QTableWidgetItem(msg.description)
-        item.setFlags(QtCore.Qt.ItemIsEnabled | QtCore.Qt.ItemIsSelectable)
-        item.setData(QtCore.Qt.UserRole, msg)
-        self.setItem(row, COL_MSG, item)
+    def replace_file_messages(self, path, messages):
+        """
+        Replaces the messages of a file.
+
+        :param path: path of the file
+        :param messages: the new messages of the file
+        """
+        self._model.remove_file_messages(path)
+        self._model.append_messages(messages)
+
+    def set_filter(self, statuses=None, path=None):
+        """
+        Only shows the messages of some statuses and/or of a file.
+
+        :param statuses: list of message statuses to show, None to show
+            all statuses.
+        :param path: path of the file whose messages are shown, None to show
+            the messages of all files.
+        """
+        self._model.set_filter(statuses, path)
 
-    def _on_item_activated(self, item):
+    def _on_item_activated(self, index):
         """
         Emits the message activated signal
         """
-        msg = item.data(QtCore.Qt.UserRole)
-        self.msg_activated.emit(msg)
+        self.msg_activated.emit(self._model.message(index.row()))
 
     def showDetails(self):
         """
         Shows the error details.
         """
-        msg = self.currentItem().data(QtCore.Qt.UserRole)
+        msg = self._model.message(self.currentIndex().row())
         desc = msg.description
         desc = desc.replace('\r\n', '\n').replace('\r', '\n')
         desc = desc.replace('\n', '<br/>')
@@ -0,0 +1,382 @@
+# -*- coding: utf-8 -*-
+"""
+This module contains the multi-document search API and widget, used to
+search (and replace) a text in all the documents opened in a
+:class:`pyqode.core.widgets.SplittableTabWidget`.
+"""
+import collections
+import logging
+import os
+import re
+import weakref
+
+from concurrent.futures import ThreadPoolExecutor
+
+from pyqode.core.api import CodeEdit, DelayJobRunner
+from pyqode.core.api.search import DocumentSearcher, SearchResults, find_all
+from pyqode.core.widgets.prompt_line_edit import PromptLineEdit
+from pyqode.qt import QtCore, QtWidgets
+
+
+def _logger():
+    return logging.getLogger(__name__)
+
+
+class MultiDocumentSearch(QtCore.QObject):
+    """
+    Searches a text in all the documents opened in a
+    :class:`pyqode.core.widgets.SplittableTabWidget` (including the child
+    splitters).
+
+    Each document is searched once, even if it is shown by several editors
+    (clones share their document with the original editor).
+
+    The search works on snapshots of the documents text, the documents are
+    searched in parallel in a pool of background threads and the occurrences
+    are delivered document per document through :attr:`results_available`::
+
+        search = MultiDocumentSearch(tab_widget)
+        search.results_available.connect(on_results_available)
+        search.search('foo', case_sensitive=True)
+
+    The occurrences of a document that changed since its snapshot was taken
+    are searched again before being delivered.
+    """
+    #: Signal emitted when the occurrences of a document are available, with
+    #: the editor and the :class:`pyqode.core.api.SearchResults`
+    results_available = QtCore.Signal(object, object)
+    #: Signal emitted when all the documents have been searched.
+    finished = QtCore.Signal()
+
+    def __init__(self, tab_widget, parent=None):
+        """
+        :param tab_widget: the SplittableTabWidget that contains the documents
+            to search.
+        :param parent: parent QObject
+        """
+        super(MultiDocumentSearch, self).__init__(parent)
+        self.tab_widget = tab_widget
+        #: Maximum number of occurrences kept per document, the other
+        #: occurrences are only counted.
+        self.max_hits = 1000
+        #: Maximum number of threads used to search the documents.
+        self.max_threads = 4
+        self._executor = None
+        self._futures = []
+        self._query = None
+        self._generation = 0
+        # (editor weakref, document revision) of the searched documents
+        self._documents = []
+        self._remaining = 0
+        # results pushed by the search thread
+        self._results = collections.deque()
+        self._timer = QtCore.QTimer(self)
+        self._timer.setInterval(50)
+        self._timer.timeout.connect(self._process_results)
+
+    @property
+    def running(self):
+        """
+        True if some documents are being searched.
+        """
+        return self._remaining > 0
+
+    def editors(self):
+        """
+        Returns the editors of the open documents, with only one editor per
+        document.
+        """
+        editors = []
+        documents = set()
+        for widget in self.tab_widget.widgets(include_clones=True):
+            if not isinstance(widget, CodeEdit):
+                continue
+            document = widget.document()
+            if document not in documents:
+                documents.add(document)
+                editors.append(widget)
+        return editors
+
+    def search(self, sub, regex=False, case_sensitive=False,
+               whole_word=False):
+        """
+        Searches all the open documents. Any running search is cancelled.
+
+        :param sub: search text or regular expression
+        :param regex: True if sub is a regular expression
+        :param case_sensitive: True to match case
+        :param whole_word: True to match whole words only
+        :raises: re.error if the regular expression is invalid
+        """
+        self.cancel()
+        # compile the pattern here to report errors to the caller
+        DocumentSearcher.compile(sub, regex, case_sensitive, whole_word)
+        self._query = (sub, regex, case_sensitive, whole_word)
+        self._documents = []
+        snapshots = []
+        for editor in self.editors():
+            document = editor.document()
+            snapshots.append(DocumentSearcher.get(document).text)
+            self._documents.append((weakref.ref(editor), document.revision()))
+        self._remaining = len(snapshots)
+        if not snapshots:
+            self.finished.emit()
+            return
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(self.max_threads)
+        self._futures = [
+            self._executor.submit(self._search, self._generation, i, text,
+                                  self._query, self.max_hits)
+            for i, text in enumerate(snapshots)]
+        self._timer.start()
+
+    def cancel(self):
+        """
+        Cancels the running search.
+        """
+        self._generation += 1
+        for future in self._futures:
+            future.cancel()
+        self._futures = []
+        self._results.clear()
+        self._remaining = 0
+        self._timer.stop()
+
+    def replace_all(self, sub, text, regex=False, case_sensitive=False,
+                    whole_word=False):
+        """
+        Replaces all the occurrences of a text in all the open documents.
+
+        Each document is modified in a single edit block (one undo step per
+        document), see :meth:`pyqode.core.api.DocumentSearcher.replace_all`.
+        Decorations updates and syntax highlighting are suspended while a
+        document is modified. If regex is True, the group references of the
+        replacement text (e.g. ``\\1``) are expanded.
+
+        :param sub: search text or regular expression
+        :param text: replacement text
+        :param regex: True if sub is a regular expression
+        :param case_sensitive: True to match case
+        :param whole_word: True to match whole words only
+
+        :returns: the number of replaced occurrences.
+        :raises: re.error if the regular expression or the group references
+            of the replacement text are invalid (no document is modified).
+        """
+        self.cancel()
+        pattern = None
+        if regex:
+            pattern = DocumentSearcher.compile(sub, regex, case_sensitive,
+                                               whole_word)
+            # check the group references before modifying the documents
+            pattern.sub(text, '')
+        count = 0
+        for editor in self.editors():
+            searcher = DocumentSearcher.get(editor.document())
+            results = searcher.search(
+                sub, regex=regex, case_sensitive=case_sensitive,
+                whole_word=whole_word)
+            if results:
+                editor.decorations.begin_update()
+                try:
+                    searcher.replace_all(
+                        results, text, pattern=pattern,
+                        highlighter=editor.syntax_highlighter)
+                finally:
+                    editor.decorations.end_update()
+                count += len(results)
+        return count
+
+    def _search(self, generation, i, text, query, max_hits):
+        # called from a pool thread
+        if generation != self._generation:
+            return
+        try:
+            results = find_all(text, *query, max_hits=max_hits)
+        except Exception:
+            _logger().exception('failed to search document')
+            results = SearchResults()
+        self._results.append((generation, i, results))
+
+    def _process_results(self):
+        while self._results:
+            generation, i, results = self._results.popleft()
+            if generation != self._generation:
+                continue
+            self._remaining -= 1
+            editor, revision = self._documents[i]
+            editor = editor()
+            if editor is None:
+                continue
+            try:
+                document = editor.document()
+                if document.revision() != revision:
+                    # the document changed since the snapshot was taken
+                    sub, regex, case_sensitive, whole_word = self._query
+                    results = DocumentSearcher.get(document).search(
+                        sub, regex=regex, case_sensitive=case_sensitive,
+                        whole_word=whole_word, max_hits=self.max_hits)
+            except RuntimeError:
+                # editor deleted
+                continue
+            self.results_available.emit(editor, results)
+        if not self._remaining:
+            self._timer.stop()
+            self.finished.emit()
+
+
+class MultiDocumentSearchWidget(QtWidgets.QWidget):
+    """
+    A search panel that searches and replaces text in all the documents
+    opened in a :class:`pyqode.core.widgets.SplittableTabWidget`.
+
+    The occurrences are shown in a tree (one top level item per document),
+    activating an occurrence shows it in its editor.
+    """
+    def __init__(self, tab_widget, parent=None):
+        """
+        :param tab_widget: the SplittableTabWidget that contains the documents
+            to search.
+        :param parent: parent widget
+        """
+        super(MultiDocumentSearchWidget, self).__init__(parent)
+        #: The search API used by the widget
+        self.search = MultiDocumentSearch(tab_widget, self)
+        self.search.results_available.connect(self._on_results_available)
+        self.search.finished.connect(self._on_search_finished)
+        self.job_runner = DelayJobRunner(delay=300)
+        self._total = 0
+
+        self.lineEditSearch = PromptLineEdit(self, _(' Search'))
+        self.lineEditReplace = PromptLineEdit(self, _(' Replace'))
+        self.checkBoxRegex = QtWidgets.QCheckBox(_('Regex'), self)
+        self.checkBoxCase = QtWidgets.QCheckBox(_('Match case'), self)
+        self.checkBoxWholeWords = QtWidgets.QCheckBox(_('Whole words'), self)
+        self.toolButtonReplaceAll = QtWidgets.QToolButton(self)
+        self.toolButtonReplaceAll.setText(_('Replace all'))
+        self.labelMatches = QtWidgets.QLabel(self)
+        self.treeWidget = QtWidgets.QTreeWidget(self)
+        self.treeWidget.setHeaderHidden(True)
+
+        options = QtWidgets.QHBoxLayout()
+        options.addWidget(self.checkBoxRegex)
+        options.addWidget(self.checkBoxCase)
+        options.addWidget(self.checkBoxWholeWords)
+        options.addStretch()
+        options.addWidget(self.labelMatches)
+        replace = QtWidgets.QHBoxLayout()
+        replace.addWidget(self.lineEditReplace)
+        replace.addWidget(self.toolButtonReplaceAll)
+        layout = QtWidgets.QVBoxLayout(self)
+        layout.setContentsMargins(0, 0, 0, 0)
+        layout.addWidget(self.lineEditSearch)
+        layout.addLayout(replace)
+        layout.addLayout(options)
+        layout.addWidget(self.treeWidget)
+
+        self.lineEditSearch.textChanged.connect(self.request_search)
+        self.lineEditSearch.returnPressed.connect(self.request_search)
+        for check_box in [self.checkBoxRegex, self.checkBoxCase,
+                          self.checkBoxWholeWords]:
+            check_box.toggled.connect(self.request_search)
+        self.toolButtonReplaceAll.clicked.connect(self.replace_all)
+        self.treeWidget.itemActivated.connect(self._on_item_activated)
+
+    def _search_flags(self):
+        return (self.checkBoxRegex.isChecked(),
+                self.checkBoxCase.isChecked(),
+                self.checkBoxWholeWords.isChecked())
+
+    def request_search(self, *args):
+        """
+        Requests a search of the text of the search line edit.
+        """
+        self.job_runner.request_job(self._exec_search)
+
+    def _exec_search(self):
+        self.treeWidget.clear()
+        self._total = 0
+        self.labelMatches.clear()
+        self.lineEditSearch.setToolTip('')
+        sub = self.lineEditSearch.text()
+        if not sub:
+            self.search.cancel()
+            return
+        regex, case_sensitive, whole_word = self._search_flags()
+        try:
+            self.search.search(sub, regex=regex,
+                               case_sensitive=case_sensitive,
+                               whole_word=whole_word)
+        except re.error as e:
+            self.lineEditSearch.setToolTip(str(e))
+
+    def replace_all(self, *args):
+        """
+        Replaces all the occurrences in all the open documents (one undo step
+        per document).
+
+        :returns: the number of replaced occurrences.
+        """
+        sub = self.lineEditSearch.text()
+        if not sub:
+            return 0
+        self.job_runner.cancel_requests()
+        regex, case_sensitive, whole_word = self._search_flags()
+        try:
+            count = self.search.replace_all(
+                sub, self.lineEditReplace.text(), regex=regex,
+                case_sensitive=case_sensitive, whole_word=whole_word)
+        except re.error:
+            return 0
+        self._exec_search()
+        return count
+
+    def _on_results_available(self, editor, results):
+        if not results.total:
+            return
+        self._total += results.total
+        path = editor.file.path
+        name = os.path.split(path)[1] if path else editor.documentTitle()
+        root = QtWidgets.QTreeWidgetItem(
+            ['%s (%d)' % (name, results.total)])
+        root.setToolTip(0, path)
+        root.setData(0, QtCore.Qt.UserRole, (weakref.ref(editor), -1, -1))
+        document = editor.document()
+        items = []
+        block = document.begin()
+        for start, end in results:
+            if not block.position() <= start < block.position() + \
+                    block.length():
+                block = document.findBlock(start)
+            item = QtWidgets.QTreeWidgetItem(
+                ['%d: %s' % (block.blockNumber() + 1,
+                             block.text().strip()[:200])])
+            item.setData(0, QtCore.Qt.UserRole,
+                         (weakref.ref(editor), start, end))
+            items.append(item)
+        root.addChildren(items)
+        self.treeWidget.addTopLevelItem(root)
+        self._update_label()
+
+    def _on_search_finished(self):
+        self._update_label()
+
+    def _update_label(self):
+        self.labelMatches.setText(_("{0} matches").format(self._total))
+
+    def _on_item_activated(self, item):
+        editor, start, end = item.data(0, QtCore.Qt.UserRole)
+        editor = editor()
+        if editor is None:
+            return
+        try:
+            tab_widget = editor.parent_tab_widget
+            tab_widget.setCurrentIndex(tab_widget.indexOf(editor))
+        except AttributeError:
+            pass
+        if start != -1:
+            cursor = editor.textCursor()
+            cursor.setPosition(start)
+            cursor.setPosition(end, cursor.KeepAnchor)
+            editor.setTextCursor(cursor)
+        editor.setFocus()
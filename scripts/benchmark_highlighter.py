@@ -0,0 +1,326 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Syntax highlighting throughput benchmark.
+
+This script measures the throughput (lines/second) of
+:class:`pyqode.core.modes.PygmentsSH` for a set of representative lexers
+(python, c++, json and xml) on synthetic documents of increasing size.
+
+Three scenarios are measured for every (lexer, size) pair:
+
+    - **full**: full rehighlight of the document
+    - **edit**: single line edit in the middle of the document (the
+      highlighter rehighlights the modified block and every following block
+      whose state changed)
+    - **theme**: color scheme switch (which triggers a full rehighlight)
+
+Every scenario is run twice: a timed run, then a run traced with
+``tracemalloc`` (when available) to record the peak python memory, so that
+the durations do not include the allocation tracing overhead. The process
+max resident set size is recorded too. Use ``--no-memory`` to skip the
+traced runs.
+
+Results are written as json so that they can be compared between two
+revisions::
+
+    QT_QPA_PLATFORM=offscreen python scripts/benchmark_highlighter.py \\
+        -o before.json
+    # ... change the highlighter or the fold detector ...
+    QT_QPA_PLATFORM=offscreen python scripts/benchmark_highlighter.py \\
+        -o after.json --compare before.json
+
+When ``--compare`` is used, the script exits with a non zero status if one
+of the scenarios is slower than the reference by more than ``--tolerance``
+percent.
+"""
+from __future__ import print_function
+import argparse
+import gc
+import json
+import os
+import platform
+import sys
+import time
+
+try:
+    import tracemalloc
+except ImportError:
+    # python 2
+    tracemalloc = None
+try:
+    import resource
+except ImportError:
+    # windows
+    resource = None
+
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+from pyqode.qt import QtCore, QtGui, QtWidgets  # noqa
+from pyqode.core.api import CodeEdit, IndentFoldDetector  # noqa
+from pyqode.core.modes import PygmentsSH  # noqa
+
+
+#: Default document sizes (number of lines)
+SIZES = [1000, 10000, 50000, 200000]
+
+#: Lexers to benchmark: name -> (mimetype, sample source). The samples are
+#: repeated until the document reaches the requested number of lines.
+LEXERS = {
+    'python': ('text/x-python', '''\
+class Foo(object):
+    """
+    Docstring of the class.
+    """
+    def __init__(self, value=42):
+        # a comment
+        self.value = [value, 'string', {"key": 3.14}]
+
+    def compute(self, *args, **kwargs):
+        return sum(x * 2 for x in args if x % 2) + len(kwargs)
+
+'''),
+    'cpp': ('text/x-c++src', '''\
+#include <vector>
+/* multi-line
+   comment */
+template <typename T>
+class Foo : public Bar {
+public:
+    explicit Foo(int value) : m_value(value) {}
+    int compute(const std::vector<T>& args) const {
+        // a comment
+        return m_value * static_cast<int>(args.size()) + 0x2A;
+    }
+private:
+    int m_value;
+};
+
+'''),
+    'json': ('application/json', '''\
+{
+    "name": "pyqode",
+    "values": [1, 2.5, -3e10, true, false, null],
+    "nested": {
+        "key": "a \\"quoted\\" string",
+        "list": [{"a": 1}, {"b": 2}]
+    }
+},
+'''),
+    'xml': ('application/xml', '''\
+<?xml version="1.0" encoding="UTF-8"?>
+<!-- a comment -->
+<root xmlns:foo="http://example.com/foo">
+    <item id="1" name='first'>Some text &amp; entities</item>
+    <foo:item id="2">
+        <![CDATA[ raw <data> ]]>
+    </foo:item>
+</root>
+'''),
+}
+
+
+def generate_text(sample, nb_lines):
+    """
+    Repeats ``sample`` until the text reaches ``nb_lines`` lines.
+    """
+    lines = sample.splitlines()
+    repeat = nb_lines // len(lines) + 1
+    return '\n'.join((lines * repeat)[:nb_lines])
+
+
+def _max_rss():
+    """
+    Returns the max resident set size of the process in KiB (or None if not
+    available on the current platform).
+    """
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        # bytes on OSX
+        rss //= 1024
+    return rss
+
+
+def _clock():
+    return time.perf_counter() if hasattr(time, 'perf_counter') else \
+        time.time()
+
+
+class _Measure(object):
+    """
+    Measures the duration and the peak python memory of a function, in two
+    separate runs (the timed run is not traced by tracemalloc).
+    """
+    def __init__(self, func, memory=True):
+        """
+        :param func: function to measure, it is called twice if memory is
+            True.
+        :param memory: True to measure the peak python memory.
+        """
+        self.duration = 0
+        self.peak_memory = None
+        gc.collect()
+        start = _clock()
+        func()
+        self.duration = _clock() - start
+        if memory and tracemalloc is not None:
+            gc.collect()
+            tracemalloc.start()
+            try:
+                func()
+                self.peak_memory = tracemalloc.get_traced_memory()[1]
+            finally:
+                tracemalloc.stop()
+
+
+def _create_editor(text, mimetype, fold_detector):
+    editor = CodeEdit()
+    # set the text before installing the highlighter, the document will be
+    # highlighted by the measured rehighlight
+    editor.setPlainText(text, mimetype, 'utf-8')
+    sh = editor.modes.append(PygmentsSH(editor.document()))
+    sh.set_mime_type(mimetype)
+    if fold_detector:
+        sh.fold_detector = IndentFoldDetector()
+    return editor, sh
+
+
+def _result(lexer, nb_lines, scenario, measure, nb_blocks):
+    return {
+        'lexer': lexer,
+        'lines': nb_lines,
+        'scenario': scenario,
+        'duration': measure.duration,
+        'lines_per_sec': (nb_blocks / measure.duration
+                          if measure.duration else None),
+        'peak_memory': measure.peak_memory,
+        'max_rss': _max_rss(),
+    }
+
+
+def run(lexer, nb_lines, fold_detector=True, nb_edits=10, memory=True):
+    """
+    Runs the three scenarios for a lexer and a document size.
+
+    :returns: the list of results (one dict per scenario)
+    """
+    mimetype, sample = LEXERS[lexer]
+    text = generate_text(sample, nb_lines)
+    editor, sh = _create_editor(text, mimetype, fold_detector)
+    results = []
+
+    # full rehighlight
+    m = _Measure(sh.rehighlight, memory)
+    results.append(_result(lexer, nb_lines, 'full', m, nb_lines))
+
+    # single line edits in the middle of the document
+    block = editor.document().findBlockByNumber(nb_lines // 2)
+
+    def edit():
+        for _ in range(nb_edits):
+            cursor = QtGui.QTextCursor(block)
+            cursor.movePosition(cursor.EndOfBlock)
+            cursor.insertText(' ')
+
+    m = _Measure(edit, memory)
+    m.duration /= float(nb_edits)
+    results.append(_result(lexer, nb_lines, 'edit', m, 1))
+
+    # theme switch
+    def switch_theme():
+        sh.color_scheme = 'darcula' if sh.color_scheme.name != 'darcula' \
+            else 'qt'
+
+    m = _Measure(switch_theme, memory)
+    results.append(_result(lexer, nb_lines, 'theme', m, nb_lines))
+
+    # don't use CodeEdit.close, it would cache the cursor position of an
+    # unnamed file in the user settings
+    editor.modes.clear()
+    editor.deleteLater()
+    QtWidgets.QApplication.processEvents()
+    return results
+
+
+def compare(results, reference, tolerance):
+    """
+    Compares the results with a reference run.
+
+    :returns: the list of regressions, as (key, reference, current) tuples.
+    """
+    def key(r):
+        return r['lexer'], r['lines'], r['scenario']
+
+    ref = dict((key(r), r['duration']) for r in reference['results'])
+    regressions = []
+    for r in results:
+        try:
+            ref_duration = ref[key(r)]
+        except KeyError:
+            continue
+        if r['duration'] > ref_duration * (1 + tolerance / 100.0):
+            regressions.append((key(r), ref_duration, r['duration']))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Benchmarks the pygments syntax highlighter.')
+    parser.add_argument('-l', '--lexers', nargs='+', default=sorted(LEXERS),
+                        choices=sorted(LEXERS), help='lexers to benchmark')
+    parser.add_argument('-s', '--sizes', nargs='+', type=int, default=SIZES,
+                        help='document sizes, in number of lines')
+    parser.add_argument('-e', '--edits', type=int, default=10,
+                        help='number of single line edits to average')
+    parser.add_argument('--no-fold', action='store_true',
+                        help='do not install a fold detector')
+    parser.add_argument('--no-memory', action='store_true',
+                        help='do not measure the peak python memory (skips '
+                        'the traced runs)')
+    parser.add_argument('-o', '--output', help='json output file (default '
+                        'is stdout)')
+    parser.add_argument('-c', '--compare', help='reference json file')
+    parser.add_argument('-t', '--tolerance', type=float, default=10,
+                        help='regression tolerance in percent (default 10)')
+    args = parser.parse_args()
+
+    app = QtWidgets.QApplication.instance() or QtWidgets.QApplication(
+        sys.argv)
+    results = []
+    for lexer in args.lexers:
+        for size in args.sizes:
+            for r in run(lexer, size, fold_detector=not args.no_fold,
+                         nb_edits=args.edits, memory=not args.no_memory):
+                print('%(lexer)-8s %(lines)8d %(scenario)-6s '
+                      '%(duration)10.4fs' % r, file=sys.stderr)
+                results.append(r)
+    data = {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'qt': QtCore.qVersion(),
+        'fold_detector': not args.no_fold,
+        'results': results
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(data, f, indent=2)
+    else:
+        print(json.dumps(data, indent=2))
+    del app
+
+    if args.compare:
+        with open(args.compare) as f:
+            reference = json.load(f)
+        regressions = compare(results, reference, args.tolerance)
+        for (lexer, size, scenario), before, after in regressions:
+            print('regression: %s %d %s: %.4fs -> %.4fs' % (
+                lexer, size, scenario, before, after), file=sys.stderr)
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
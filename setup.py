@@ -54,6 +54,12 @@ if sys.version_info[0] == 3 and sys.version_info[1] == 2:
     pygments_req += "==1.6"
 
 
+requirements = [pygments_req, 'pyqode.qt', 'future']
+if sys.version_info[0] == 2:
+    # concurrent.futures backport
+    requirements.append('futures')
+
+
 DESCRIPTION = 'PyQt/PySide Source Code Editor Widget'
 
 
@@ -75,7 +81,7 @@ setup(
     author_email='colin.duquesnoy@gmail.com',
     description=DESCRIPTION,
     long_description=readme(),
-    install_requires=[pygments_req, 'pyqode.qt', 'future'],
+    install_requires=requirements,
     tests_require=['pytest-xdist', 'pytest-cov', 'pytest-pep8', 'pytest'],
     entry_points={
         'console_scripts': [
@@ -350,6 +350,11 @@ def test_clone(editor):
     assert len(editor.clones) == 1
     assert new in editor.clones
     assert editor.document() == new.document()
+    editor.file.restore_fold_state = False
+    try:
+        assert editor.split().file.restore_fold_state is False
+    finally:
+        editor.file.restore_fold_state = True
 
 
 def test_cut_empty_line(editor):
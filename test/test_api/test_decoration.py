@@ -74,3 +74,125 @@ def test_formats(editor):
     deco.set_as_error(QtGui.QColor('#FF0000'))
     deco.set_as_error()
     deco.set_as_warning()
+
+
+@editor_open(__file__)
+def test_decorations_order_and_batch(editor):
+    editor.decorations.clear()
+    decos = []
+    for order in [3, 1, 2, 1, 0]:
+        deco = TextDecoration(editor.textCursor(), draw_order=order)
+        decos.append(deco)
+    editor.decorations.begin_update()
+    for deco in decos:
+        assert editor.decorations.append(deco)
+    # nothing pushed to the editor until the end of the update
+    assert len(editor.extraSelections()) == 0
+    # not sorted until the end of the update
+    assert len(editor.decorations._pending) == len(decos)
+    assert len(editor.decorations) == len(decos)
+    editor.decorations.end_update()
+    assert not editor.decorations._pending
+    assert len(editor.extraSelections()) == len(decos)
+    # sorted by draw order, insertion order is kept for equal draw orders
+    assert list(editor.decorations) == [
+        decos[4], decos[1], decos[3], decos[2], decos[0]]
+    assert decos[3] in editor.decorations
+    assert editor.decorations.remove(decos[3])
+    assert decos[3] not in editor.decorations
+    assert list(editor.decorations) == [
+        decos[4], decos[1], decos[2], decos[0]]
+    editor.decorations.clear()
+    assert len(editor.extraSelections()) == 0
+
+
+@editor_open(__file__)
+def test_decorations_at(editor):
+    editor.decorations.clear()
+    block = editor.document().findBlockByNumber(1)
+    deco = TextDecoration(editor.textCursor(), start_pos=block.position(),
+                          end_pos=block.position() + 5, draw_order=2)
+    line_deco = TextDecoration(editor.textCursor(), start_line=1,
+                               end_line=2, draw_order=1)
+    editor.decorations.append(deco)
+    editor.decorations.append(line_deco)
+    helper = TextHelper(editor)
+    helper.goto_line(1, 2)
+    assert editor.decorations.decorations_at(editor.textCursor()) == [
+        line_deco, deco]
+    helper.goto_line(1, 7)
+    assert editor.decorations.decorations_at(editor.textCursor()) == [
+        line_deco]
+    helper.goto_line(3, 0)
+    assert editor.decorations.decorations_at(editor.textCursor()) == []
+    # positions are updated when the text changes, the index is shifted
+    index = editor.decorations._index
+    helper.goto_line(0, 0)
+    editor.textCursor().insertText('\n')
+    helper.goto_line(2, 2)
+    assert editor.decorations.decorations_at(editor.textCursor()) == [
+        line_deco, deco]
+    assert editor.decorations._index is index
+    # a change inside a decoration rebuilds the index
+    editor.textCursor().insertText('x')
+    assert editor.decorations._index is None
+    assert editor.decorations.decorations_at(editor.textCursor()) == [
+        line_deco, deco]
+    editor.decorations.clear()
+
+
+@editor_open(__file__)
+def test_decorations_clipping(editor):
+    editor.decorations.clear()
+    doc = editor.document()
+    decos = []
+    for i in range(doc.blockCount()):
+        decos.append(TextDecoration(editor.textCursor(), start_line=i))
+    editor.decorations.clip_threshold = 0
+    editor.decorations.clip_margin = 0
+    editor.decorations.begin_update()
+    for deco in decos:
+        editor.decorations.append(deco)
+    editor.decorations.end_update()
+    assert len(editor.decorations) == len(decos)
+    assert len(editor.extraSelections()) < len(decos)
+    editor.decorations.clip_threshold = 500
+    editor.decorations.clip_margin = 100
+    editor.decorations.clear()
+
+
+@editor_open(__file__)
+def test_decoration_layers(editor):
+    editor.decorations.clear()
+    other = TextDecoration(editor.textCursor(), start_line=0, end_line=1)
+    editor.decorations.append(other)
+    decos = [TextDecoration(editor.textCursor(), start_line=i, end_line=i + 1,
+                            draw_order=1) for i in range(3)]
+    editor.decorations.replace_layer('search', decos)
+    assert editor.decorations.layer('search') == decos
+    assert len(editor.decorations) == 4
+    editor.decorations.replace_layer('search', decos[:1])
+    assert editor.decorations.layer('search') == decos[:1]
+    assert list(editor.decorations) == [other, decos[0]]
+    # restyle
+    color = QtGui.QColor('#FF0000')
+    editor.decorations.restyle_layer(
+        'search', lambda deco: deco.set_background(color))
+    assert decos[0].format.background().color() == color
+    # hide
+    helper = TextHelper(editor)
+    helper.goto_line(0, 0)
+    assert editor.decorations.decorations_at(editor.textCursor()) == [
+        other, decos[0]]
+    editor.decorations.set_layer_visible('search', False)
+    assert not editor.decorations.is_layer_visible('search')
+    assert editor.decorations.decorations_at(editor.textCursor()) == [other]
+    assert decos[0] in editor.decorations
+    editor.decorations.set_layer_visible('search', True)
+    # removing a decoration removes it from its layer
+    editor.decorations.remove(decos[0])
+    assert editor.decorations.layer('search') == []
+    editor.decorations.replace_layer('search', decos)
+    editor.decorations.clear_layer('search')
+    assert list(editor.decorations) == [other]
+    editor.decorations.clear()
@@ -1,5 +1,29 @@
+import pytest
 from pyqode.core.api import encodings
 
 
 def test_convert_to_code_key():
     assert encodings.convert_to_codec_key('UTF-8') == 'utf_8'
+
+
+def test_decode():
+    text = u'h\xe9llo\n' * 1000
+    data = text.encode('utf_16')
+    assert encodings.get_bom_encoding(data) == 'utf_16'
+    assert encodings.decode(data, ['utf_8']) == ('utf_16', text)
+    data = text.encode('cp1252')
+    assert encodings.get_bom_encoding(data) is None
+    assert encodings.decode(data, ['utf_8', 'cp1252']) == ('cp1252', text)
+    with pytest.raises(UnicodeDecodeError):
+        encodings.decode(data, ['utf_8', 'ascii'])
+
+
+def test_decode_file(tmpdir):
+    path = str(tmpdir.join('big.txt'))
+    text = u'h\xe9llo\n' * encodings.MMAP_THRESHOLD
+    with open(path, 'wb') as f:
+        f.write(text.encode('utf_8_sig'))
+    # memory mapped
+    assert encodings.decode_file(path, ['cp1252']) == ('utf_8_sig', text)
+    assert encodings.decode_file(path, ['cp1252'], detect_bom=False)[0] == \
+        'cp1252'
@@ -2,6 +2,10 @@ import glob
 import re
 import pytest
 import sys
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
 from ..helpers import delete_file_on_return, editor_open
 from pyqode.core.api import folding, TextBlockHelper, TextHelper
 from pyqode.qt.QtTest import QTest
@@ -178,3 +182,60 @@ class DynamicFoldDetectorTestCase(object):
 ])
 def test_fold_detection_dynamic(editor, case):
     case.execute(editor)
+
+
+def test_fold_index(editor):
+    from pyqode.qt import QtGui
+    editor.file.open('test/test_api/folding_cases/foo.py')
+    doc = editor.document()
+    index = folding.FoldIndex.get(doc)
+    assert folding.FoldIndex.get(doc) is index
+    # class Foo
+    scope = folding.FoldScope(doc.findBlockByNumber(8))
+    start, end = scope.get_range()
+    children = [c.get_range() for c in scope.child_regions()]
+    assert children
+    for child in scope.child_regions():
+        assert child.parent().get_range() == (start, end)
+    # adding lines in the class body must update the index
+    cursor = QtGui.QTextCursor(doc.findBlockByNumber(9))
+    cursor.insertText('    a = 1\n    b = 2\n')
+    assert scope.get_range() == (start, end + 2)
+    assert [c.get_range() for c in scope.child_regions()] == [
+        (s + 2, e + 2) for s, e in children]
+    assert folding.FoldScope.find_parent_scope(
+        doc.findBlockByNumber(10)).blockNumber() == start
+    # a fold level change only updates the regions around the block
+    TextBlockHelper.set_fold_lvl(doc.findBlockByNumber(14), 0)
+    assert scope.get_range() == (start, 13)
+    assert not list(scope.child_regions())
+
+
+def test_bulk_fold_detection(editor):
+    with open('test/test_api/folding_cases/foo.py', 'r') as f:
+        content = f.read()
+    with open('test/test_api/folding_cases/foo.static_results', 'r') as f:
+        expected = f.read()
+    assert editor.syntax_highlighter.fold_detector.bulk_processing
+    # fold levels must be computed even if the highlighter is disabled
+    editor.syntax_highlighter.enabled = False
+    try:
+        editor.setPlainText(content, '', '')
+        results = StringIO()
+        folding.print_tree(editor, file=results, print_blocks=True)
+        assert results.getvalue() == expected
+    finally:
+        editor.syntax_highlighter.enabled = True
+
+
+def test_bulk_fold_detection_line_separator(editor):
+    # U+2028 is kept inside its block but toPlainText turns it into '\n'
+    content = u'def foo():\n    a = 1\u2028\n    if a:\n        pass\nb = 2\n'
+    editor.setPlainText(content, '', '')
+    doc = editor.document()
+    levels = [TextBlockHelper.get_fold_lvl(doc.findBlockByNumber(i))
+              for i in range(doc.blockCount())]
+    editor.syntax_highlighter.rehighlight()
+    assert levels == [
+        TextBlockHelper.get_fold_lvl(doc.findBlockByNumber(i))
+        for i in range(doc.blockCount())]
@@ -6,6 +6,8 @@ import mimetypes
 import os
 import sys
 import pytest
+from pyqode.core.api import CodeEdit, SyntaxHighlighter
+from pyqode.core.api.search import DocumentSearcher
 from pyqode.core.api.utils import TextHelper, keep_tc_pos
 
 from pyqode.qt import QtGui, QtWidgets
@@ -239,6 +241,79 @@ def test_search_text(editor):
     assert len(occurences) == 10
 
 
+class StringHighlighter(SyntaxHighlighter):
+    def highlight_block(self, text, block):
+        start = text.find('"')
+        if start != -1:
+            self.setFormat(start, len(text) - start, self.formats['string'])
+
+
+def test_is_comment_or_string():
+    editor = CodeEdit()
+    editor.modes.append(StringHighlighter(editor.document()))
+    editor.setPlainText('a = "(b c"\nd = (e)', '', '')
+    block = editor.document().firstBlock()
+    assert list(block.userData().literal_starts) == [4]
+    assert list(block.userData().literal_ends) == [10]
+    # the bracket in the string is not recorded
+    assert block.userData().bracket_chars == ''
+    helper = TextHelper(editor)
+    cursor = editor.textCursor()
+    cursor.setPosition(6)
+    assert helper.is_comment_or_string(cursor)
+    assert not helper.is_comment_or_string(cursor, formats=['comment'])
+    cursor.setPosition(1)
+    assert not helper.is_comment_or_string(cursor)
+    assert helper.is_comment_or_string(block)
+    assert not helper.is_comment_or_string(block.next())
+    editor.close()
+    del editor
+
+
+def test_document_searcher(editor):
+    editor.setPlainText('foo Foo foo_bar\nfoo', '', '')
+    searcher = DocumentSearcher.get(editor.document())
+    assert DocumentSearcher.get(editor.document()) is searcher
+    results = searcher.search('foo')
+    assert list(results) == [(0, 3), (4, 7), (8, 11), (16, 19)]
+    assert results.index(5, 6) == 1
+    assert len(searcher.search('foo', case_sensitive=True)) == 3
+    assert len(searcher.search('foo', whole_word=True)) == 3
+    assert list(searcher.search('f.o$', regex=True)) == [(16, 19)]
+    # incremental search, the query extends the previous one
+    assert list(searcher.search('foo_')) == [(8, 12)]
+    # hit cap
+    results = searcher.search('o', max_hits=2)
+    assert len(results) == 2
+    assert results.total == 8
+    # the text snapshot is invalidated when the document changes
+    TextHelper(editor).insert_text('foo')
+    assert searcher.search('foo').total == 5
+
+
+def test_document_searcher_non_bmp(editor):
+    # positions are UTF-16 positions (a non BMP character counts twice)
+    editor.setPlainText(u'x\U0001F600foo\nfoo', '', '')
+    searcher = DocumentSearcher.get(editor.document())
+    results = searcher.search('foo')
+    assert list(results) == [(3, 6), (7, 10)]
+    cursor = editor.textCursor()
+    cursor.setPosition(results.starts[0])
+    cursor.setPosition(results.ends[0], cursor.KeepAnchor)
+    assert cursor.selectedText() == 'foo'
+    assert list(searcher.search('foo', start=4)) == [(7, 10)]
+
+
+def test_compiled_patterns():
+    pattern = DocumentSearcher.compile('foo', whole_word=True)
+    assert DocumentSearcher.compile('foo', whole_word=True) is pattern
+    for i in range(DocumentSearcher._max_patterns):
+        DocumentSearcher.compile('bar%d' % i)
+    # least recently used patterns are dropped
+    assert len(DocumentSearcher._patterns) == DocumentSearcher._max_patterns
+    assert DocumentSearcher.compile('foo', whole_word=True) is not pattern
+
+
 @editor_open(__file__)
 def test_keep_tc(editor):
     @keep_tc_pos
@@ -308,3 +383,22 @@ def test_matched_selection(editor):
     cursor = editor.textCursor()
     assert cursor.hasSelection()
     assert text in cursor.selectedText()
+
+
+@editor_open(__file__)
+def test_long_block(editor):
+    from pyqode.core.api.utils import get_block_symbol_data
+    editor.long_line_threshold = 100
+    editor.setPlainText('(a)\n' + '(' * 200, 'text/x-python', 'utf-8')
+    helper = TextHelper(editor)
+    first = editor.document().firstBlock()
+    last = editor.document().lastBlock()
+    assert not helper.is_long_block(first)
+    assert helper.is_long_block(last)
+    assert len(get_block_symbol_data(editor, first)[0]) == 2
+    assert get_block_symbol_data(editor, last) == ([], [], [])
+    editor.truncate_long_lines = True
+    # the tail of the long line is not formatted
+    assert max(r.start + r.length for r in last.layout().formats()) <= 100
+    editor.long_line_threshold = 0
+    assert not helper.is_long_block(last)
@@ -106,3 +106,20 @@ def test_block_helper():
     assert utils.TextBlockHelper.is_fold_trigger(block) is True
     assert utils.TextBlockHelper.get_fold_lvl(block) == 1023
     assert utils.TextBlockHelper.get_state(block) == 26
+
+
+def test_get_changed_blocks():
+    doc = QtGui.QTextDocument()
+    doc.setPlainText('a\nb\nc')
+    changes = []
+    doc.contentsChange.connect(
+        lambda *args: changes.append(utils.get_changed_blocks(
+            doc, args[0], args[2], 3 + len(changes) * 2)))
+    # two lines inserted in the second block
+    QtGui.QTextCursor(doc.findBlockByNumber(1)).insertText('x\ny\n')
+    # three lines removed
+    cursor = QtGui.QTextCursor(doc.findBlockByNumber(1))
+    cursor.setPosition(doc.findBlockByNumber(4).position(),
+                       cursor.KeepAnchor)
+    cursor.removeSelectedText()
+    assert changes == [(1, 3, 1), (1, 1, 4)]
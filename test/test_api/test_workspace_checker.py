@@ -0,0 +1,129 @@
+import os
+import time
+
+from pyqode.core.api import WorkspaceChecker
+from pyqode.core.widgets import ErrorsTable
+from pyqode.qt.QtTest import QTest
+
+
+def check(data):
+    if 'crash' in data['code']:
+        raise ValueError('checker crashed')
+    return [('desc', 2, i) for i, line in enumerate(data['code'].splitlines())
+            if 'error' in line]
+
+
+def logged_check(data):
+    with open(data['path'] + '.log', 'a') as f:
+        f.write('x')
+    return check(data)
+
+
+def wait_finished(checker, timeout=30):
+    start = time.time()
+    while checker.running and time.time() - start < timeout:
+        QTest.qWait(100)
+    assert not checker.running
+
+
+def test_check_directory(tmpdir):
+    tmpdir.join('a.txt').write('error\nok\nerror\n')
+    tmpdir.join('b.txt').write('ok\n')
+    tmpdir.join('c.py').write('error\n')
+    table = ErrorsTable()
+    checker = WorkspaceChecker(check, errors_table=table, max_processes=2)
+    checked = []
+    checker.file_checked.connect(lambda path, msgs: checked.append(path))
+    try:
+        checker.check_directory(str(tmpdir), patterns=['*.txt'])
+        wait_finished(checker)
+        assert len(checker.messages()) == 2
+        assert table.rowCount() == 2
+        assert sorted(os.path.basename(p) for p in checked) == [
+            'a.txt', 'b.txt']
+        # nothing changed, nothing is checked
+        del checked[:]
+        checker.check_directory(str(tmpdir), patterns=['*.txt'])
+        wait_finished(checker)
+        assert checked == []
+        # only the modified file is checked again
+        path = str(tmpdir.join('b.txt'))
+        tmpdir.join('b.txt').write('error\nok\n')
+        os.utime(path, (time.time() + 10, time.time() + 10))
+        checker.check([path])
+        wait_finished(checker)
+        assert checked == [path]
+        assert len(checker.messages(path)) == 1
+        assert table.rowCount() == 3
+        # removed files are forgotten
+        tmpdir.join('a.txt').remove()
+        checker.check_directory(str(tmpdir), patterns=['*.txt'])
+        assert table.rowCount() == 1
+    finally:
+        checker.close()
+
+
+def test_check_failed(tmpdir):
+    path = str(tmpdir.join('a.txt'))
+    tmpdir.join('a.txt').write('error\n')
+    checker = WorkspaceChecker(check, max_processes=1)
+    failures = []
+    checker.file_check_failed.connect(
+        lambda path, error: failures.append(path))
+    try:
+        checker.check([path])
+        wait_finished(checker)
+        assert len(checker.messages(path)) == 1
+        tmpdir.join('a.txt').write('error\ncrash\n')
+        os.utime(path, (time.time() + 10, time.time() + 10))
+        checker.check([path])
+        wait_finished(checker)
+        assert failures == [path]
+        # the previous messages are kept
+        assert len(checker.messages(path)) == 1
+    finally:
+        checker.close()
+
+
+def test_reverted_file(tmpdir):
+    path = str(tmpdir.join('a.txt'))
+    checker = WorkspaceChecker(logged_check, max_processes=1)
+    try:
+        for i, content in enumerate(['error\n', 'ok\n', 'error\n']):
+            tmpdir.join('a.txt').write(content)
+            os.utime(path, (time.time() + 10 * i, time.time() + 10 * i))
+            checker.check([path])
+            wait_finished(checker)
+            assert len(checker.messages(path)) == content.count('error')
+        # the reverted content is not checked again
+        assert tmpdir.join('a.txt.log').read() == 'xx'
+    finally:
+        checker.close()
+
+
+def test_cached_dependencies(tmpdir):
+    calls = []
+
+    def dependencies(path):
+        calls.append(path)
+        if path.endswith('b.txt'):
+            return [str(tmpdir.join('a.txt'))]
+        return []
+
+    for name in 'abc':
+        tmpdir.join('%s.txt' % name).write('ok\n')
+    checker = WorkspaceChecker(check, max_processes=1)
+    checker.dependencies = dependencies
+    try:
+        checker.check_directory(str(tmpdir))
+        wait_finished(checker)
+        assert len(calls) == 3
+        del calls[:]
+        path = str(tmpdir.join('a.txt'))
+        os.utime(path, (time.time() + 10, time.time() + 10))
+        checker.check([path])
+        # only the dependencies of the changed file are asked again
+        assert calls == [path]
+        wait_finished(checker)
+    finally:
+        checker.close()
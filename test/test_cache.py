@@ -1,11 +1,14 @@
 """
 Test pyqode.core.settings
 """
+import json
 import os
 import locale
 import pytest
+from pyqode.core import cache
 from pyqode.core.api import convert_to_codec_key
-from pyqode.core.cache import Cache
+from pyqode.core.cache import Cache, FileMetadataStore
+from pyqode.qt import QtCore
 
 
 def test_preferred_encodings():
@@ -31,3 +34,62 @@ def test_cached_encodings():
     s.set_file_encoding(__file__, 'utf_16')
     s = Cache(suffix='-pytest')
     assert s.get_file_encoding(__file__) == 'utf_16'
+
+
+def test_detect_file_encoding(tmpdir):
+    s = Cache(suffix='-pytest')
+    s.clear()
+    path = str(tmpdir.join('bom.txt'))
+    with open(path, 'wb') as f:
+        f.write(u'h\xe9llo'.encode('utf_16'))
+    with pytest.raises(KeyError):
+        s.get_cached_file_encoding(path)
+    assert s.get_file_encoding(path) == 'utf_16'
+    path = str(tmpdir.join('cp1252.txt'))
+    with open(path, 'wb') as f:
+        f.write(u'h\xe9llo'.encode('cp1252'))
+    assert s.get_file_encoding(path, preferred_encoding='cp1252') == 'cp1252'
+
+
+def test_cached_fold_state():
+    s = Cache(suffix='-pytest')
+    s.clear()
+    assert s.get_fold_state(__file__) == []
+    s.set_fold_state(__file__, [(10, 1234), (20, 5678)])
+    s = Cache(suffix='-pytest')
+    assert s.get_fold_state(__file__) == [(10, 1234), (20, 5678)]
+    s.set_fold_state(__file__, [])
+    assert s.get_fold_state(__file__) == []
+
+
+def test_migrate_legacy_maps(monkeypatch):
+    s = Cache(suffix='-pytest')
+    s.clear()
+    settings = QtCore.QSettings('pyQode', 'pyqode.core-pytest')
+    settings.setValue('cachedFileEncodings', json.dumps({__file__: 'cp1252'}))
+    settings.setValue('cachedCursorPosition', json.dumps({__file__: 42}))
+    # the maps are only migrated once per process
+    s = Cache(suffix='-pytest')
+    assert settings.contains('cachedFileEncodings')
+    monkeypatch.setattr(cache, '_MIGRATED', set())
+    s = Cache(suffix='-pytest')
+    assert not settings.contains('cachedFileEncodings')
+    assert s.get_file_encoding(__file__) == 'cp1252'
+    assert s.get_cursor_position(__file__) == 42
+
+
+def test_metadata_store_eviction():
+    s = Cache(suffix='-pytest')
+    s.clear()
+    store = FileMetadataStore.get(s._store_path())
+    max_files = store.max_files
+    store.max_files = 2
+    try:
+        for i in range(3):
+            s.set_cursor_position('file%d.py' % i, i + 1)
+            store.flush()
+        # least recently used file removed
+        assert s.get_cursor_position('file0.py') == 0
+        assert s.get_cursor_position('file2.py') == 3
+    finally:
+        store.max_files = max_files
@@ -84,3 +84,35 @@ def test_preferred_encodings(editor, preferred_eol):
         print(f.read())
         assert f.newlines == editor.file.EOL.string(preferred_eol)
     os.remove(fn)
+
+
+def test_restore_fold_state(editor):
+    from pyqode.core.api import TextBlockHelper
+    from pyqode.core.cache import Cache
+    path = os.path.join(os.getcwd(), 'test', 'test_api', 'folding_cases',
+                        'foo.py')
+    panel = editor.panels.get(panels.FoldingPanel)
+    editor.file.open(path)
+    block = editor.document().findBlockByNumber(8)
+    panel.toggle_fold_trigger(block)
+    assert TextBlockHelper.is_collapsed(block)
+    editor.file.close()
+    assert Cache().get_fold_state(path)
+    editor.file.open(path)
+    block = editor.document().findBlockByNumber(8)
+    assert TextBlockHelper.is_collapsed(block)
+    assert not block.next().isVisible()
+    panel.expand_all()
+    editor.file.close()
+    assert Cache().get_fold_state(path) == []
+
+
+def test_open_detects_bom(editor, tmpdir):
+    path = str(tmpdir.join('bom.txt'))
+    with open(path, 'wb') as f:
+        f.write(u'First line\r\nSecond line'.encode('utf_16'))
+    editor.file.autodetect_eol = True
+    editor.file.open(path, encoding='utf-8')
+    assert editor.file.encoding == 'utf_16'
+    assert editor.file._eol == '\r\n'
+    assert editor.toPlainText() == 'First line\nSecond line'
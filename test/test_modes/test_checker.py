@@ -46,7 +46,7 @@ def test_add_messages(editor):
     mode.add_messages([modes.CheckerMessage('desc', random.choice(status),
                                             10 + i)
                        for i in range(500)])
-    assert len(mode._messages) < 500
+    assert len(mode._messages) == 500
     QTest.qWait(500)
 
 
@@ -57,6 +57,7 @@ def test_remove_message(editor):
     mode.clear_messages()
     status = [modes.CheckerMessages.ERROR, modes.CheckerMessages.WARNING,
               modes.CheckerMessages.INFO]
+    mode.limit = 200
     mode.add_messages([modes.CheckerMessage('desc', modes.CheckerMessages.ERROR,
                                             10 + i)
                        for i in range(mode.limit * 2)])
@@ -67,6 +68,7 @@ def test_remove_message(editor):
     mode.remove_message(mode._messages[10])
     QTest.qWait(5000)
     assert len(mode._messages) == mode.limit - 1
+    mode.limit = None
     mode.clear_messages()
 
 
@@ -94,3 +96,89 @@ def check(data):
         return [('desc', i % 3, 10 + i) for i in range(150)]
     else:
         return [('desc', i % 3, 10 + i) for i in range(20)]
+
+
+@editor_open(__file__)
+def test_messages_diff(editor):
+    mode = get_mode(editor)
+    mode.clear_messages()
+    mode.add_messages([modes.CheckerMessage('desc', i % 3, 10 + i)
+                       for i in range(20)])
+    assert mode._finished
+    assert len(mode.messages) == 20
+    kept = mode.messages[5]
+    decoration = kept.decoration
+    mode.add_messages([modes.CheckerMessage('desc', i % 3, 10 + i)
+                       for i in range(5, 30)])
+    assert len(mode.messages) == 25
+    # unchanged messages are not re-created
+    assert kept in mode.messages
+    assert kept.decoration is decoration
+    assert len(editor.decorations.layer('checker')) == 25
+    mode.clear_messages()
+    assert not editor.decorations.layer('checker')
+
+
+@editor_open(__file__)
+def test_messages_displayed_near_viewport(editor):
+    mode = get_mode(editor)
+    mode.clear_messages()
+    editor.setPlainText('\n'.join(['pass'] * 5000), '', '')
+    mode.add_messages([modes.CheckerMessage('desc', i % 3, i)
+                       for i in range(5000)])
+    assert len(mode.messages) == 5000
+    assert len(mode.messages_per_line) == 5000
+    displayed = [msg for msg in mode.messages if msg.decoration]
+    assert 0 < len(displayed) < 5000
+    assert len(editor.decorations.layer('checker')) == len(displayed)
+    last = editor.document().lastBlock()
+    assert not last.userData() or not last.userData().messages
+    mode.clear_messages()
+
+
+@editor_open(__file__)
+def test_messages_follow_lines(editor):
+    mode = get_mode(editor)
+    mode.clear_messages()
+    editor.setPlainText('\n'.join(['pass'] * 5000), '', '')
+    far = modes.CheckerMessage('far', 2, 4000)
+    near = modes.CheckerMessage('near', 2, 10)
+    mode.add_messages([far, near])
+    # insert two lines at the top of the document
+    cursor = editor.textCursor()
+    cursor.setPosition(0)
+    cursor.insertText('\n\n')
+    assert near.line == 12
+    assert far.line == 4002
+    assert mode.messages_per_line[4002] == [far]
+    # remove the inserted lines
+    cursor.setPosition(0)
+    cursor.setPosition(2, cursor.KeepAnchor)
+    cursor.removeSelectedText()
+    assert far.line == 4000
+    mode.remove_message(far)
+    assert 4000 not in mode.messages_per_line
+    mode.clear_messages()
+
+
+def test_messages_moved_to_the_same_line(editor):
+    mode = get_mode(editor)
+    mode.clear_messages()
+    editor.setPlainText('\n'.join(['pass'] * 5000), '', '')
+    first = modes.CheckerMessage('msg', 2, 3000)
+    second = modes.CheckerMessage('msg', 2, 3001)
+    mode.add_messages([first, second])
+    # remove line 3001: both messages end up on line 3000, with the same key
+    cursor = editor.textCursor()
+    cursor.setPosition(editor.document().findBlockByNumber(3000).position())
+    cursor.setPosition(editor.document().findBlockByNumber(3002).position(),
+                       cursor.KeepAnchor)
+    cursor.removeSelectedText()
+    assert first.line == second.line == 3000
+    assert first.key == second.key
+    mode.remove_message(first)
+    assert mode.messages_per_line[3000] == [second]
+    # the remaining message is still known: it is not added twice
+    mode.add_messages([second, modes.CheckerMessage('msg', 2, 3000)])
+    assert mode.messages == [second]
+    mode.clear_messages()
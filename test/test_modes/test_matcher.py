@@ -14,7 +14,7 @@ example_tuple = (
 
 
 from test.helpers import editor_open
-from pyqode.core.api import TextHelper
+from pyqode.core.api import TextHelper, get_block_bracket_depths
 from pyqode.core import modes
 from pyqode.qt import QtGui
 
@@ -143,3 +143,26 @@ def test_symbol_pos(editor):
     l, c = mode.symbol_pos(cursor)
     assert l == 9
     assert c == 17
+
+
+skip_code = """def foo():
+    a = (1,
+         [2, 3],
+         {4: 6},
+         5)
+"""
+
+
+@editor_open(__file__)
+def test_recorded_brackets(editor):
+    mode = get_mode(editor)
+    editor.setPlainText(skip_code, 'text/x-python', 'utf-8')
+    block = editor.document().findBlockByNumber(3)
+    assert block.userData().bracket_chars == '{}'
+    assert get_block_bracket_depths(editor, block) == (
+        (0, 0, 0), (0, 0, 0), (0, 0, 0))
+    block = editor.document().findBlockByNumber(1)
+    assert get_block_bracket_depths(editor, block)[0] == (1, 0, -1)
+    # the blocks in between are skipped using their depth summary
+    cursor = TextHelper(editor).goto_line(4, 11, move=False)
+    assert mode.symbol_pos(cursor) == (1, 8)
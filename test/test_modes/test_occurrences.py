@@ -2,7 +2,7 @@ import pytest
 from pyqode.qt import QtGui
 from pyqode.qt.QtTest import QTest
 
-from pyqode.core.api import TextHelper
+from pyqode.core.api import TextHelper, WordIndex
 from pyqode.core import modes
 
 from ..helpers import ensure_visible, ensure_connected
@@ -23,11 +23,11 @@ def test_enabled(editor):
 @ensure_visible
 def test_delay(editor):
     mode = get_mode(editor)
-    assert mode.delay == 1000
+    assert mode.delay == 50
     mode.delay = 3000
     assert mode.delay == 3000
-    mode.delay = 1000
-    assert mode.delay == 1000
+    mode.delay = 50
+    assert mode.delay == 50
 
 
 @ensure_connected
@@ -57,8 +57,26 @@ def test_occurrences(editor):
         assert editor.backend.running is True
         mode = get_mode(editor)
         mode.underlined = underlined
-        assert len(mode._decorations) == 0
-        assert mode.delay == 1000
+        assert len(editor.decorations.layer('occurrences')) == 0
+        assert mode.delay == 50
         TextHelper(editor).goto_line(16, 7)
         QTest.qWait(2000)
-        assert len(mode._decorations) > 0
+        assert len(editor.decorations.layer('occurrences')) > 0
+
+
+def test_word_index(editor):
+    editor.setPlainText('foo bar\nFoo foo_bar\nbar foo', '', '')
+    index = WordIndex.get(editor.document())
+    assert index.occurrences('foo') == [(0, 3), (8, 11), (24, 27)]
+    assert index.occurrences('foo', case_sensitive=True) == [(0, 3), (24, 27)]
+    assert index.occurrences('foo', first_line=1, last_line=1) == [(8, 11)]
+    assert index.count('bar') == 2
+    # the modified blocks are tokenized again
+    cursor = editor.textCursor()
+    cursor.setPosition(4)
+    cursor.insertText('foo\n')
+    assert index.occurrences('foo') == [(0, 3), (4, 7), (12, 15), (28, 31)]
+    assert index.count('bar') == 2
+    # non BMP characters count as two positions
+    editor.setPlainText(u'\U0001F600 foo', '', '')
+    assert index.occurrences('foo') == [(3, 6)]
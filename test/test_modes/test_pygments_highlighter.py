@@ -1,3 +1,4 @@
+import pytest
 from pyqode.qt.QtTest import QTest
 from pyqode.core import modes
 from test.helpers import editor_open
@@ -27,3 +28,82 @@ def test_apply_all_pygments_styles(editor):
         mode.pygments_style = style
         assert mode.pygments_style == style
         QTest.qWait(500)
+
+
+def test_shared_formats(editor):
+    from pygments.token import Token
+    from pyqode.core.api import ColorScheme
+    mode = get_mode(editor)
+    other = modes.PygmentsSH(None, color_scheme=mode.color_scheme)
+    other._style = mode._style
+    other._pygments_style = mode._pygments_style
+    assert (mode._get_format(Token.Keyword) is
+            other._get_format(Token.Keyword))
+    assert (ColorScheme('monokai').formats['keyword'] is
+            ColorScheme('monokai').formats['keyword'])
+    # each color scheme has its own dict, the cached one is not modified
+    scheme = ColorScheme('monokai')
+    scheme.formats['keyword'] = None
+    assert ColorScheme('monokai').formats['keyword'] is not None
+
+
+def test_lexer_cache():
+    from pyqode.core.modes.pygments_sh import LexerCache
+    LexerCache.clear()
+    lexer = LexerCache.lexer_for_filename('foo.py')
+    assert lexer.name == 'Python'
+    assert 'ext:.py' in LexerCache._classes
+    # special file names are cached by name, not by extension
+    assert LexerCache.lexer_for_filename('CMakeLists.txt').name == 'CMake'
+    assert LexerCache.lexer_for_filename('foo.txt').name != 'CMake'
+    assert 'name:CMakeLists.txt' in LexerCache._classes
+    assert LexerCache.lexer_for_mimetype('text/x-python').name == 'Python'
+
+
+def test_persistent_lexer_cache(monkeypatch):
+    from pyqode.core.modes import pygments_sh
+    from pyqode.core.modes.pygments_sh import LexerCache
+    monkeypatch.setattr(LexerCache, 'persistent', True)
+    LexerCache.clear()
+    LexerCache.lexer_for_filename('foo.py')
+    # new run: the registered lexers must not be scanned again
+    LexerCache._classes.clear()
+    LexerCache._special_patterns = None
+    LexerCache._loaded = False
+
+    def scan():
+        raise AssertionError('lexers scanned')
+
+    monkeypatch.setattr(pygments_sh, 'get_all_lexers', scan)
+    assert LexerCache.lexer_for_filename('bar.py').name == 'Python'
+    # the persisted lexers of another pygments version are not used
+    monkeypatch.setattr(pygments_sh.pygments, '__version__', '0.0')
+    LexerCache._classes.clear()
+    LexerCache._special_patterns = None
+    LexerCache._loaded = False
+    with pytest.raises(AssertionError):
+        LexerCache.lexer_for_filename('bar.py')
+    # clear the persisted entries too
+    LexerCache.clear()
+    monkeypatch.undo()
+
+
+def test_lazy_styles():
+    assert 'qt' in modes.PYGMENTS_STYLES
+    assert 'darcula' in modes.PYGMENTS_STYLES
+    assert list(modes.PYGMENTS_STYLES) == sorted(modes.PYGMENTS_STYLES)
+    styles = ['mystyle'] + modes.PYGMENTS_STYLES
+    assert styles[0] == 'mystyle' and styles[1:] == modes.PYGMENTS_STYLES
+
+
+def test_long_first_line(editor):
+    editor.long_line_threshold = 100
+    # the first line is not lexed, the next lines must still be highlighted
+    editor.setPlainText('"' * 200 + '\nx = """\ndoc\n"""', 'text/x-python',
+                        'utf-8')
+    mode = get_mode(editor)
+    mode.rehighlight()
+    block = editor.document().findBlockByNumber(2)
+    # still inside the docstring opened on the previous line
+    assert block.userData().syntax_stack[-1] != 'root'
+    editor.long_line_threshold = 10000
@@ -28,3 +28,24 @@ def test_enabled(editor):
 
 def check(data):
     return True, [('desc', i % 3, i + 1) for i in range(20)]
+
+
+@editor_open(__file__)
+def test_global_checker_pixmap(editor):
+    panel = editor.panels.get(panels.GlobalCheckerPanel)
+    mode = get_mode(editor)
+    mode.clear_messages()
+    pixmap = panel._get_pixmap()
+    # cached until the messages change
+    assert panel._get_pixmap() is pixmap
+    mode.add_messages([modes.CheckerMessage('desc', i % 3, i)
+                       for i in range(20)])
+    assert panel._get_pixmap() is not pixmap
+    pixmap = panel._get_pixmap()
+    assert panel._get_pixmap() is pixmap
+    # an edit that keeps the block count also invalidates the pixmap
+    TextHelper(editor).insert_text('a')
+    assert panel._get_pixmap() is not pixmap
+    pixmap = panel._get_pixmap()
+    mode.clear_messages()
+    assert panel._get_pixmap() is not pixmap
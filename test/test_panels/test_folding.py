@@ -133,3 +133,65 @@ def test_enabled(editor):
 #         if TextBlockHelper.is_fold_trigger(block):
 #             assert TextBlockHelper.is_collapsed(block) is False
 #         block = block.next()
+
+
+@editor_open('test/test_api/folding_cases/foo.py')
+def test_batched_fold_visibility(editor):
+    from pyqode.core.api import FoldScope
+    panel = get_panel(editor)
+    panel.collapse_all()
+    block = editor.document().firstBlock()
+    while block.blockNumber() < editor.document().blockCount() - 1:
+        if TextBlockHelper.get_fold_lvl(block) == 0:
+            assert block.isVisible()
+        elif block.text().strip():
+            assert not block.isVisible()
+        block = block.next()
+    panel.expand_all()
+    block = editor.document().firstBlock()
+    while block.isValid():
+        assert block.isVisible()
+        assert not TextBlockHelper.is_collapsed(block)
+        block = block.next()
+    # toggling a fold only changes the visibility of its own blocks
+    trigger = editor.document().findBlockByNumber(8)
+    start, end = FoldScope(trigger).get_range()
+    panel.toggle_fold_trigger(trigger)
+    assert TextBlockHelper.is_collapsed(trigger)
+    assert trigger.isVisible()
+    assert not editor.document().findBlockByNumber(end).isVisible()
+    assert editor.document().findBlockByNumber(end + 1).isVisible()
+    panel.toggle_fold_trigger(trigger)
+    assert editor.document().findBlockByNumber(end).isVisible()
+
+
+@editor_open('test/test_api/folding_cases/foo.py')
+def test_fold_decorations_by_block(editor):
+    from pyqode.core.api import FoldScope
+    from pyqode.qt import QtGui
+    panel = get_panel(editor)
+    block = editor.document().findBlockByNumber(8)
+    panel._add_fold_decoration(block, FoldScope(block))
+    deco = panel._block_decos[8]
+    # tooltip is computed lazily
+    assert callable(deco.tooltip)
+    assert deco.tooltip() == FoldScope(block).text(max_lines=25)
+    # adding lines before the folded block must update the index
+    QtGui.QTextCursor(editor.document().firstBlock()).insertText('\n\n')
+    panel._reindex_block_decos()
+    assert panel._block_decos == {10: deco}
+    panel._clear_block_deco()
+    assert deco not in editor.decorations
+
+
+def test_fold_scrollbar_range(editor):
+    with open('test/test_api/folding_cases/foo.py', 'r') as f:
+        content = f.read()
+    editor.setPlainText(content * 10, 'text/x-python', 'utf-8')
+    panel = get_panel(editor)
+    scrollbar = editor.verticalScrollBar()
+    maximum = scrollbar.maximum()
+    panel.collapse_all()
+    assert scrollbar.maximum() < maximum
+    panel.expand_all()
+    assert scrollbar.maximum() == maximum
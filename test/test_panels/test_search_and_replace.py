@@ -1,7 +1,7 @@
 import pytest
 from pyqode.qt import QtCore, QtGui
 from pyqode.qt.QtTest import QTest
-from pyqode.core.api import TextHelper
+from pyqode.core.api import SearchResults, TextHelper
 from pyqode.core import panels
 from test.helpers import editor_open, ensure_connected
 
@@ -158,3 +158,71 @@ def test_event_filter(editor):
     editor.show()
     QTest.qWait(1000)
     assert not panel.isVisible()
+
+
+def test_replace_all_single_undo(editor):
+    panel = get_panel(editor)
+    editor.setPlainText('foo bar foo\nfoo', '', '')
+    panel._exec_search('foo', (False, True, False, False))
+    assert panel.cpt_occurences == 3
+    assert panel.replace_all('spam') == 3
+    assert editor.toPlainText() == 'spam bar spam\nspam'
+    assert panel.cpt_occurences == 0
+    editor.undo()
+    assert editor.toPlainText() == 'foo bar foo\nfoo'
+
+
+def test_replace_all_regex(editor):
+    panel = get_panel(editor)
+    editor.setPlainText('foo1 bar foo2', '', '')
+    panel._exec_search(r'foo(\d)', (True, True, False, False))
+    assert panel.replace_all(r'spam\1') == 2
+    assert editor.toPlainText() == 'spam1 bar spam2'
+    assert not editor.syntax_highlighter._suspended
+    # invalid group reference, nothing is replaced
+    panel._exec_search(r'spam(\d)', (True, True, False, False))
+    assert panel.replace_all(r'foo\2') == 0
+    assert editor.toPlainText() == 'spam1 bar spam2'
+
+
+def test_replace_all_after_edit(editor):
+    panel = get_panel(editor)
+    editor.setPlainText('foo bar foo', '', '')
+    panel._exec_search('foo', (False, True, False, False))
+    cursor = editor.textCursor()
+    cursor.setPosition(0)
+    cursor.insertText('xx')
+    # the occurrences found before the edit are out of date
+    assert panel.replace_all('spam') == 2
+    assert editor.toPlainText() == 'xxspam bar spam'
+
+
+def test_select_occurrences(editor):
+    panel = get_panel(editor)
+    editor.setPlainText('foo bar foo\nfoo', '', '')
+    panel._exec_search('foo', (False, True, False, False))
+    assert isinstance(panel.get_occurences(), SearchResults)
+    cursor = editor.textCursor()
+    cursor.setPosition(5)
+    editor.setTextCursor(cursor)
+    assert panel.select_next()
+    cursor = editor.textCursor()
+    assert (cursor.selectionStart(), cursor.selectionEnd()) == (8, 11)
+    assert panel.select_previous()
+    cursor = editor.textCursor()
+    assert (cursor.selectionStart(), cursor.selectionEnd()) == (0, 3)
+
+
+def test_replace_all_keeps_blocks(editor):
+    panel = get_panel(editor)
+    editor.setPlainText(u'\U0001F600 foo\nbar\nfoo foo', '', '')
+    marker = panels.Marker(1, description='between two occurrences')
+    editor.panels.get(panels.MarkerPanel).add_marker(marker)
+    panel._exec_search('foo', (False, True, False, False))
+    assert panel.replace_all('spam') == 3
+    assert editor.toPlainText() == u'\U0001F600 spam\nbar\nspam spam'
+    # the block between the occurrences has not been recreated
+    assert marker.block.isValid()
+    assert marker.position == 1
+    doc = editor.document()
+    assert editor.textCursor().position() == doc.characterCount() - 1
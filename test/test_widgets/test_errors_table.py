@@ -0,0 +1,49 @@
+from pyqode.core.modes import CheckerMessage, CheckerMessages
+from pyqode.core.widgets import ErrorsTable
+from pyqode.core.widgets.errors_table import COL_LINE_NBR
+from pyqode.qt import QtCore
+
+
+def messages(path, count):
+    return [CheckerMessage('desc %d' % i, i % 3, i, path=path)
+            for i in range(count)]
+
+
+def test_add_messages():
+    table = ErrorsTable()
+    table.add_messages(messages('/a.py', 1000))
+    table.add_message(CheckerMessage('desc', 0, 3, path='/b.py'))
+    assert table.rowCount() == 1001
+    msg = table.model().message(1000)
+    assert msg.path == '/b.py'
+    assert msg.description == 'desc'
+    # the original message objects are returned (and emitted)
+    msg = CheckerMessage('desc', 0, 4, path='/c.py')
+    msg.custom = 'custom attribute'
+    table.add_message(msg)
+    assert table.model().message(1001) is msg
+    activated = []
+    table.msg_activated.connect(activated.append)
+    table._on_item_activated(table.model().index(1001, 0))
+    assert activated[0] is msg
+    table.replace_file_messages('/a.py', messages('/a.py', 10))
+    assert table.rowCount() == 12
+    table.clear()
+    assert table.rowCount() == 0
+
+
+def test_sort_and_filter():
+    table = ErrorsTable()
+    table.add_messages(messages('/a.py', 30))
+    table.add_messages(messages('/b.py', 30))
+    model = table.model()
+    model.sort(COL_LINE_NBR, QtCore.Qt.DescendingOrder)
+    assert model.message(0).line == 29
+    table.set_filter(statuses=[CheckerMessages.ERROR])
+    assert table.rowCount() == 20
+    assert all(model.message(row).status == CheckerMessages.ERROR
+               for row in range(table.rowCount()))
+    table.set_filter(path='/b.py')
+    assert table.rowCount() == 30
+    table.set_filter()
+    assert table.rowCount() == 60
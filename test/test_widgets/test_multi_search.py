@@ -0,0 +1,66 @@
+import re
+import time
+
+import pytest
+
+from pyqode.core.widgets import MultiDocumentSearch, SplittableCodeEditTabWidget
+from pyqode.core.widgets import MultiDocumentSearchWidget
+from pyqode.qt import QtCore
+from pyqode.qt.QtTest import QTest
+
+
+def wait_finished(search, timeout=30):
+    start = time.time()
+    while search.running and time.time() - start < timeout:
+        QTest.qWait(100)
+    assert not search.running
+
+
+def test_multi_document_search():
+    tw = SplittableCodeEditTabWidget()
+    tw.show()
+    first = tw.create_new_document()
+    # non BMP characters count as two positions
+    first.setPlainText(u'\U0001F600 foo bar\nfoo', '', '')
+    second = tw.create_new_document()
+    second.setPlainText('bar', '', '')
+    # a clone shares the document of the original editor
+    tw.split(first, QtCore.Qt.Vertical)
+    search = MultiDocumentSearch(tw)
+    assert len(search.editors()) == 2
+    results = {}
+    search.results_available.connect(
+        lambda editor, occurrences: results.update({editor: occurrences}))
+    search.search('foo')
+    wait_finished(search)
+    assert list(results[first]) == [(3, 6), (11, 14)]
+    assert not results[second]
+    assert search.replace_all('bar', 'spam') == 2
+    assert first.toPlainText() == u'\U0001F600 foo spam\nfoo'
+    assert second.toPlainText() == 'spam'
+    # one undo step per document
+    first.undo()
+    assert first.toPlainText() == u'\U0001F600 foo bar\nfoo'
+    widget = MultiDocumentSearchWidget(tw)
+    widget.lineEditSearch.setText('bar')
+    widget._exec_search()
+    wait_finished(widget.search)
+    root = widget.treeWidget.topLevelItem(0)
+    widget._on_item_activated(root.child(0))
+    assert first.textCursor().selectedText() == 'bar'
+    tw.close()
+    del tw
+
+
+def test_multi_document_replace_all_regex():
+    tw = SplittableCodeEditTabWidget()
+    editor = tw.create_new_document()
+    editor.setPlainText('foo1 bar foo2', '', '')
+    search = MultiDocumentSearch(tw)
+    assert search.replace_all(r'foo(\d)', r'spam\1', regex=True) == 2
+    assert editor.toPlainText() == 'spam1 bar spam2'
+    with pytest.raises(re.error):
+        search.replace_all(r'spam(\d)', r'foo\2', regex=True)
+    assert editor.toPlainText() == 'spam1 bar spam2'
+    tw.close()
+    del tw